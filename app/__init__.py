@@ -25,6 +25,106 @@ limiter = Limiter(key_func=get_remote_address, storage_uri="memory://")
 # Initialize Scheduler global instance
 from flask_apscheduler import APScheduler
 scheduler = APScheduler()
+# Lock file held for the lifetime of the scheduler leader process
+_leader_lock_file = None
+
+
+def acquire_scheduler_leadership(app):
+    """
+    Elect one process (of all gunicorn workers) to run exclusive jobs such as backups.
+    The first worker to lock the file wins and holds the lock until it exits;
+    a restarted worker takes over. Without fcntl (Windows) there is only one process anyway.
+    """
+    global _leader_lock_file
+    if _leader_lock_file is not None:
+        return True
+    try:
+        import fcntl
+    except ImportError:
+        return True
+    os.makedirs(app.instance_path, exist_ok=True)
+    lock_file = open(os.path.join(app.instance_path, 'scheduler_leader.lock'), 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _leader_lock_file = lock_file
+    return True
+
+def _git_head(repo_dir):
+    """Commit id of HEAD read from .git (no subprocess), None if unavailable"""
+    git_dir = os.path.join(repo_dir, '.git')
+    try:
+        with open(os.path.join(git_dir, 'HEAD')) as f:
+            head = f.read().strip()
+        if not head.startswith('ref: '):
+            return head  # Detached
+        ref = head[5:]
+        ref_file = os.path.join(git_dir, ref)
+        if os.path.exists(ref_file):
+            with open(ref_file) as f:
+                return f.read().strip()
+        with open(os.path.join(git_dir, 'packed-refs')) as f:
+            for line in f:
+                if line.rstrip().endswith(' ' + ref):
+                    return line.split(' ', 1)[0]
+    except OSError:
+        pass
+    return None
+
+
+_version = None
+
+
+def resolve_version(app):
+    """
+    Version shown in the UI: 1.1.<commit count> in a git checkout, else version.txt.
+    `git rev-list --count` only runs when HEAD changed since the last run (cached in
+    the instance folder, shared by all workers), and once per process at most.
+    """
+    global _version
+    if _version is not None:
+        return _version
+    repo_dir = os.path.dirname(app.root_path)
+    version_file = os.path.join(repo_dir, 'version.txt')
+    cache_file = os.path.join(app.instance_path, 'version_cache')
+
+    head = _git_head(repo_dir)
+    if head:
+        try:
+            with open(cache_file) as f:
+                cached_head, cached_version = f.read().split()
+            if cached_head == head:
+                _version = cached_version
+                return _version
+        except (OSError, ValueError):
+            pass
+        try:
+            commit_count = subprocess.check_output(['git', 'rev-list', '--count', 'HEAD'],
+                                                   stderr=subprocess.STDOUT,
+                                                   cwd=app.root_path).decode('utf-8').strip()
+            _version = f"1.1.{commit_count}"
+            try:
+                with open(version_file, 'w') as f:
+                    f.write(_version)
+                os.makedirs(app.instance_path, exist_ok=True)
+                with open(cache_file, 'w') as f:
+                    f.write(f"{head} {_version}")
+            except Exception:
+                pass
+            return _version
+        except Exception:
+            pass
+
+    _version = "2.0.0"  # Default fallback
+    if os.path.exists(version_file):
+        try:
+            with open(version_file, 'r') as f:
+                _version = f.read().strip()
+        except Exception:
+            pass
+    return _version
 
 def create_app():
     app = Flask(__name__, template_folder='../templates', static_folder='../static')
@@ -46,6 +146,12 @@ def create_app():
 
     app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///l8testudy.db')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # SQLite connection pragmas (see sqlite_profile)
+    app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'wal')
+    app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'normal')
+    app.config['SQLITE_BUSY_TIMEOUT'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 15000))  # ms
+    app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    app.config['SQLITE_CACHE_SIZE_KB'] = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 32 * 1024))
     # app.root_path points to 'app/', but static is in '../static' relative to it. 
     # However, Flask's static_folder arg handles serving. We just need the absolute path to writing files.
     # Since we passed static_folder='../static', app.static_folder should be populated correctly with absolute path?
@@ -63,6 +169,24 @@ def create_app():
     
     # Ensure upload directory exists
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    # Serving uploads: flask (send_from_directory), x-accel (nginx) or x-sendfile (Apache/lighttpd)
+    app.config['UPLOAD_SERVE_MODE'] = os.environ.get('UPLOAD_SERVE_MODE', 'flask').lower()
+    app.config['UPLOAD_ACCEL_PREFIX'] = os.environ.get('UPLOAD_ACCEL_PREFIX', '/_protected_uploads/')
+    app.config['UPLOAD_CACHE_MAX_AGE'] = int(os.environ.get('UPLOAD_CACHE_MAX_AGE', 31536000))  # Upload names are never reused
+    # Flashcards: new cards a user may start per deck and day
+    app.config['NEW_CARDS_PER_DAY'] = int(os.environ.get('NEW_CARDS_PER_DAY', 20))
+    # Anki import: unpacked size of the collection (zstd packages can expand a lot)
+    app.config['ANKI_MAX_COLLECTION_SIZE'] = int(os.environ.get('ANKI_MAX_COLLECTION_SIZE', 1024 * 1024 * 1024))
+
+    # Resumable uploads (see chunked_upload)
+    app.config['CHUNKED_UPLOAD_FOLDER'] = os.environ.get('CHUNKED_UPLOAD_FOLDER', os.path.join(app.instance_path, 'chunked_uploads'))
+    app.config['CHUNKED_UPLOAD_CHUNK_SIZE'] = int(os.environ.get('CHUNKED_UPLOAD_CHUNK_SIZE', 4 * 1024 * 1024))
+    app.config['CHUNKED_UPLOAD_MAX_SIZE'] = int(os.environ.get('CHUNKED_UPLOAD_MAX_SIZE', 512 * 1024 * 1024))
+    app.config['CHUNKED_UPLOAD_QUOTA'] = int(os.environ.get('CHUNKED_UPLOAD_QUOTA', 1024 * 1024 * 1024))  # Open upload bytes per user
+    app.config['CHUNKED_UPLOAD_MAX_OPEN'] = int(os.environ.get('CHUNKED_UPLOAD_MAX_OPEN', 5))
+    if app.config['UPLOAD_SERVE_MODE'] not in ('flask', 'x-accel', 'x-sendfile'):
+        app.logger.warning(f"Unknown UPLOAD_SERVE_MODE {app.config['UPLOAD_SERVE_MODE']!r}, using flask")
+        app.config['UPLOAD_SERVE_MODE'] = 'flask'
     
     # Google Drive Configuration
     app.config['GOOGLE_CLIENT_ID'] = os.environ.get('GOOGLE_CLIENT_ID')
@@ -70,6 +194,27 @@ def create_app():
     app.config['DRIVE_ENCRYPTION_KEY'] = os.environ.get('DRIVE_ENCRYPTION_KEY')
     app.config['GOOGLE_SERVICE_ACCOUNT_INFO'] = os.environ.get('GOOGLE_SERVICE_ACCOUNT_INFO')
     app.config['GOOGLE_SERVICE_ACCOUNT_FILE'] = os.environ.get('GOOGLE_SERVICE_ACCOUNT_FILE')
+    # Drive content cache: how long cached file content is served without revalidation,
+    # and how often the Changes feed is polled to invalidate changed files early
+    app.config['DRIVE_CONTENT_FRESH_SECONDS'] = int(os.environ.get('DRIVE_CONTENT_FRESH_SECONDS', 900))
+    app.config['DRIVE_CHANGES_POLL_SECONDS'] = int(os.environ.get('DRIVE_CHANGES_POLL_SECONDS', 60))
+    # Server-side Drive thumbnails (stored content-addressed on disk)
+    app.config['DRIVE_THUMBNAIL_FOLDER'] = os.environ.get('DRIVE_THUMBNAIL_FOLDER', os.path.join(app.instance_path, 'drive_cache', 'thumbnails'))
+    app.config['DRIVE_THUMBNAIL_FORMAT'] = os.environ.get('DRIVE_THUMBNAIL_FORMAT', 'webp')
+    app.config['DRIVE_THUMBNAIL_WORKERS'] = int(os.environ.get('DRIVE_THUMBNAIL_WORKERS', 2))
+    # Scheduled backups (written by the scheduler leader in a separate low-priority process)
+    app.config['BACKUP_DIR'] = os.environ.get('BACKUP_DIR', os.path.join(app.instance_path, 'backups'))
+    app.config['BACKUP_INTERVAL_HOURS'] = float(os.environ.get('BACKUP_INTERVAL_HOURS', 24))  # 0 = disabled
+    app.config['BACKUP_RETENTION'] = int(os.environ.get('BACKUP_RETENTION', 7))
+    app.config['BACKUP_COMPRESSION'] = os.environ.get('BACKUP_COMPRESSION', 'deflate')  # deflate, zstd or store
+    app.config['BACKUP_COMPRESSION_LEVEL'] = int(os.environ.get('BACKUP_COMPRESSION_LEVEL', 6))
+    # Process pool for uploaded images (per worker)
+    app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', 2))
+    # Fork the pool in create_app(); CLI scripts and the backup child turn this off (pool starts on first upload)
+    app.config['IMAGE_POOL_PREFORK'] = os.environ.get('IMAGE_POOL_PREFORK', 'true').lower() != 'false'
+    # Responsive variants written for each image (avif is skipped if Pillow cannot encode it)
+    app.config['IMAGE_VARIANT_FORMATS'] = tuple(f.strip() for f in os.environ.get('IMAGE_VARIANT_FORMATS', 'avif,webp').split(',') if f.strip())
+    app.config['SCHEDULER_ENABLED'] = os.environ.get('SCHEDULER_ENABLED', 'true').lower() != 'false'
     
     
     # Session Configuration - Enhanced Security
@@ -85,6 +230,9 @@ def create_app():
     app.config['WTF_CSRF_SSL_STRICT'] = is_production  # Disable strict SSL check unless in prod
 
     db.init_app(app)
+    from . import sqlite_profile
+    with app.app_context():
+        sqlite_profile.configure(db.engine, app.config)
     migrate.init_app(app, db)
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login_page'
@@ -244,168 +392,25 @@ def create_app():
             return mapping.get(key, key)
         return dict(t=t)
 
-    def update_version_file():
-        version_file = os.path.join(app.root_path, '..', 'version.txt')
-        version = "2.0.0" # Default fallback
-        
-        try:
-            commit_count = subprocess.check_output(['git', 'rev-list', '--count', 'HEAD'], 
-                                                   stderr=subprocess.STDOUT,
-                                                   cwd=app.root_path).decode('utf-8').strip()
-            version = f"1.1.{commit_count}"
-            try:
-                with open(version_file, 'w') as f:
-                    f.write(version)
-            except Exception:
-                pass
-        except Exception:
-            if os.path.exists(version_file):
-                try:
-                    with open(version_file, 'r') as f:
-                        version = f.read().strip()
-                except Exception:
-                    pass
-        return version
-
-    current_version = update_version_file()
+    current_version = resolve_version(app)
 
     @app.context_processor
     def inject_version():
         return dict(version=current_version)
 
-    with app.app_context():
-        try:
-            # Create all database tables
-            db.create_all()
-            app.logger.info("Database tables created/verified successfully")
-        except Exception as e:
-            # If multiple workers try to create the tables at the same time,
-            # or if tables already exist, we can safely continue
-            app.logger.warning(f"Database initialization warning: {str(e)}")
-            # Try to continue anyway - tables might already exist
-            pass
-        
-        # Schema Update: Add chat_enabled if missing
-        try:
-            from sqlalchemy import inspect, text
-            inspector = inspect(db.engine)
-            if 'school_class' in inspector.get_table_names():
-                cols = [c['name'] for c in inspector.get_columns('school_class')]
-                if 'chat_enabled' not in cols:
-                    app.logger.info("Migrating: Adding chat_enabled to school_class")
-                    with db.engine.connect() as conn:
-                        conn.execute(text("ALTER TABLE school_class ADD COLUMN chat_enabled BOOLEAN DEFAULT 0"))
-                        conn.commit()
-        except Exception as e:
-            app.logger.error(f"Schema migration error: {e}")
-
-        # Schema Update: Add role if missing
-        try:
-            if 'user' in inspector.get_table_names():
-                cols = [c['name'] for c in inspector.get_columns('user')]
-                if 'role' not in cols:
-                    app.logger.info("Migrating: Adding role to user")
-                    with db.engine.connect() as conn:
-                        # Add column
-                        conn.execute(text("ALTER TABLE user ADD COLUMN role VARCHAR(20) DEFAULT 'student'"))
-                        # Migrate existing admins
-                        # Note: We use raw SQL because we can't be sure the boolean columns are in the model anymore,
-                        # but they should be in the DB if this is a migration.
-                        try:
-                            # Try to migrate from old columns if they exist
-                            if 'is_super_admin' in cols:
-                                conn.execute(text("UPDATE user SET role='super_admin' WHERE is_super_admin=1"))
-                            if 'is_admin' in cols:
-                                conn.execute(text("UPDATE user SET role='admin' WHERE is_admin=1 AND (is_super_admin=0 OR is_super_admin IS NULL)"))
-                        except Exception as ex:
-                            app.logger.warning(f"Could not migrate roles from old columns: {ex}")
-                        
-                        conn.commit()
-        except Exception as e:
-            app.logger.error(f"Schema migration (role) error: {e}")
-
-        # Schema Update: Comprehensive User Table Update (fix for missing columns)
-        try:
-            if 'user' in inspector.get_table_names():
-                cols = [c['name'] for c in inspector.get_columns('user')]
-                with db.engine.connect() as conn:
-                    if 'class_id' not in cols:
-                        app.logger.info("Migrating: Adding class_id to user")
-                        conn.execute(text("ALTER TABLE user ADD COLUMN class_id INTEGER REFERENCES school_class(id)"))
-                    if 'dark_mode' not in cols:
-                        app.logger.info("Migrating: Adding dark_mode to user")
-                        conn.execute(text("ALTER TABLE user ADD COLUMN dark_mode BOOLEAN DEFAULT 0"))
-                    if 'language' not in cols:
-                        app.logger.info("Migrating: Adding language to user")
-                        conn.execute(text("ALTER TABLE user ADD COLUMN language VARCHAR(5) DEFAULT 'de'"))
-                    if 'needs_password_change' not in cols:
-                        app.logger.info("Migrating: Adding needs_password_change to user")
-                        conn.execute(text("ALTER TABLE user ADD COLUMN needs_password_change BOOLEAN DEFAULT 1"))
-                    if 'has_seen_tutorial' not in cols:
-                        app.logger.info("Migrating: Adding has_seen_tutorial to user")
-                        conn.execute(text("ALTER TABLE user ADD COLUMN has_seen_tutorial BOOLEAN DEFAULT 0"))
-                    if 'has_accepted_privacy' not in cols:
-                        app.logger.info("Migrating: Adding has_accepted_privacy to user")
-                        conn.execute(text("ALTER TABLE user ADD COLUMN has_accepted_privacy BOOLEAN DEFAULT 0"))
-                    if 'theme' not in cols:
-                        app.logger.info("Migrating: Adding theme to user")
-                        conn.execute(text("ALTER TABLE user ADD COLUMN theme VARCHAR(32) DEFAULT 'standard'"))
-                    conn.commit()
-        except Exception as e:
-            app.logger.error(f"User schema migration error: {e}")
-
-        # Schema Update: Add parent_id to task_message if missing
-        try:
-            if 'task_message' in inspector.get_table_names():
-                cols = [c['name'] for c in inspector.get_columns('task_message')]
-                if 'parent_id' not in cols:
-                    app.logger.info("Migrating: Adding parent_id to task_message")
-                    with db.engine.connect() as conn:
-                        conn.execute(text("ALTER TABLE task_message ADD COLUMN parent_id INTEGER REFERENCES task_message(id)"))
-                        conn.commit()
-        except Exception as e:
-            app.logger.error(f"Schema migration (parent_id) error: {e}")
-
-        # Schema Update: Add notify_chat_message to notification_setting if missing
-        try:
-            if 'notification_setting' in inspector.get_table_names():
-                cols = [c['name'] for c in inspector.get_columns('notification_setting')]
-                if 'notify_chat_message' not in cols:
-                    app.logger.info("Migrating: Adding notify_chat_message to notification_setting")
-                    with db.engine.connect() as conn:
-                        conn.execute(text("ALTER TABLE notification_setting ADD COLUMN notify_chat_message BOOLEAN DEFAULT 1"))
-                        conn.commit()
-        except Exception as e:
-            app.logger.error(f"Schema migration (notify_chat_message) error: {e}")
-
-        # Schema Update: Fix DriveFolder table (add missing columns)
-        try:
-            if 'drive_folder' in inspector.get_table_names():
-                cols = [c['name'] for c in inspector.get_columns('drive_folder')]
-                with db.engine.connect() as conn:
-                    if 'class_id' not in cols:
-                        app.logger.info("Migrating: Adding class_id to drive_folder")
-                        conn.execute(text("ALTER TABLE drive_folder ADD COLUMN class_id INTEGER REFERENCES school_class(id)"))
-                    if 'folder_id' not in cols:
-                         # folder_id might be needed if re-creating
-                         app.logger.info("Migrating: Adding folder_id to drive_folder")
-                         conn.execute(text("ALTER TABLE drive_folder ADD COLUMN folder_id VARCHAR(256)"))
-                    if 'file_count' not in cols:
-                        app.logger.info("Migrating: Adding file_count to drive_folder")
-                        conn.execute(text("ALTER TABLE drive_folder ADD COLUMN file_count INTEGER DEFAULT 0"))
-                    if 'is_active' not in cols:
-                        app.logger.info("Migrating: Adding is_active to drive_folder")
-                        conn.execute(text("ALTER TABLE drive_folder ADD COLUMN is_active BOOLEAN DEFAULT 1"))
-                    if 'include_subfolders' not in cols:
-                        app.logger.info("Migrating: Adding include_subfolders to drive_folder")
-                        conn.execute(text("ALTER TABLE drive_folder ADD COLUMN include_subfolders BOOLEAN DEFAULT 1"))
-                    if 'created_by_user_id' not in cols:
-                        app.logger.info("Migrating: Adding created_by_user_id to drive_folder")
-                        conn.execute(text("ALTER TABLE drive_folder ADD COLUMN created_by_user_id INTEGER REFERENCES user(id)"))
-                    conn.commit()
-        except Exception as e:
-            app.logger.error(f"DriveFolder schema migration error: {e}")
+    # Schema: one query when the database is at the current revision, otherwise
+    # create or upgrade it (see schema.py; migrations/versions holds the revisions)
+    from . import schema
+    try:
+        if schema.ensure_schema(app):
+            app.logger.info(f"Database schema migrated to {schema.SCHEMA_REVISION}")
+    except Exception as e:
+        app.logger.error(f"Schema migration error: {e}")
 
+    # Image pool processes are forked now, while this is the only thread
+    if app.config['IMAGE_POOL_PREFORK']:
+        from . import image_queue
+        image_queue.start_pool(app)
 
     # Initialize Scheduler
     scheduler.init_app(app)
@@ -423,8 +428,42 @@ def create_app():
                 # Cache structure and file contents (up to 20MB per file)
                 client.warmup_cache(depth=3, warmup_content=True)
 
+    def run_drive_changes_sync():
+        with app.app_context():
+            client = DriveOAuthClient()
+            if client.is_authenticated():
+                client.sync_changes()
+
+    def run_image_requeue():
+        with app.app_context():
+            from app.image_queue import requeue_stale_images
+            requeue_stale_images()
+
+    def run_upload_gc():
+        with app.app_context():
+            from app.upload_store import collect_garbage
+            removed, stray = collect_garbage()
+            app.logger.info(f"Upload GC: {removed} unreferenced blob(s), {stray} stray file(s) removed")
+
+    def run_chunked_upload_cleanup():
+        with app.app_context():
+            from app.chunked_upload import cleanup_stale_uploads
+            cleanup_stale_uploads()
+
+    def run_fsrs_optimize():
+        with app.app_context():
+            from app.fsrs import optimize_due_users
+            refitted = optimize_due_users()
+            if refitted:
+                app.logger.info(f"FSRS: refitted weights of {refitted} user(s)")
+
+    def run_scheduled_backup():
+        from app.backup_job import spawn_backup_process
+        spawn_backup_process(app)
+
     # In Gunicorn/Docker, we want it to run. In dev with reloader, only in the main process.
-    if not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true' or os.environ.get('GUNICORN_VERSION'):
+    # Helper processes (e.g. the backup process) disable it via SCHEDULER_ENABLED=false.
+    if app.config['SCHEDULER_ENABLED'] and (not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true' or os.environ.get('GUNICORN_VERSION')):
         try:
             if not scheduler.get_job('check_reminders'):
                 scheduler.add_job(id='check_reminders', func=check_reminders, trigger='interval', seconds=45)
@@ -437,6 +476,11 @@ def create_app():
             if not scheduler.get_job('drive_periodic_warmup'):
                 scheduler.add_job(id='drive_periodic_warmup', func=run_drive_warmup, trigger='interval', hours=2)
             
+            # Drive Changes feed (invalidates cached content of changed files)
+            if not scheduler.get_job('drive_changes_sync'):
+                scheduler.add_job(id='drive_changes_sync', func=run_drive_changes_sync, trigger='interval',
+                                  seconds=app.config['DRIVE_CHANGES_POLL_SECONDS'])
+            
             # Untis Cache Jobs
             if not scheduler.get_job('untis_cache_update'):
                 scheduler.add_job(id='untis_cache_update', func=update_untis_cache_job, args=[app], 
@@ -446,6 +490,24 @@ def create_app():
             scheduler.add_job(id='untis_initial_fetch', func=update_untis_cache_job, args=[app], 
                               trigger='date', run_date=datetime.now() + timedelta(seconds=15))
             
+            # Exclusive jobs only run in one worker (the scheduler leader)
+            if acquire_scheduler_leadership(app):
+                if app.config['BACKUP_INTERVAL_HOURS'] > 0 and not scheduler.get_job('scheduled_backup'):
+                    scheduler.add_job(id='scheduled_backup', func=run_scheduled_backup, trigger='interval',
+                                      hours=app.config['BACKUP_INTERVAL_HOURS'])
+                # Image jobs lost by a worker restart
+                if not scheduler.get_job('image_requeue'):
+                    scheduler.add_job(id='image_requeue', func=run_image_requeue, trigger='interval', minutes=5)
+                # Unreferenced content-addressed uploads
+                if not scheduler.get_job('upload_gc'):
+                    scheduler.add_job(id='upload_gc', func=run_upload_gc, trigger='interval', hours=24)
+                # Unfinished chunked uploads
+                if not scheduler.get_job('chunked_upload_cleanup'):
+                    scheduler.add_job(id='chunked_upload_cleanup', func=run_chunked_upload_cleanup, trigger='interval', hours=1)
+                # Personal FSRS weights of users with many new reviews
+                if not scheduler.get_job('fsrs_optimize'):
+                    scheduler.add_job(id='fsrs_optimize', func=run_fsrs_optimize, trigger='interval', days=7)
+            
             if not scheduler.running:
                 scheduler.start()
                 import atexit
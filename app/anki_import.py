@@ -0,0 +1,408 @@
+"""
+Anki Import
+Imports Anki packages (.apkg) into a new deck:
+
+- collection.anki21b (zstd compressed, Anki 2.1.50+), collection.anki21 and
+  legacy collection.anki2, newest first (newer exports also contain a dummy
+  anki2 collection that must not be imported)
+- one card per note from the first two fields, HTML reduced to text, clozes
+  turned into question and answer
+- the first image of the front goes through the content-addressed upload
+  store (deduplicated, media listed in the legacy JSON or the newer protobuf
+  media map)
+- scheduling state of the importing user: interval, ease, due date, FSRS memory
+  state where Anki has one, and the review history (revlog) for the optimizer
+
+The collection is streamed to a temp file and read in batches, cards and
+reviews are inserted with Core executemany, so memory stays flat for large decks.
+"""
+import os
+import re
+import html
+import json
+import shutil
+import sqlite3
+import zipfile
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta
+from .models import db, Deck, Flashcard, CardReview, ReviewLog
+from . import upload_store, decks
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COLLECTIONS = ('collection.anki21b', 'collection.anki21', 'collection.anki2')
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+MAX_MEDIA_SIZE = 20 * 1024 * 1024
+MAX_COLLECTION_SIZE = 1024 * 1024 * 1024  # Unpacked, the app passes ANKI_MAX_COLLECTION_SIZE
+BATCH_SIZE = 1000
+QUALITY_FROM_EASE = {1: 1, 2: 2, 3: 4, 4: 5}  # Anki answer button -> SM-2 quality (like the study UI)
+
+_IMG_RE = re.compile(r'<img[^>]*?\ssrc\s*=\s*["\']?([^"\'>]+)', re.IGNORECASE)
+_SOUND_RE = re.compile(r'\[sound:[^\]]*\]')
+_BREAK_RE = re.compile(r'<br\s*/?>|</(?:div|p|li|tr|h\d)>', re.IGNORECASE)
+_TAG_RE = re.compile(r'<[^>]+>')
+_CLOZE_RE = re.compile(r'\{\{c\d+::(.*?)(?:::(.*?))?\}\}', re.DOTALL)
+
+
+class AnkiImportError(Exception):
+    pass
+
+
+class _TooLarge(AnkiImportError):
+    pass
+
+
+class ImportResult:
+    def __init__(self, deck_id):
+        self.deck_id = deck_id
+        self.cards = 0
+        self.reviews = 0
+        self.media = 0
+
+
+def field_text(value):
+    """Anki field HTML -> plain text (the study view shows text)"""
+    value = _SOUND_RE.sub('', value)
+    value = _BREAK_RE.sub('\n', value)
+    value = html.unescape(_TAG_RE.sub('', value)).replace('\xa0', ' ')
+    lines = [line.strip() for line in value.split('\n')]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+
+def card_sides(fields):
+    """(front, back, front html) of a note, clozes become '[...]' (or their hint) and the answer"""
+    front_html = fields[0]
+    back_html = fields[1] if len(fields) > 1 else ''
+    if _CLOZE_RE.search(front_html):
+        question = _CLOZE_RE.sub(lambda m: f"[{m.group(2) or '...'}]", front_html)
+        answer = _CLOZE_RE.sub(lambda m: m.group(1), front_html)
+        extra = field_text(back_html)
+        return field_text(question), field_text(answer) + (f"\n\n{extra}" if extra else ''), front_html
+    return field_text(front_html), field_text(back_html), front_html
+
+
+def _decompress_to(src, dst):
+    if zstandard is None:
+        raise AnkiImportError('This Anki package needs the zstandard module on the server')
+    zstandard.ZstdDecompressor().copy_stream(src, dst)
+
+
+class _LimitedWriter:
+    """File wrapper that fails once more than max_size bytes were written"""
+
+    def __init__(self, f, max_size):
+        self.f = f
+        self.max_size = max_size
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        if self.written > self.max_size:
+            raise _TooLarge(f'Anki package too large (more than {self.max_size // (1024 * 1024)} MB unpacked)')
+        return self.f.write(data)
+
+
+def _extract(z, name, target, max_size):
+    """
+    Copy a zip member to target, decompressing zstd members; bounded memory.
+    Neither the zip header nor the zstd frame size can be trusted, so the bytes
+    written are counted against max_size.
+    """
+    with z.open(name) as src:
+        head = src.read(4)
+        with open(target, 'wb') as f:
+            dst = _LimitedWriter(f, max_size)
+            if head == ZSTD_MAGIC:
+                with z.open(name) as again:
+                    _decompress_to(again, dst)
+            else:
+                dst.write(head)
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+
+
+def _varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _protobuf_fields(data):
+    """(field number, value) pairs of a protobuf message (varint and length-delimited only)"""
+    pos = 0
+    while pos < len(data):
+        key, pos = _varint(data, pos)
+        field, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = _varint(data, pos)
+        elif wire == 2:
+            length, pos = _varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        else:
+            raise AnkiImportError('Unsupported media map')
+        yield field, value
+
+
+def read_media_map(z):
+    """{ media filename: zip member } from the legacy JSON map or the protobuf MediaEntries"""
+    if 'media' not in z.namelist():
+        return {}
+    with z.open('media') as f:
+        data = f.read(16 * 1024 * 1024)
+    if data.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise AnkiImportError('This Anki package needs the zstandard module on the server')
+        data = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+        media = {}
+        index = 0
+        for field, entry in _protobuf_fields(data):
+            if field != 1:
+                continue
+            name, member = None, str(index)
+            for entry_field, value in _protobuf_fields(entry):
+                if entry_field == 1:
+                    name = value.decode('utf-8')
+                elif entry_field == 255:
+                    member = str(value)
+            if name:
+                media[name] = member
+            index += 1
+        return media
+    try:
+        return {name: member for member, name in json.loads(data.decode('utf-8') or '{}').items()}
+    except ValueError:
+        return {}
+
+
+class MediaImporter:
+    """Stores referenced images once per package and content"""
+
+    def __init__(self, z, tmp_dir):
+        self.z = z
+        self.tmp_dir = tmp_dir
+        self.media = read_media_map(z)
+        self.members = set(z.namelist())
+        self.stored = {}  # media filename -> image URL or None
+        self.references = Counter()
+
+    def image_url(self, field_html):
+        match = _IMG_RE.search(field_html)
+        if not match:
+            return None
+        name = html.unescape(match.group(1)).strip()
+        if name not in self.stored:
+            self.stored[name] = self._store(name)
+        url = self.stored[name]
+        if url:
+            self.references[upload_store.upload_name(url)] += 1
+        return url
+
+    def _store(self, name):
+        ext = upload_store.normalize_ext(name)
+        member = self.media.get(name)
+        if ext not in IMAGE_EXTENSIONS or member not in self.members:
+            return None
+        if self.z.getinfo(member).file_size > MAX_MEDIA_SIZE:
+            return None
+        path = os.path.join(self.tmp_dir, f"media{len(self.stored)}{ext}")
+        try:
+            _extract(self.z, member, path, MAX_MEDIA_SIZE)
+        except _TooLarge:
+            return None
+        key, _ = upload_store.store_file(path, ext)
+        return f"{upload_store.URL_PREFIX}{key}"
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _has_table(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone() is not None
+
+
+def _memory_state(data):
+    """FSRS stability/difficulty from cards.data (Anki 23.10+), if any"""
+    if not data:
+        return None, None
+    try:
+        state = json.loads(data)
+        return state.get('s'), state.get('d')
+    except (ValueError, AttributeError):
+        return None, None
+
+
+def _review_state(row, collection_start, first_review, now):
+    """CardReview values for an Anki card that has been studied, None for new cards"""
+    card_type, queue, due, ivl, factor, reps, data = row
+    if card_type not in (1, 2, 3) or not reps:
+        return None
+    ease = factor / 1000 if factor else 2.5
+    if card_type == 2:
+        next_review = collection_start + timedelta(days=due)
+        interval = max(ivl, 1)
+        last_review = next_review - timedelta(days=interval)
+        review_count = reps
+    else:
+        # (Re)learning: due is a timestamp (or a day number for steps longer than a day)
+        next_review = datetime.utcfromtimestamp(due) if due > 1_000_000_000 else collection_start + timedelta(days=due)
+        interval = 0
+        last_review = min(next_review, now)
+        review_count = 0
+    stability, difficulty = _memory_state(data)
+    return {
+        'next_review_at': next_review,
+        'last_review_at': last_review,
+        'interval': float(interval),
+        'ease_factor': max(ease, 1.3),
+        'review_count': review_count,
+        'created_at': first_review or last_review,
+        'stability': stability,
+        'difficulty': difficulty
+    }
+
+
+def _insert_cards(batch, result, user_id, card_ids, collection_start, first_reviews, now):
+    table = Flashcard.__table__
+    ids = db.session.execute(
+        table.insert().returning(table.c.id, sort_by_parameter_order=True),
+        [card for card, _, _ in batch]
+    ).scalars().all()
+    reviews = []
+    for flashcard_id, (_, anki_card_id, state_row) in zip(ids, batch):
+        if anki_card_id is None:
+            continue
+        card_ids[anki_card_id] = flashcard_id
+        state = _review_state(state_row, collection_start, first_reviews.get(anki_card_id), now)
+        if state:
+            reviews.append(dict(state, user_id=user_id, card_id=flashcard_id))
+    if reviews:
+        db.session.execute(CardReview.__table__.insert(), reviews)
+        result.reviews += len(reviews)
+    result.cards += len(batch)
+
+
+def _import_revlog(conn, user_id, card_ids):
+    """Review history of the imported cards -> ReviewLog"""
+    if not _has_table(conn, 'revlog'):
+        return
+    cursor = conn.execute("SELECT cid, id, ease, lastIvl, type FROM revlog ORDER BY cid, id")
+    previous = {}
+    batch = []
+    while True:
+        rows = cursor.fetchmany(BATCH_SIZE)
+        if not rows:
+            break
+        for anki_card_id, timestamp, ease, last_ivl, review_type in rows:
+            card_id = card_ids.get(anki_card_id)
+            # Type 4 is a manual reschedule, ease 0 no answer
+            if card_id is None or review_type == 4 or ease not in QUALITY_FROM_EASE:
+                continue
+            reviewed_at = datetime.utcfromtimestamp(timestamp / 1000)
+            last = previous.get(card_id)
+            batch.append({
+                'user_id': user_id,
+                'card_id': card_id,
+                'rating': QUALITY_FROM_EASE[ease],
+                'reviewed_at': reviewed_at,
+                'elapsed_days': (reviewed_at - last).total_seconds() / 86400 if last else None,
+                'last_interval': float(max(last_ivl or 0, 0)),  # Negative: seconds (learning step)
+                'scheduler': 'anki'
+            })
+            previous[card_id] = reviewed_at
+        if batch:
+            db.session.execute(ReviewLog.__table__.insert(), batch)
+            batch = []
+
+
+def import_apkg(stream, user_id, title, description=None, max_size=MAX_COLLECTION_SIZE):
+    """
+    Import a package into a new deck of the user; not committed. Returns an ImportResult.
+    max_size: limit of the unpacked collection in bytes.
+    """
+    try:
+        z = zipfile.ZipFile(stream)
+    except zipfile.BadZipFile:
+        raise AnkiImportError('Not a valid Anki package')
+
+    with z, tempfile.TemporaryDirectory() as tmp_dir:
+        names = set(z.namelist())
+        collection = next((name for name in COLLECTIONS if name in names), None)
+        if collection is None:
+            raise AnkiImportError('No Anki collection found in the package')
+        db_path = os.path.join(tmp_dir, 'collection.db')
+        _extract(z, collection, db_path, max_size)
+
+        conn = sqlite3.connect(db_path)
+        try:
+            return _import_collection(conn, z, tmp_dir, user_id, title, description)
+        except sqlite3.DatabaseError as e:
+            raise AnkiImportError(f'Unreadable Anki collection: {e}')
+        finally:
+            conn.close()
+
+
+def _import_collection(conn, z, tmp_dir, user_id, title, description):
+    media = MediaImporter(z, tmp_dir)
+    now = datetime.utcnow()
+    crt = conn.execute("SELECT crt FROM col").fetchone()
+    collection_start = datetime.utcfromtimestamp(crt[0]) if crt and crt[0] else now
+    data_column = 'c.data' if 'data' in _columns(conn, 'cards') else 'NULL'
+    first_reviews = {}
+    if _has_table(conn, 'revlog'):
+        first_reviews = {
+            cid: datetime.utcfromtimestamp(ms / 1000)
+            for cid, ms in conn.execute("SELECT cid, MIN(id) FROM revlog GROUP BY cid")
+        }
+
+    deck = Deck(title=title, user_id=user_id, description=description)
+    db.session.add(deck)
+    db.session.flush()
+    result = ImportResult(deck.id)
+
+    # First card (template) of every note carries the scheduling state
+    cursor = conn.execute(f"""
+        SELECT n.flds, c.id, c.type, c.queue, c.due, c.ivl, c.factor, c.reps, {data_column}
+        FROM notes n
+        LEFT JOIN cards c ON c.id = (SELECT id FROM cards WHERE nid = n.id ORDER BY ord LIMIT 1)
+        ORDER BY n.id
+    """)
+    card_ids = {}  # Anki card id -> flashcard id
+    while True:
+        rows = cursor.fetchmany(BATCH_SIZE)
+        if not rows:
+            break
+        batch = []
+        for flds, anki_card_id, *state_row in rows:
+            front, back, front_html = card_sides(flds.split('\x1f'))
+            image_url = media.image_url(front_html)
+            if not (front or image_url) or not back:
+                continue
+            batch.append(({
+                'deck_id': deck.id,
+                'front': front or '[Bild]',
+                'back': back,
+                'image_url': image_url,
+                'created_at': now
+            }, anki_card_id, state_row))
+        if batch:
+            _insert_cards(batch, result, user_id, card_ids, collection_start, first_reviews, now)
+
+    if not result.cards:
+        raise AnkiImportError('No cards found in file')
+
+    _import_revlog(conn, user_id, card_ids)
+    # Bulk inserts bypass the session listeners of the card count and the upload references
+    decks.refresh_card_counts([deck.id])
+    upload_store.adjust_references(db.session.connection(), media.references)
+    result.media = sum(1 for url in media.stored.values() if url)
+    return result
@@ -0,0 +1,637 @@
+"""
+Streaming Backup Export
+Writes the database as per-table NDJSON plus all uploads into a ZIP stream.
+Rows are fetched in yield_per batches and the archive is produced chunk by chunk,
+so memory use stays constant regardless of database and upload size.
+Restore streams the NDJSON back in with batched Core executemany inserts,
+converting values by column type.
+
+Incremental backups (changes since the last backup) and differential backups
+(changes since the last full backup) use the ChangeLog journal written by the
+session listeners below, and the upload hash map of the base backup's manifest.
+Upload reference counts change outside the journal (upload_store.adjust_references),
+so every restore recounts them from the restored rows.
+
+Archive layout (format 3.0):
+    database/<table_key>.ndjson   one JSON object per row (changed rows only in incremental backups)
+    uploads/<relative path>       files from UPLOAD_FOLDER (new or changed only in incremental backups)
+    manifest.json                 backup id/type/parent, revision mark, row counts,
+                                  deleted keys, hash map of all uploads (written last)
+"""
+import os
+import io
+import json
+import zlib
+import shutil
+import zipfile
+import hashlib
+import itertools
+import threading
+import uuid
+import tempfile
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date
+import sqlalchemy as sa
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from .models import (
+    db, User, Task, TaskImage, Event, Grade, NotificationSetting,
+    PushSubscription, Subject, TaskMessage, TaskChatRead,
+    GlobalSetting, SchoolClass, TaskCompletion, DriveOAuthToken,
+    SubjectTeacher, UntisCredential, DriveFolder, DriveFile,
+    DriveFileContent, BlackboardItem, AuditLog, MealPlan, subject_classes,
+    ChangeLog, BackupRecord, UploadBlob, GradeSummary
+)
+from . import upload_store
+
+BACKUP_FORMAT_VERSION = '3.0'
+BATCH_SIZE = 1000  # Rows per yield_per batch
+COPY_CHUNK_SIZE = 1024 * 1024  # Bytes per upload read
+RESTORE_BATCH_SIZE = 5000  # Rows per executemany during restore
+RESTORE_WORKERS = 4  # Threads extracting uploads during restore
+# Uploads in these formats are already compressed and always stored as-is
+PRECOMPRESSED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.avif', '.gif', '.zip', '.gz', '.zst', '.mp4', '.mp3'}
+
+# Backup tables in restore order (parents before children).
+# Keys match the sections of the legacy database.json format.
+BACKUP_TABLES = [
+    ('school_classes', SchoolClass.__table__),
+    ('users', User.__table__),
+    ('subjects', Subject.__table__),
+    ('global_settings', GlobalSetting.__table__),
+    ('subject_classes', subject_classes),
+    ('tasks', Task.__table__),
+    ('task_images', TaskImage.__table__),
+    ('task_completions', TaskCompletion.__table__),
+    ('events', Event.__table__),
+    ('grades', Grade.__table__),
+    ('notification_settings', NotificationSetting.__table__),
+    ('push_subscriptions', PushSubscription.__table__),
+    ('task_messages', TaskMessage.__table__),
+    ('task_chat_reads', TaskChatRead.__table__),
+    ('blackboard_items', BlackboardItem.__table__),
+    ('audit_logs', AuditLog.__table__),
+    ('meal_plans', MealPlan.__table__),
+    ('subject_teachers', SubjectTeacher.__table__),
+    ('untis_credentials', UntisCredential.__table__),
+    ('drive_oauth_tokens', DriveOAuthToken.__table__),
+    ('drive_folders', DriveFolder.__table__),
+    ('drive_files', DriveFile.__table__),
+    ('drive_file_contents', DriveFileContent.__table__),
+    ('upload_blobs', UploadBlob.__table__),
+]
+
+# Tables with row-level change tracking ({ table name: backup key }).
+# subject_classes has no single primary key and is always contained completely.
+TRACKED_TABLES = {table.name: key for key, table in BACKUP_TABLES if 'id' in table.c}
+
+
+def journal_rows(connection, table_name, pks, changed_at=None):
+    """Journal rows written on the connection directly (such statements bypass both listeners below)"""
+    changed_at = changed_at or datetime.utcnow()
+    connection.execute(ChangeLog.__table__.insert(), [
+        {'table_name': table_name, 'row_pk': pk, 'changed_at': changed_at} for pk in pks
+    ])
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_row_changes(session, flush_context):
+    """Journal ORM inserts, updates and deletes of tracked tables (same transaction as the change)"""
+    now = datetime.utcnow()
+    entries = []
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        table = getattr(obj, '__table__', None)
+        if table is None or table.name not in TRACKED_TABLES:
+            continue
+        if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+            continue
+        if obj.id is not None:
+            entries.append({'table_name': table.name, 'row_pk': obj.id, 'changed_at': now})
+    if entries:
+        session.connection().execute(ChangeLog.__table__.insert(), entries)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _record_bulk_changes(orm_execute_state):
+    """Bulk statements (Query.delete(), Core inserts) touch unknown rows: mark the whole table"""
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if table is None or getattr(table, 'name', None) not in TRACKED_TABLES:
+        return
+    orm_execute_state.session.connection().execute(
+        ChangeLog.__table__.insert(),
+        {'table_name': table.name, 'row_pk': None, 'changed_at': datetime.utcnow()}
+    )
+
+
+class _ZipSink(io.RawIOBase):
+    """Write-only, non-seekable sink. ZipFile writes into it, the generator drains it."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _json_default(val):
+    if isinstance(val, (datetime, date)):
+        return val.isoformat()
+    raise TypeError(f"Not JSON serializable: {type(val)}")
+
+
+def iter_table_rows(table, batch_size=BATCH_SIZE):
+    """Yield rows of a table as dicts, fetched in batches"""
+    result = db.session.execute(table.select().execution_options(yield_per=batch_size))
+    columns = list(result.keys())
+    for row in result:
+        yield dict(zip(columns, row))
+
+
+@contextmanager
+def open_backup_zip(source, name=None):
+    """
+    ZipFile of a backup archive, source a path or file object. An archive whose name
+    (default: the path) ends in .zst was written with BACKUP_COMPRESSION=zstd; it is
+    decompressed to a temporary file first, since ZipFile has to seek.
+    """
+    name = (name if name is not None else source).lower()
+    if not name.endswith('.zst'):
+        with zipfile.ZipFile(source) as zf:
+            yield zf
+        return
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError('zstd compressed backups need the zstandard package')
+    tmp_dir = os.path.dirname(os.path.abspath(source)) if isinstance(source, str) else None
+    with tempfile.TemporaryFile(dir=tmp_dir) as tmp:
+        with (open(source, 'rb') if isinstance(source, str) else nullcontext(source)) as f:
+            zstandard.ZstdDecompressor().copy_stream(f, tmp)
+        tmp.seek(0)
+        with zipfile.ZipFile(tmp) as zf:
+            yield zf
+
+
+def iter_upload_files(upload_folder):
+    """Yield (absolute path, archive name) for every file in the upload folder"""
+    if not upload_folder or not os.path.exists(upload_folder):
+        return
+    for root, dirs, files in os.walk(upload_folder):
+        for file in files:
+            abs_path = os.path.join(root, file)
+            rel_path = os.path.relpath(abs_path, upload_folder)
+            yield abs_path, os.path.join('uploads', rel_path).replace(os.sep, '/')
+
+
+def _changed_rows(since_revision):
+    """
+    Collect changes after a revision mark from the ChangeLog.
+    Returns { table_name: set of primary keys } and the set of tables changed in bulk.
+    """
+    changed = {}
+    bulk = set()
+    result = db.session.execute(
+        sa.select(ChangeLog.table_name, ChangeLog.row_pk)
+        .where(ChangeLog.id > since_revision)
+        .distinct()
+    )
+    for table_name, row_pk in result:
+        if row_pk is None:
+            bulk.add(table_name)
+        else:
+            changed.setdefault(table_name, set()).add(row_pk)
+    return changed, bulk
+
+
+def _iter_rows_by_pk(table, pks, chunk_size=500):
+    """Yield the existing rows of a table for the given primary keys (chunked IN queries)"""
+    pk_col = table.c.id
+    pks = sorted(pks)
+    for i in range(0, len(pks), chunk_size):
+        result = db.session.execute(table.select().where(pk_col.in_(pks[i:i + chunk_size])))
+        columns = list(result.keys())
+        for row in result:
+            yield dict(zip(columns, row))
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_backup_base(mode):
+    """BackupRecord a new backup of this mode builds on (None = full backup needed)"""
+    if mode == 'incremental':
+        return BackupRecord.query.order_by(BackupRecord.id.desc()).first()
+    if mode == 'differential':
+        return BackupRecord.query.filter_by(kind='full').order_by(BackupRecord.id.desc()).first()
+    return None
+
+
+def iter_backup_zip(upload_folder=None, compression=zipfile.ZIP_DEFLATED, compresslevel=None, mode='full',
+                    record=True):
+    """
+    Generator producing a backup ZIP as a stream of byte chunks.
+    mode: 'full', 'incremental' (changes since the last backup) or
+    'differential' (changes since the last full backup). Without a base, a full backup is produced.
+    With record, the backup is recorded as BackupRecord once the archive is complete and
+    later backups build on it. Scheduled backups (backup_job) stay on the server and are
+    not recorded: the downloaded chain must not depend on them.
+    Must run inside an app context (use stream_with_context for responses).
+    """
+    if upload_folder is None:
+        upload_folder = current_app.config.get('UPLOAD_FOLDER')
+
+    base = find_backup_base(mode)
+    if base is None:
+        mode = 'full'
+    base_manifest = json.loads(base.manifest) if base is not None else {}
+    base_uploads = base_manifest.get('uploads', {})
+
+    # Revision mark taken before reading rows: later changes go into the next backup
+    revision = db.session.query(sa.func.max(ChangeLog.id)).scalar() or 0
+    if mode != 'full':
+        changed, bulk = _changed_rows(base.revision)
+
+    sink = _ZipSink()
+    manifest = {
+        'version': BACKUP_FORMAT_VERSION,
+        'format': 'ndjson',
+        'backup_id': str(uuid.uuid4()),
+        'type': mode,
+        'parent_id': base.backup_id if base is not None else None,
+        'revision': revision,
+        'timestamp': datetime.utcnow().isoformat(),
+        'tables': {},
+        'replace_tables': [],  # Tables contained completely (restore replaces them)
+        'deleted': {},  # { table_key: [primary keys] }
+        'uploads': {}  # { path: [size, mtime, sha256] } of ALL current files
+    }
+
+    with zipfile.ZipFile(sink, 'w', compression=compression, compresslevel=compresslevel) as zf:
+        # 1. Database, one NDJSON member per table
+        for key, table in BACKUP_TABLES:
+            if mode == 'full' or table.name in bulk or table.name not in TRACKED_TABLES:
+                rows = iter_table_rows(table)
+                manifest['replace_tables'].append(key)
+            else:
+                pks = changed.get(table.name, set())
+                rows = _iter_rows_by_pk(table, pks)
+
+            count = 0
+            found = set()
+            with zf.open(f'database/{key}.ndjson', 'w', force_zip64=True) as dest:
+                lines = []
+                for row in rows:
+                    lines.append(json.dumps(row, default=_json_default))
+                    count += 1
+                    if key not in manifest['replace_tables']:
+                        found.add(row['id'])
+                    if len(lines) >= BATCH_SIZE:
+                        dest.write(('\n'.join(lines) + '\n').encode('utf-8'))
+                        lines = []
+                        yield sink.drain()
+                if lines:
+                    dest.write(('\n'.join(lines) + '\n').encode('utf-8'))
+            manifest['tables'][key] = count
+            if key not in manifest['replace_tables']:
+                # Changed rows that no longer exist were deleted
+                deleted = sorted(changed.get(table.name, set()) - found)
+                if deleted:
+                    manifest['deleted'][key] = deleted
+            yield sink.drain()
+
+        # 2. Uploaded files: all in a full backup, only new or changed ones otherwise
+        for abs_path, arcname in iter_upload_files(upload_folder):
+            rel_path = arcname[8:]
+            stat = os.stat(abs_path)
+            known = base_uploads.get(rel_path)
+            if known and known[0] == stat.st_size and known[1] == int(stat.st_mtime):
+                sha256 = known[2]  # Unchanged size and mtime, no need to hash again
+            else:
+                sha256 = _file_sha256(abs_path)
+            manifest['uploads'][rel_path] = [stat.st_size, int(stat.st_mtime), sha256]
+            if mode != 'full' and known and known[2] == sha256:
+                continue
+
+            info = zipfile.ZipInfo.from_file(abs_path, arcname)
+            if os.path.splitext(abs_path)[1].lower() in PRECOMPRESSED_EXTENSIONS:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = compression
+                info._compresslevel = compresslevel
+            with open(abs_path, 'rb') as src, zf.open(info, 'w', force_zip64=True) as dest:
+                while True:
+                    chunk = src.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+
+        # 3. Manifest last: it contains the final row counts
+        zf.writestr('manifest.json', json.dumps(manifest, indent=4))
+
+    # Central directory is written on close
+    yield sink.drain()
+
+    if record:
+        record_backup(manifest)
+    elif manifest['type'] == 'full' and BackupRecord.query.first() is None:
+        # No chain to continue yet: the journal is only read for backups with a base
+        _prune_journal(manifest['revision'])
+        db.session.commit()
+
+
+def record_backup(manifest):
+    """Store a finished backup as base for later ones; a full backup makes older change entries obsolete"""
+    db.session.add(BackupRecord(
+        backup_id=manifest['backup_id'],
+        kind=manifest['type'],
+        parent_id=manifest['parent_id'],
+        revision=manifest['revision'],
+        manifest=json.dumps(manifest)
+    ))
+    if manifest['type'] == 'full':
+        _prune_journal(manifest['revision'])
+    db.session.commit()
+
+
+def _prune_journal(revision):
+    """Drop change entries a full backup contains (not committed)"""
+    db.session.execute(sa.delete(ChangeLog).where(ChangeLog.id <= revision))
+
+
+def write_backup(path, **kwargs):
+    """Write a backup ZIP to a file (atomic: temp file + rename). Returns the path."""
+    tmp_path = f"{path}.part"
+    with open(tmp_path, 'wb') as f:
+        for chunk in iter_backup_zip(**kwargs):
+            if chunk:
+                f.write(chunk)
+    os.replace(tmp_path, path)
+    return path
+
+
+class BackupReader:
+    """
+    Read access to the table sections of a backup, independent of its format.
+    get(key) returns an iterable of row dicts (streamed for NDJSON backups).
+    """
+
+    def __init__(self, zf=None, legacy_data=None, manifest=None):
+        self.zf = zf
+        self.legacy_data = legacy_data
+        self.manifest = manifest or {'type': 'full'}
+        self._names = set(zf.namelist()) if zf is not None else set()
+
+    @classmethod
+    def from_zip(cls, zf):
+        if 'database.json' in zf.namelist():
+            with zf.open('database.json') as f:
+                return cls(legacy_data=json.load(f))
+        if 'manifest.json' in zf.namelist():
+            with zf.open('manifest.json') as f:
+                return cls(zf=zf, manifest=json.load(f))
+        return None
+
+    @property
+    def kind(self):
+        return self.manifest.get('type', 'full')
+
+    def get(self, key, default=None):
+        if self.legacy_data is not None:
+            return self.legacy_data.get(key, default if default is not None else [])
+        name = f'database/{key}.ndjson'
+        if name not in self._names:
+            return default if default is not None else []
+        return self._iter_ndjson(name)
+
+    def _iter_ndjson(self, name):
+        with self.zf.open(name) as raw:
+            for line in io.TextIOWrapper(raw, encoding='utf-8'):
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _file_crc32(path):
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def _extract_member(zf, info, target_path):
+    """Stream one ZIP member to disk. Returns False if an identical file is already there."""
+    if (os.path.exists(target_path)
+            and os.path.getsize(target_path) == info.file_size
+            and _file_crc32(target_path) == info.CRC):
+        return False
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    tmp_path = f"{target_path}.{threading.get_ident()}.part"
+    with zf.open(info) as src, open(tmp_path, 'wb') as dest:
+        shutil.copyfileobj(src, dest, COPY_CHUNK_SIZE)
+    os.replace(tmp_path, target_path)
+    return True
+
+
+def restore_uploads(zf, upload_folder, workers=RESTORE_WORKERS):
+    """
+    Extract the uploads/ members of a backup ZIP into the upload folder.
+    Members are streamed in chunks by a small thread pool (decompression releases the GIL),
+    files with the same size and CRC32 as the archived copy are skipped.
+    Returns (extracted, skipped).
+    """
+    os.makedirs(upload_folder, exist_ok=True)
+    root = os.path.realpath(upload_folder)
+
+    jobs = []
+    for info in zf.infolist():
+        if not info.filename.startswith('uploads/') or info.is_dir():
+            continue
+        target_path = os.path.realpath(os.path.join(root, info.filename[8:]))
+        # Never write outside the upload folder (../ in member names)
+        if not target_path.startswith(root + os.sep):
+            continue
+        jobs.append((info, target_path))
+
+    if not jobs:
+        return 0, 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda job: _extract_member(zf, *job), jobs))
+    extracted = sum(results)
+    return extracted, len(results) - extracted
+
+
+def _to_datetime(val):
+    return datetime.fromisoformat(val) if isinstance(val, str) else val
+
+
+def _to_date(val):
+    return date.fromisoformat(val[:10]) if isinstance(val, str) else val
+
+
+def _to_bool(val):
+    return bool(val) if isinstance(val, int) else val
+
+
+def _column_converters(table):
+    """Value converters per column, derived from the column types (JSON only knows str/int/float)"""
+    converters = {}
+    for col in table.columns:
+        if isinstance(col.type, sa.DateTime):
+            converters[col.name] = _to_datetime
+        elif isinstance(col.type, sa.Date):
+            converters[col.name] = _to_date
+        elif isinstance(col.type, sa.Boolean):
+            converters[col.name] = _to_bool
+    return converters
+
+
+def _prepare_rows(table, rows):
+    """Yield rows reduced to the table's columns, with values converted (unknown keys of old backups are dropped)"""
+    known = set(table.columns.keys())
+    converters = _column_converters(table)
+    for row in rows:
+        prepared = {}
+        for key, val in row.items():
+            if key not in known:
+                continue
+            if val is not None and key in converters:
+                val = converters[key](val)
+            prepared[key] = val
+        yield prepared
+
+
+def bulk_insert(table, rows, batch_size=RESTORE_BATCH_SIZE, replace_existing=False):
+    """
+    Insert row dicts with executemany in batches. Returns the number of rows.
+    A batch is flushed early when the key set changes, since executemany needs uniform parameters.
+    replace_existing deletes rows with the same primary key first (applying incremental backups).
+    """
+    def flush(batch):
+        if replace_existing:
+            db.session.execute(table.delete().where(table.c.id.in_([r['id'] for r in batch])))
+        db.session.execute(table.insert(), batch)
+
+    count = 0
+    batch = []
+    batch_keys = None
+    for row in _prepare_rows(table, rows):
+        if batch and (len(batch) >= batch_size or row.keys() != batch_keys):
+            flush(batch)
+            batch = []
+        batch_keys = row.keys()
+        batch.append(row)
+        count += 1
+    if batch:
+        flush(batch)
+    return count
+
+
+def clear_derived_tables():
+    """Caches computed from restored rows (not backed up, rebuilt on demand)"""
+    db.session.execute(GradeSummary.__table__.delete())
+
+
+def restore_database(reader, batch_size=RESTORE_BATCH_SIZE):
+    """
+    Replace the contents of all backup tables with the rows from a BackupReader.
+    Runs in the current transaction, the caller commits or rolls back.
+    Returns { table_key: restored rows }.
+    """
+    # Children first, so foreign keys never point to deleted parents mid-way
+    for key, table in reversed(BACKUP_TABLES):
+        db.session.execute(table.delete())
+
+    counts = {}
+    for key, table in BACKUP_TABLES:
+        counts[key] = bulk_insert(table, reader.get(key, []), batch_size=batch_size)
+    clear_derived_tables()
+    upload_store.recount_references()
+    return counts
+
+
+def apply_backup_delta(reader, batch_size=RESTORE_BATCH_SIZE):
+    """
+    Apply an incremental or differential backup on top of the current database.
+    Tables listed in replace_tables are replaced, others get their changed rows replaced
+    and deleted rows removed. Runs in the current transaction. Returns { table_key: rows }.
+    """
+    replace = set(reader.manifest.get('replace_tables', []))
+    deleted = reader.manifest.get('deleted', {})
+    for key, table in reversed(BACKUP_TABLES):
+        if key in replace:
+            db.session.execute(table.delete())
+        elif deleted.get(key):
+            pks = deleted[key]
+            for i in range(0, len(pks), 500):
+                db.session.execute(table.delete().where(table.c.id.in_(pks[i:i + 500])))
+
+    counts = {}
+    for key, table in BACKUP_TABLES:
+        counts[key] = bulk_insert(table, reader.get(key, []), batch_size=batch_size,
+                                  replace_existing=key not in replace)
+    clear_derived_tables()
+    upload_store.recount_references()
+    return counts
+
+
+def restore_chain(paths, upload_folder):
+    """
+    Restore a full backup followed by its incremental backups (in order) or a differential backup.
+    Every archive must reference its predecessor (incremental) or the full backup (differential).
+    Runs in the current transaction, the caller commits. Raises ValueError for a broken chain.
+    """
+    previous_id = None
+    full_id = None
+    manifest = None
+    for index, path in enumerate(paths):
+        with open_backup_zip(path) as zf:
+            reader = BackupReader.from_zip(zf)
+            if reader is None:
+                raise ValueError(f"{path}: not a backup archive")
+            manifest = reader.manifest
+            if index == 0:
+                if reader.kind != 'full':
+                    raise ValueError(f"{path}: chain must start with a full backup, got {reader.kind}")
+                restore_database(reader)
+                full_id = manifest.get('backup_id')
+            else:
+                expected = previous_id if reader.kind == 'incremental' else full_id
+                if reader.kind == 'full' or expected is None or manifest.get('parent_id') != expected:
+                    raise ValueError(f"{path}: {reader.kind} backup does not continue the chain")
+                apply_backup_delta(reader)
+            restore_uploads(zf, upload_folder)
+            previous_id = manifest.get('backup_id')
+
+    # The last manifest lists every upload that existed at backup time
+    uploads = manifest.get('uploads') if manifest else None
+    if isinstance(uploads, dict):
+        # Rows of tables outside the backup (timetable images, flashcards) survive the restore
+        referenced = {os.path.basename(key)[:64] for key in upload_store.count_references()}
+        for abs_path, arcname in list(iter_upload_files(upload_folder)):
+            if arcname[8:] not in uploads and os.path.basename(abs_path)[:64] not in referenced:
+                os.remove(abs_path)
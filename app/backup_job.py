@@ -0,0 +1,161 @@
+"""
+Scheduled Backups
+Writes full backups to BACKUP_DIR with selectable compression, verifies the
+archive and applies retention. The scheduler leader starts the work in a
+separate low-priority process (python -m app.backup_job), so request-serving
+workers never spend CPU on compression.
+"""
+import os
+import sys
+import glob
+import shutil
+import hashlib
+import zipfile
+import subprocess
+from datetime import datetime
+from flask import current_app
+from .backup import iter_backup_zip, open_backup_zip, COPY_CHUNK_SIZE
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BACKUP_PREFIX = 'l8testudy_backup_'
+COMPRESSIONS = ('deflate', 'zstd', 'store')
+BACKUP_TIMEOUT = 6 * 3600  # Seconds before a backup process is killed
+
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def resolve_compression(name):
+    """Configured codec, falling back to deflate if zstandard is not installed"""
+    if name not in COMPRESSIONS:
+        name = 'deflate'
+    if name == 'zstd' and zstandard is None:
+        current_app.logger.warning("BACKUP_COMPRESSION=zstd but zstandard is not installed, using deflate")
+        name = 'deflate'
+    return name
+
+
+def write_archive(path, compression='deflate', level=None):
+    """
+    Write a full backup to path (suffix .zip, or .zip.zst for zstd).
+    deflate: ZIP members compressed with zlib at the given level (single core).
+    zstd: members stored, the whole archive compressed by multi-threaded zstd.
+    store: no compression.
+    Already-compressed uploads (JPEG, PNG, WebP, ...) are always stored.
+    Not recorded as BackupRecord: downloaded incremental backups never build on it.
+    Returns the final path.
+    """
+    tmp_path = f"{path}.part"
+    if compression == 'zstd':
+        cctx = zstandard.ZstdCompressor(level=level or 3, threads=-1, write_checksum=True)
+        with open(tmp_path, 'wb') as f, cctx.stream_writer(f, closefd=False) as out:
+            for chunk in iter_backup_zip(compression=zipfile.ZIP_STORED, record=False):
+                if chunk:
+                    out.write(chunk)
+    else:
+        method = zipfile.ZIP_STORED if compression == 'store' else zipfile.ZIP_DEFLATED
+        level = level if method == zipfile.ZIP_DEFLATED else None
+        with open(tmp_path, 'wb') as f:
+            for chunk in iter_backup_zip(compression=method, compresslevel=level, record=False):
+                if chunk:
+                    f.write(chunk)
+    os.replace(tmp_path, path)
+    return path
+
+
+def verify_archive(path):
+    """
+    Re-read a backup: CRC check of every ZIP member (testzip) and SHA-256 of the file.
+    zstd archives are decompressed to a temporary file first (this also checks the frame checksum).
+    Returns the SHA-256 hex digest, raises ValueError if the archive is damaged.
+    """
+    with open_backup_zip(path) as zf:
+        bad = zf.testzip()
+        if bad is not None:
+            raise ValueError(f"CRC mismatch in member {bad}")
+        if 'manifest.json' not in zf.namelist():
+            raise ValueError("manifest.json missing")
+    return _sha256_file(path)
+
+
+def apply_retention(backup_dir, keep):
+    """Delete all but the newest `keep` backups (with their checksum files)"""
+    archives = sorted(
+        p for p in glob.glob(os.path.join(backup_dir, f'{BACKUP_PREFIX}*'))
+        if p.endswith(('.zip', '.zip.zst'))
+    )
+    removed = archives[:-keep] if keep > 0 else []
+    for path in removed:
+        os.remove(path)
+        if os.path.exists(f"{path}.sha256"):
+            os.remove(f"{path}.sha256")
+    return removed
+
+
+def run_backup():
+    """Create, verify and rotate one backup in BACKUP_DIR (needs an app context)"""
+    config = current_app.config
+    backup_dir = config['BACKUP_DIR']
+    os.makedirs(backup_dir, exist_ok=True)
+
+    compression = resolve_compression(config['BACKUP_COMPRESSION'])
+    suffix = '.zip.zst' if compression == 'zstd' else '.zip'
+    path = os.path.join(backup_dir, f"{BACKUP_PREFIX}{datetime.now().strftime('%Y%m%d_%H%M%S')}{suffix}")
+
+    write_archive(path, compression, config['BACKUP_COMPRESSION_LEVEL'])
+    try:
+        checksum = verify_archive(path)
+    except Exception:
+        os.replace(path, f"{path}.corrupt")
+        raise
+    with open(f"{path}.sha256", 'w') as f:
+        f.write(f"{checksum}  {os.path.basename(path)}\n")
+
+    removed = apply_retention(backup_dir, config['BACKUP_RETENTION'])
+    current_app.logger.info(f"Backup written: {path} ({os.path.getsize(path)} bytes, sha256 {checksum}), "
+                            f"{len(removed)} old backup(s) removed")
+    return path
+
+
+def spawn_backup_process(app):
+    """
+    Scheduler job: run the backup in a separate process with lowest CPU and I/O priority.
+    Blocks only the scheduler thread, never a request worker.
+    """
+    cmd = [sys.executable, '-m', 'app.backup_job']
+    if shutil.which('ionice'):
+        cmd = ['ionice', '-c', '3'] + cmd  # Idle I/O class
+    env = dict(os.environ, SCHEDULER_ENABLED='false', IMAGE_POOL_PREFORK='false')
+    cwd = os.path.dirname(app.root_path)
+    try:
+        result = subprocess.run(cmd, cwd=cwd, env=env, capture_output=True, text=True, timeout=BACKUP_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        app.logger.error("Scheduled backup timed out")
+        return False
+    if result.returncode != 0:
+        app.logger.error(f"Scheduled backup failed: {result.stderr.strip()[-2000:]}")
+        return False
+    app.logger.info(f"Scheduled backup finished: {result.stdout.strip()}")
+    return True
+
+
+def main():
+    if hasattr(os, 'nice'):
+        os.nice(10)
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        print(run_backup())
+
+
+if __name__ == '__main__':
+    main()
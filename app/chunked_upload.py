@@ -0,0 +1,181 @@
+"""
+Chunked Uploads
+Resumable uploads for large chat attachments and deck imports:
+
+    POST   /api/uploads                        init (size, name, purpose) -> upload_id, chunk_size
+    PUT    /api/uploads/<id>/chunks/<index>    raw chunk body, X-Chunk-SHA256 header
+    GET    /api/uploads/<id>                   missing chunks (resume after a dropped connection)
+    POST   /api/uploads/<id>/complete          verify and hand the file to the chat / deck import handler
+    DELETE /api/uploads/<id>                   abort
+
+Chunks are streamed from the request body straight into the temp file at their
+offset (no multipart parsing, nothing buffered in memory). Size limits and the
+per-user quota of open upload bytes are checked at init, before any data is sent.
+"""
+import os
+import uuid
+import hashlib
+import shutil
+from datetime import datetime, timedelta
+from flask import current_app
+from .models import db, ChunkedUpload, ChunkedUploadPart
+
+PURPOSES = ('chat', 'deck_import')
+DECK_IMPORT_EXTENSIONS = ('.csv', '.txt', '.apkg')
+READ_SIZE = 64 * 1024
+STALE_AFTER = timedelta(hours=24)  # Unfinished uploads older than this are removed
+
+
+class ChunkedUploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def upload_path(upload):
+    return os.path.join(current_app.config['CHUNKED_UPLOAD_FOLDER'], f"{upload.upload_id}.part")
+
+
+def open_upload_bytes(user_id):
+    """Bytes reserved by the user's unfinished uploads"""
+    total = db.session.query(db.func.sum(ChunkedUpload.total_size)).filter_by(user_id=user_id).scalar()
+    return total or 0
+
+
+def start_upload(user_id, purpose, filename, total_size, sha256=None, target_id=None):
+    """Validate limits and quota, reserve the temp file and return the new ChunkedUpload (not committed)"""
+    config = current_app.config
+    if purpose not in PURPOSES:
+        raise ChunkedUploadError('Unknown upload purpose')
+    if not filename:
+        raise ChunkedUploadError('Filename required')
+    if not isinstance(total_size, int) or total_size <= 0:
+        raise ChunkedUploadError('Invalid size')
+    if total_size > config['CHUNKED_UPLOAD_MAX_SIZE']:
+        raise ChunkedUploadError('File too large', 413)
+    if purpose == 'deck_import' and os.path.splitext(filename)[1].lower() not in DECK_IMPORT_EXTENSIONS:
+        raise ChunkedUploadError('Unsupported file type. Use .csv, .txt or .apkg')
+    if sha256 is not None and (len(sha256) != 64 or any(c not in '0123456789abcdef' for c in sha256.lower())):
+        raise ChunkedUploadError('Invalid sha256')
+
+    open_count = ChunkedUpload.query.filter_by(user_id=user_id).count()
+    if open_count >= config['CHUNKED_UPLOAD_MAX_OPEN']:
+        raise ChunkedUploadError('Too many unfinished uploads', 429)
+    if open_upload_bytes(user_id) + total_size > config['CHUNKED_UPLOAD_QUOTA']:
+        raise ChunkedUploadError('Upload quota exceeded', 413)
+
+    folder = config['CHUNKED_UPLOAD_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    if shutil.disk_usage(folder).free < total_size * 2:  # Temp file plus the stored copy
+        raise ChunkedUploadError('Not enough storage space', 507)
+
+    upload = ChunkedUpload(
+        upload_id=uuid.uuid4().hex,
+        user_id=user_id,
+        purpose=purpose,
+        target_id=target_id,
+        filename=filename,
+        total_size=total_size,
+        chunk_size=config['CHUNKED_UPLOAD_CHUNK_SIZE'],
+        sha256=sha256.lower() if sha256 else None
+    )
+    with open(upload_path(upload), 'wb') as f:
+        f.truncate(total_size)
+    db.session.add(upload)
+    return upload
+
+
+def chunk_count(upload):
+    return (upload.total_size + upload.chunk_size - 1) // upload.chunk_size
+
+
+def expected_chunk_size(upload, index):
+    return min(upload.chunk_size, upload.total_size - index * upload.chunk_size)
+
+
+def missing_chunks(upload):
+    received = {index for (index,) in db.session.query(ChunkedUploadPart.index).filter_by(upload_id=upload.id)}
+    return [i for i in range(chunk_count(upload)) if i not in received]
+
+
+def write_chunk(upload, index, stream, content_length, checksum):
+    """
+    Stream one chunk into the temp file and record it (not committed).
+    The length is checked before reading, the SHA-256 after; a bad chunk is not recorded
+    and can simply be sent again. Re-sending a received chunk is harmless.
+    """
+    if index < 0 or index >= chunk_count(upload):
+        raise ChunkedUploadError('Invalid chunk index')
+    expected = expected_chunk_size(upload, index)
+    if content_length != expected:
+        raise ChunkedUploadError(f'Chunk {index} must be {expected} bytes', 413 if (content_length or 0) > expected else 400)
+    if not checksum:
+        raise ChunkedUploadError('X-Chunk-SHA256 header required')
+
+    digest = hashlib.sha256()
+    received = 0
+    with open(upload_path(upload), 'r+b') as f:
+        f.seek(index * upload.chunk_size)
+        while received < expected:
+            data = stream.read(min(READ_SIZE, expected - received))
+            if not data:
+                break
+            digest.update(data)
+            f.write(data)
+            received += len(data)
+    if received != expected:
+        raise ChunkedUploadError('Incomplete chunk')
+    if digest.hexdigest() != checksum.lower():
+        raise ChunkedUploadError('Checksum mismatch', 422)
+
+    part = ChunkedUploadPart.query.filter_by(upload_id=upload.id, index=index).first()
+    if part is None:
+        part = ChunkedUploadPart(upload_id=upload.id, index=index)
+        db.session.add(part)
+    part.size = received
+    part.sha256 = digest.hexdigest()
+    upload.updated_at = datetime.utcnow()
+    return part
+
+
+def finish_upload(upload):
+    """Check that every chunk is there and the whole-file checksum; returns (path, sha256)"""
+    missing = missing_chunks(upload)
+    if missing:
+        raise ChunkedUploadError(f'{len(missing)} chunk(s) missing', 409)
+    path = upload_path(upload)
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(data)
+    if upload.sha256 and digest.hexdigest() != upload.sha256:
+        raise ChunkedUploadError('Checksum mismatch', 422)
+    return path, digest.hexdigest()
+
+
+def discard_upload(upload):
+    """Remove the temp file and the row (not committed)"""
+    path = upload_path(upload)
+    if os.path.exists(path):
+        os.remove(path)
+    db.session.delete(upload)
+
+
+def cleanup_stale_uploads(max_age=STALE_AFTER):
+    """Remove unfinished uploads nobody resumed, and orphaned temp files; needs an app context"""
+    cutoff = datetime.utcnow() - max_age
+    removed = 0
+    for upload in ChunkedUpload.query.filter(ChunkedUpload.updated_at < cutoff).all():
+        discard_upload(upload)
+        removed += 1
+    db.session.commit()
+
+    folder = current_app.config['CHUNKED_UPLOAD_FOLDER']
+    if os.path.isdir(folder):
+        known = {upload_id for (upload_id,) in db.session.query(ChunkedUpload.upload_id)}
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if name[:-5] not in known and os.path.getmtime(path) < cutoff.timestamp():
+                os.remove(path)
+    return removed
@@ -0,0 +1,102 @@
+"""
+Decks
+Deck listing for the flashcards overview: own decks and a paginated, searchable
+public catalogue, each page in one grouped query (author name, card count and
+the current user's due count).
+
+Deck.card_count is kept in step by a session listener on Flashcard inserts and
+deletes; refresh_card_counts() recounts, for bulk inserts that bypass the ORM.
+"""
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from .models import db, Deck, Flashcard, CardReview, User
+
+PUBLIC_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+
+@event.listens_for(Session, 'after_flush')
+def _count_deck_cards(session, flush_context):
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, Flashcard):
+            deltas[obj.deck_id] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Flashcard):
+            deltas[obj.deck_id] -= 1
+
+    table = Deck.__table__
+    for deck_id, delta in deltas.items():
+        if delta:
+            session.connection().execute(
+                table.update().where(table.c.id == deck_id).values(card_count=table.c.card_count + delta)
+            )
+
+
+def refresh_card_counts(deck_ids=None):
+    """Recount Deck.card_count (all decks or the given ones); not committed"""
+    counted = db.session.query(db.func.count(Flashcard.id)).filter(
+        Flashcard.deck_id == Deck.id
+    ).scalar_subquery()
+    query = db.update(Deck).values(card_count=counted)
+    if deck_ids is not None:
+        query = query.where(Deck.id.in_(deck_ids))
+    db.session.execute(query.execution_options(synchronize_session=False))
+
+
+def _listing_query(user_id, now):
+    due = db.session.query(
+        Flashcard.deck_id, db.func.count(CardReview.id).label('due')
+    ).join(
+        CardReview, CardReview.card_id == Flashcard.id
+    ).filter(
+        CardReview.user_id == user_id, CardReview.next_review_at <= now
+    ).group_by(Flashcard.deck_id).subquery()
+
+    return db.session.query(
+        Deck.id, Deck.title, Deck.description, Deck.is_public, Deck.user_id,
+        Deck.created_at, Deck.card_count, User.username,
+        db.func.coalesce(due.c.due, 0)
+    ).join(User, User.id == Deck.user_id).outerjoin(due, due.c.deck_id == Deck.id)
+
+
+def _serialize(row, user_id):
+    deck_id, title, description, is_public, owner_id, created_at, card_count, username, due_count = row
+    return {
+        'id': deck_id,
+        'title': title,
+        'description': description,
+        'is_public': is_public,
+        'is_own': owner_id == user_id,
+        'author_name': username,
+        'card_count': card_count or 0,
+        'due_count': due_count,
+        'created_at': created_at.isoformat()
+    }
+
+
+def own_decks(user_id, now=None):
+    rows = _listing_query(user_id, now or datetime.utcnow()).filter(
+        Deck.user_id == user_id
+    ).order_by(Deck.created_at.desc())
+    return [_serialize(row, user_id) for row in rows]
+
+
+def public_decks(user_id, search=None, page=1, per_page=PUBLIC_PAGE_SIZE, now=None):
+    """One page of other users' public decks, newest first. Returns (decks, total)."""
+    per_page = max(1, min(per_page, MAX_PAGE_SIZE))
+    page = max(1, page)
+    query = _listing_query(user_id, now or datetime.utcnow()).filter(
+        Deck.is_public == True, Deck.user_id != user_id
+    )
+    if search:
+        query = query.filter(db.or_(
+            Deck.title.icontains(search, autoescape=True),
+            Deck.description.icontains(search, autoescape=True),
+            User.username.icontains(search, autoescape=True)
+        ))
+    total = query.order_by(None).count()
+    rows = query.order_by(Deck.created_at.desc(), Deck.id.desc()).offset((page - 1) * per_page).limit(per_page)
+    return [_serialize(row, user_id) for row in rows], total
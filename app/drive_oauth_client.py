@@ -8,11 +8,8 @@ import time
 import sys
 from datetime import datetime, timedelta
 from flask import current_app, url_for
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 from .models import DriveOAuthToken, db
+from . import integrations
 
 # OAuth 2.0 Scopes
 SCOPES = [
@@ -24,7 +21,35 @@ SCOPES = [
 # Format: { cache_key: (timestamp, data) }
 _DRIVE_RAM_CACHE = {}
 _CACHE_TTL = 86400 # 24 hours (for listings)
-_DRIVE_CONTENT_CACHE = {} # { file_id: (modifiedTime, checksum, bytes) }
+_DRIVE_CONTENT_CACHE = {} # { file_id: (modifiedTime, checksum, bytes, validated_at) }
+_CONTENT_FRESH_FOR = 900 # Default: cached content is trusted for 15 minutes without revalidation
+_DRIVE_CHANGES_TOKEN = None # Page token of the Drive Changes feed (per worker)
+
+# Content cache counters (exposed via get_cache_stats)
+_DRIVE_CACHE_COUNTERS = {
+    'hits': 0,           # Served from cache without any remote call
+    'misses': 0,         # Not cached or changed remotely -> full download
+    'revalidations': 0,  # Freshness window expired, metadata check confirmed cache
+    'invalidations': 0   # Entries dropped by the Changes feed
+}
+
+def _google():
+    """google-auth / google-api-python-client, imported on first use (unconfigured deployments never load them)"""
+    return integrations.load('drive')
+
+
+class _NoHttpError(Exception):
+    """Never raised: stands in for HttpError while the google libraries are not loaded"""
+
+
+def _http_error():
+    """
+    HttpError for except clauses. Loading the libraries there would replace the
+    exception being handled with IntegrationUnavailable when they are missing;
+    if they are not loaded, no Google call can have raised an HttpError.
+    """
+    return _google().HttpError if integrations.is_loaded('drive') else _NoHttpError
+
 
 class DriveOAuthClient:
     """Client for Google Drive API using OAuth 2.0"""
@@ -45,7 +70,7 @@ class DriveOAuthClient:
             }
         }
         
-        flow = Flow.from_client_config(
+        flow = _google().Flow.from_client_config(
             client_config,
             scopes=SCOPES,
             redirect_uri=redirect_uri
@@ -71,7 +96,7 @@ class DriveOAuthClient:
             }
         }
         
-        flow = Flow.from_client_config(
+        flow = _google().Flow.from_client_config(
             client_config,
             scopes=SCOPES,
             redirect_uri=redirect_uri
@@ -110,7 +135,7 @@ class DriveOAuthClient:
             return None
         
         if token:
-            credentials = Credentials(
+            credentials = _google().Credentials(
                 token=token.get_access_token(),
                 refresh_token=token.get_refresh_token(),
                 token_uri="https://oauth2.googleapis.com/token",
@@ -139,7 +164,7 @@ class DriveOAuthClient:
         
         # If no DB token or refresh failed, try ENV token
         if not token and env_refresh_token:
-            credentials = Credentials(
+            credentials = _google().Credentials(
                 token=None,
                 refresh_token=env_refresh_token,
                 token_uri="https://oauth2.googleapis.com/token",
@@ -166,7 +191,7 @@ class DriveOAuthClient:
                     credentials = service_account.Credentials.from_service_account_info(
                         info, scopes=SCOPES
                     )
-                    return build('drive', 'v3', credentials=credentials)
+                    return _google().build('drive', 'v3', credentials=credentials)
                 except Exception as e:
                     current_app.logger.warning(f"Note: Service Account loading failed (normal if not using SA): {e}")
         elif service_account_info and isinstance(service_account_info, dict):
@@ -175,7 +200,7 @@ class DriveOAuthClient:
                 credentials = service_account.Credentials.from_service_account_info(
                     service_account_info, scopes=SCOPES
                 )
-                return build('drive', 'v3', credentials=credentials)
+                return _google().build('drive', 'v3', credentials=credentials)
             except Exception as e:
                 current_app.logger.warning(f"Note: Service Account (dict) loading failed: {e}")
 
@@ -184,7 +209,7 @@ class DriveOAuthClient:
         if not credentials:
             return None
         
-        return build('drive', 'v3', credentials=credentials)
+        return _google().build('drive', 'v3', credentials=credentials)
     
     def _get_cache(self, key):
         """Internal helper to get item from RAM cache"""
@@ -240,7 +265,7 @@ class DriveOAuthClient:
                 q=query,
                 pageSize=page_size,
                 pageToken=page_token,
-                fields="nextPageToken, files(id, name, mimeType, size, modifiedTime, webViewLink, parents, thumbnailLink, iconLink, owners)",
+                fields="nextPageToken, files(id, name, mimeType, size, modifiedTime, md5Checksum, webViewLink, parents, thumbnailLink, iconLink, owners)",
                 orderBy="folder, name"
             ))
             
@@ -249,7 +274,7 @@ class DriveOAuthClient:
             
             self._set_cache(cache_key, (items, next_token))
             return items, next_token
-        except HttpError as error:
+        except _http_error() as error:
             current_app.logger.error(f"Drive API error: {error}")
             return None, None
     
@@ -271,12 +296,12 @@ class DriveOAuthClient:
                 q=query,
                 pageSize=page_size,
                 pageToken=page_token,
-                fields="nextPageToken, files(id, name, mimeType, size, modifiedTime, webViewLink, parents, thumbnailLink, iconLink)",
+                fields="nextPageToken, files(id, name, mimeType, size, modifiedTime, md5Checksum, webViewLink, parents, thumbnailLink, iconLink)",
                 orderBy="modifiedTime desc"
             ))
             
             return results.get('files', []), results.get('nextPageToken')
-        except HttpError as error:
+        except _http_error() as error:
             current_app.logger.error(f"Drive API error: {error}")
             return None, None
     
@@ -294,12 +319,12 @@ class DriveOAuthClient:
                 q=query,
                 pageSize=page_size,
                 pageToken=page_token,
-                fields="nextPageToken, files(id, name, mimeType, size, modifiedTime, webViewLink, parents, thumbnailLink, iconLink, owners)",
+                fields="nextPageToken, files(id, name, mimeType, size, modifiedTime, md5Checksum, webViewLink, parents, thumbnailLink, iconLink, owners)",
                 orderBy="modifiedTime desc"
             ))
             
             return results.get('files', []), results.get('nextPageToken')
-        except HttpError as error:
+        except _http_error() as error:
             current_app.logger.error(f"Drive API error: {error}")
             return None, None
     
@@ -346,14 +371,14 @@ class DriveOAuthClient:
             results = self._execute_with_retry(service.files().list(
                 q=query,
                 pageSize=page_size,
-                fields="files(id, name, mimeType, size, modifiedTime, webViewLink, parents, thumbnailLink, iconLink, owners)",
+                fields="files(id, name, mimeType, size, modifiedTime, md5Checksum, webViewLink, parents, thumbnailLink, iconLink, owners)",
                 orderBy="modifiedTime desc"
             ))
             
             items = results.get('files', [])
             self._set_cache(cache_key, items)
             return items
-        except HttpError as error:
+        except _http_error() as error:
             current_app.logger.error(f"Drive API error: {error}")
             return None
     
@@ -371,12 +396,12 @@ class DriveOAuthClient:
         try:
             file = self._execute_with_retry(service.files().get(
                 fileId=file_id,
-                fields="id, name, mimeType, size, modifiedTime, webViewLink, parents, thumbnailLink, iconLink, description"
+                fields="id, name, mimeType, size, modifiedTime, md5Checksum, webViewLink, parents, thumbnailLink, iconLink, description"
             ))
             
             self._set_cache(cache_key, file)
             return file
-        except HttpError as error:
+        except _http_error() as error:
             current_app.logger.error(f"Drive API error: {error}")
             return None
     
@@ -401,7 +426,7 @@ class DriveOAuthClient:
                 current_id = parents[0] if parents else None
             
             return '/' + '/'.join(path_parts) if path_parts else '/'
-        except HttpError as error:
+        except _http_error() as error:
             current_app.logger.error(f"Drive API error: {error}")
             return None
     
@@ -420,33 +445,54 @@ class DriveOAuthClient:
         return self.get_credentials() is not None
 
     def download_file(self, file_id, mime_type=None):
-        """Download file content or export Google Doc as PDF with RAM Caching and Validation"""
+        """Download file content or export Google Doc as PDF with RAM Caching and Validation
+
+        Cached content is served without any remote call while it is fresh
+        (validated less than DRIVE_CONTENT_FRESH_SECONDS ago and not invalidated
+        by the Changes feed). Stale entries are revalidated with one small
+        metadata request before falling back to a full download.
+        """
+        cache_key = f"content_{file_id}"
+        fresh_for = current_app.config.get('DRIVE_CONTENT_FRESH_SECONDS', _CONTENT_FRESH_FOR)
+        
+        # 1. Fresh cache hit: zero remote calls
+        cached = _DRIVE_CONTENT_CACHE.get(cache_key)
+        if cached and (time.time() - cached[3]) < fresh_for:
+            _DRIVE_CACHE_COUNTERS['hits'] += 1
+            # Move to end so eviction drops the least recently used entry
+            _DRIVE_CONTENT_CACHE[cache_key] = _DRIVE_CONTENT_CACHE.pop(cache_key)
+            return cached[2]
+
         service = self.get_service()
         if not service:
             return None
         
         try:
-            # 1. Fetch current minimal metadata for validation (Always-Validate)
-            # This is 1 small API call, much faster than a full download/export.
+            # 2. Revalidate with current metadata (1 small API call).
+            # We request the full metadata fields so the listing/metadata cache is refreshed too
+            # and the download route does not need a second round-trip.
             current_meta = self._execute_with_retry(service.files().get(
                 fileId=file_id,
-                fields="id, modifiedTime, md5Checksum, mimeType"
+                fields="id, name, mimeType, size, modifiedTime, md5Checksum, webViewLink, parents, thumbnailLink, iconLink, description"
             ))
+            self._set_cache(f"meta_{file_id}", current_meta)
             
             m_time = current_meta.get('modifiedTime')
             checksum = current_meta.get('md5Checksum', '')
             mime_type = current_meta.get('mimeType')
             
-            # 2. Check Content Cache
-            cache_key = f"content_{file_id}"
-            if cache_key in _DRIVE_CONTENT_CACHE:
-                cached_mtime, cached_checksum, cached_data = _DRIVE_CONTENT_CACHE[cache_key]
+            if cached:
+                cached_mtime, cached_checksum, cached_data, _ = cached
                 # Compare modified time and checksum (checksum is empty for Google Apps files)
                 if cached_mtime == m_time and (not checksum or cached_checksum == checksum):
-                    current_app.logger.info(f"Serving file from RAM cache: {file_id}")
+                    _DRIVE_CACHE_COUNTERS['revalidations'] += 1
+                    _DRIVE_CONTENT_CACHE.pop(cache_key, None)
+                    _DRIVE_CONTENT_CACHE[cache_key] = (m_time, checksum, cached_data, time.time())
+                    current_app.logger.info(f"Serving file from RAM cache (revalidated): {file_id}")
                     return cached_data
 
             # 3. If not in cache or changed, Download/Export
+            _DRIVE_CACHE_COUNTERS['misses'] += 1
             current_app.logger.info(f"Downloading/Exporting file (not in cache or outdated): {file_id}")
             if mime_type.startswith('application/vnd.google-apps.'):
                 content = self._execute_with_retry(service.files().export(
@@ -459,19 +505,79 @@ class DriveOAuthClient:
                 ))
 
             # 4. Update Cache
-            _DRIVE_CONTENT_CACHE[cache_key] = (m_time, checksum, content)
+            _DRIVE_CONTENT_CACHE.pop(cache_key, None)
+            _DRIVE_CONTENT_CACHE[cache_key] = (m_time, checksum, content, time.time())
             
-            # Simple LRU-ish: Limit to 500 files or ~4-6 GB (assuming avg file size)
+            # Simple LRU: Limit to 500 files or ~4-6 GB (assuming avg file size)
             if len(_DRIVE_CONTENT_CACHE) > 500:
-                # Remove oldest entry
+                # Remove least recently used entry
                 _DRIVE_CONTENT_CACHE.pop(next(iter(_DRIVE_CONTENT_CACHE)))
                 
             return content
             
-        except HttpError as error:
+        except _http_error() as error:
             current_app.logger.error(f"Drive download error: {error}")
             return None
 
+    def invalidate_file(self, file_id, parent_ids=None):
+        """Drop cached content, metadata and parent listings for a changed file"""
+        dropped = 0
+        if _DRIVE_CONTENT_CACHE.pop(f"content_{file_id}", None) is not None:
+            dropped += 1
+        if _DRIVE_RAM_CACHE.pop(f"meta_{file_id}", None) is not None:
+            dropped += 1
+        
+        # Listings are keyed by parent: list_<parent_id>_<page_token>_<creds_hash>
+        prefixes = tuple(f"list_{pid}_" for pid in (parent_ids or []))
+        if prefixes:
+            for key in [k for k in _DRIVE_RAM_CACHE if k.startswith(prefixes)]:
+                del _DRIVE_RAM_CACHE[key]
+                dropped += 1
+        
+        _DRIVE_CACHE_COUNTERS['invalidations'] += dropped
+        return dropped
+
+    def sync_changes(self):
+        """Poll the Drive Changes feed and invalidate cache entries of changed files.
+
+        The first call only records the start page token. Returns the number of
+        dropped cache entries.
+        """
+        global _DRIVE_CHANGES_TOKEN
+        service = self.get_service()
+        if not service:
+            return 0
+        
+        try:
+            if _DRIVE_CHANGES_TOKEN is None:
+                response = self._execute_with_retry(service.changes().getStartPageToken())
+                _DRIVE_CHANGES_TOKEN = response.get('startPageToken')
+                return 0
+            
+            dropped = 0
+            page_token = _DRIVE_CHANGES_TOKEN
+            while page_token:
+                response = self._execute_with_retry(service.changes().list(
+                    pageToken=page_token,
+                    pageSize=1000,
+                    includeRemoved=True,
+                    fields="nextPageToken, newStartPageToken, changes(fileId, removed, file(parents))"
+                ))
+                for change in response.get('changes', []):
+                    parents = (change.get('file') or {}).get('parents', [])
+                    dropped += self.invalidate_file(change.get('fileId'), parents)
+                
+                if response.get('newStartPageToken'):
+                    _DRIVE_CHANGES_TOKEN = response['newStartPageToken']
+                page_token = response.get('nextPageToken')
+            
+            if dropped:
+                current_app.logger.info(f"Drive Changes feed: invalidated {dropped} cache entries")
+            return dropped
+        except _http_error() as error:
+            current_app.logger.error(f"Drive Changes feed error: {error}")
+            return 0
+
     def warmup_cache(self, depth=10, warmup_content=False):
         """Warmup the RAM cache by pre-crawling the Drive structure and optionally caching content"""
         try:
@@ -500,7 +606,12 @@ class DriveOAuthClient:
             'metadata_count': listing_count,
             'metadata_size_mb': round(listing_bytes / (1024 * 1024), 2),
             'total_size_mb': round((content_bytes + listing_bytes) / (1024 * 1024), 2),
-            'limit_mb': 8192
+            'limit_mb': 8192,
+            'content_hits': _DRIVE_CACHE_COUNTERS['hits'],
+            'content_misses': _DRIVE_CACHE_COUNTERS['misses'],
+            'content_revalidations': _DRIVE_CACHE_COUNTERS['revalidations'],
+            'content_invalidations': _DRIVE_CACHE_COUNTERS['invalidations'],
+            'content_fresh_seconds': current_app.config.get('DRIVE_CONTENT_FRESH_SECONDS', _CONTENT_FRESH_FOR)
         }
 
     def _warmup_recursive(self, parent_id, remaining_depth, warmup_content=False):
@@ -569,7 +680,7 @@ class DriveOAuthClient:
         for i in range(max_retries):
             try:
                 return request.execute()
-            except HttpError as e:
+            except _http_error() as e:
                 if e.resp.status in [500, 502, 503, 504] and i < max_retries - 1:
                     wait_time = (2 ** i) + (0.1 * i)
                     current_app.logger.warning(f"Drive API {e.resp.status} error, retrying in {wait_time}s... (Attempt {i+1}/{max_retries})")
@@ -6,6 +6,7 @@ from flask import Blueprint, request, jsonify, redirect, url_for, session, curre
 from flask_login import login_required, current_user
 from .models import DriveOAuthToken, db
 from .drive_oauth_client import DriveOAuthClient
+from .drive_thumbnails import attach_thumbnail_urls, get_or_create_thumbnail, thumbnail_key, get_format, FORMATS
 from datetime import datetime
 from io import BytesIO
 
@@ -177,6 +178,10 @@ def revoke_auth():
     DriveOAuthToken.query.delete()
     db.session.commit()
     
+    # Drop cached ciphers and decrypted tokens of this worker
+    from .encryption import clear_key_cache
+    clear_key_cache()
+    
     return jsonify({'success': True})
 
 @drive_bp.route('/browse', methods=['GET'])
@@ -338,6 +343,8 @@ def get_files():
     if items is None:
         return jsonify({'success': False, 'message': 'Google Drive not connected or inaccessible'}), 401
     
+    items = attach_thumbnail_urls(items)
+    
     return jsonify({
         'success': True,
         'items': items,
@@ -383,7 +390,7 @@ def search_files():
     
     return jsonify({
         'success': True,
-        'files': files
+        'files': attach_thumbnail_urls(files)
     })
 
 @drive_bp.route('/file/<file_id>', methods=['GET'])
@@ -418,19 +425,20 @@ def download_file(file_id):
     if not client.is_authenticated():
         return jsonify({'success': False, 'message': 'Not authenticated'}), 401
     
+    # Download/Export first: on a cache miss or revalidation this refreshes the
+    # metadata cache, so the lookup below is served from RAM without a second round-trip
+    content = client.download_file(file_id)
+    
     # Get metadata to know the filename and mime type
     meta = client.get_file_metadata(file_id)
     if not meta:
         return jsonify({'success': False, 'message': 'File not found'}), 404
+    if not content:
+        return jsonify({'success': False, 'message': 'Download failed'}), 500
     
     mime_type = meta.get('mimeType')
     filename = meta.get('name')
     
-    # Download/Export
-    content = client.download_file(file_id, mime_type)
-    if not content:
-        return jsonify({'success': False, 'message': 'Download failed'}), 500
-    
     # If it was a Google Doc, we exported it as PDF
     if mime_type.startswith('application/vnd.google-apps.'):
         mime_type = 'application/pdf'
@@ -445,3 +453,30 @@ def download_file(file_id):
         as_attachment=not inline,
         download_name=filename
     )
+
+@drive_bp.route('/file/<file_id>/thumbnail', methods=['GET'])
+@login_required
+def get_file_thumbnail(file_id):
+    """Serve a server-rendered thumbnail (first PDF page or image preview)"""
+    if not current_user.is_admin and not verify_drive_access(file_id):
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+
+    client = DriveOAuthClient()
+    if not client.is_authenticated():
+        return jsonify({'success': False, 'message': 'Not authenticated'}), 401
+    
+    meta = client.get_file_metadata(file_id)
+    if not meta:
+        return jsonify({'success': False, 'message': 'File not found'}), 404
+    
+    path = get_or_create_thumbnail(client, meta)
+    if not path:
+        return jsonify({'success': False, 'message': 'No preview available'}), 404
+    
+    response = send_file(path, mimetype=FORMATS[get_format()][1], etag=thumbnail_key(meta), conditional=True)
+    if request.args.get('v') == thumbnail_key(meta):
+        # Versioned URL: content behind it never changes
+        response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
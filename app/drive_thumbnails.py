@@ -0,0 +1,190 @@
+"""
+Drive Thumbnail Service
+Renders small previews (first PDF page / images) of Drive files on the server,
+so the browser never has to load Google's thumbnailLink (blocked by our CSP).
+"""
+import os
+import hashlib
+import threading
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+
+THUMBNAIL_MAX_SIZE = 320  # Longest edge in pixels
+THUMBNAIL_VERSION = 1  # Bump to invalidate all stored thumbnails after render changes
+MAX_SOURCE_BYTES = 20 * 1024 * 1024  # Same limit as the content warmup
+
+PDF_MIME = 'application/pdf'
+# Image types Pillow decodes (SVG, HEIC etc. would be downloaded just to fail)
+IMAGE_MIMES = {
+    'image/jpeg',
+    'image/png',
+    'image/gif',
+    'image/webp',
+    'image/bmp',
+    'image/tiff',
+}
+# Google Docs are exported as PDF by DriveOAuthClient.download_file
+EXPORTABLE_MIMES = {
+    'application/vnd.google-apps.document',
+    'application/vnd.google-apps.presentation',
+    'application/vnd.google-apps.spreadsheet',
+    'application/vnd.google-apps.drawing',
+}
+FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+
+# Worker pool shared by all requests of this process
+_THUMB_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+# pdfium (used by pdfplumber) is not thread-safe, so PDF rasterization is serialized
+_PDF_RENDER_LOCK = threading.Lock()
+# Renders in flight: { thumbnail_key: Future } (deduplicates concurrent requests)
+_PENDING = {}
+
+
+def _get_executor():
+    global _THUMB_EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _THUMB_EXECUTOR is None:
+            workers = current_app.config.get('DRIVE_THUMBNAIL_WORKERS', 2)
+            _THUMB_EXECUTOR = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='drive-thumb')
+        return _THUMB_EXECUTOR
+
+
+def get_format():
+    fmt = current_app.config.get('DRIVE_THUMBNAIL_FORMAT', 'webp')
+    return fmt if fmt in FORMATS else 'jpeg'
+
+
+def is_thumbnailable(meta):
+    """Check if a thumbnail can be rendered for this Drive item"""
+    if not meta:
+        return False
+    mime_type = meta.get('mimeType', '')
+    size_str = str(meta.get('size', '0'))
+    if size_str.isdigit() and int(size_str) > MAX_SOURCE_BYTES:
+        return False
+    return mime_type in IMAGE_MIMES or mime_type == PDF_MIME or mime_type in EXPORTABLE_MIMES
+
+
+def thumbnail_key(meta):
+    """
+    Content-addressed key of a thumbnail.
+    Binary files use Drive's md5Checksum, so identical files share one thumbnail.
+    Google Docs have no checksum and are keyed by id and modification time.
+    """
+    content_id = meta.get('md5Checksum') or f"{meta.get('id')}:{meta.get('modifiedTime')}"
+    raw = f"v{THUMBNAIL_VERSION}:{THUMBNAIL_MAX_SIZE}:{get_format()}:{content_id}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def thumbnail_url(meta):
+    """Versioned URL for a thumbnail (safe to cache forever)"""
+    return f"/api/drive/file/{meta['id']}/thumbnail?v={thumbnail_key(meta)}"
+
+
+def thumbnail_path(key):
+    """Sharded storage path: <folder>/ab/<key>.<ext>"""
+    folder = current_app.config['DRIVE_THUMBNAIL_FOLDER']
+    return os.path.join(folder, key[:2], f"{key}.{get_format()}")
+
+
+def failure_marker_path(key):
+    """Empty marker next to the thumbnail: rendering this content failed, don't download it again"""
+    folder = current_app.config['DRIVE_THUMBNAIL_FOLDER']
+    return os.path.join(folder, key[:2], f"{key}.failed")
+
+
+def _mark_failed(future, marker_path):
+    """Pool callback: record a failed render (the key changes with the content)"""
+    if future.cancelled() or (future.exception() is None and future.result()):
+        return
+    try:
+        os.makedirs(os.path.dirname(marker_path), exist_ok=True)
+        open(marker_path, 'a').close()
+    except OSError:
+        pass
+
+
+def _render_thumbnail(content, mime_type, target_path, fmt):
+    """Render a thumbnail to target_path (runs in the worker pool, no app context)"""
+    from PIL import Image, ImageOps
+
+    if mime_type in IMAGE_MIMES:
+        img = Image.open(BytesIO(content))
+        img.draft('RGB', (THUMBNAIL_MAX_SIZE * 2, THUMBNAIL_MAX_SIZE * 2))  # Fast JPEG downscale on decode
+        img = ImageOps.exif_transpose(img)
+    else:
+        import pdfplumber
+        with _PDF_RENDER_LOCK:
+            with pdfplumber.open(BytesIO(content)) as pdf:
+                if not pdf.pages:
+                    return False
+                page = pdf.pages[0]
+                img = page.to_image(width=THUMBNAIL_MAX_SIZE * 2).original.copy()
+
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    img.thumbnail((THUMBNAIL_MAX_SIZE, THUMBNAIL_MAX_SIZE), Image.Resampling.LANCZOS)
+
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    tmp_path = f"{target_path}.{threading.get_ident()}.tmp"
+    pil_format = FORMATS[fmt][0]
+    if pil_format == 'WEBP':
+        img.save(tmp_path, pil_format, quality=70, method=4)
+    else:
+        img.save(tmp_path, pil_format, quality=75, optimize=True)
+    # Atomic publish: readers never see a half-written file
+    os.replace(tmp_path, target_path)
+    return True
+
+
+def get_or_create_thumbnail(client, meta, timeout=20):
+    """
+    Return the path of the thumbnail for a Drive item, rendering it if needed.
+    The file content comes from the client's content cache; rendering runs in the worker pool.
+    Returns None if no thumbnail could be produced.
+    """
+    if not is_thumbnailable(meta):
+        return None
+
+    key = thumbnail_key(meta)
+    path = thumbnail_path(key)
+    if os.path.exists(path):
+        return path
+    marker_path = failure_marker_path(key)
+    if os.path.exists(marker_path):
+        return None
+
+    future = _PENDING.get(key)
+    if future is None:
+        content = client.download_file(meta['id'])
+        if not content:
+            return None
+        mime_type = meta.get('mimeType', '')
+        if mime_type in EXPORTABLE_MIMES:
+            mime_type = PDF_MIME
+        future = _get_executor().submit(_render_thumbnail, content, mime_type, path, get_format())
+        _PENDING[key] = future
+        future.add_done_callback(lambda f, m=marker_path: _mark_failed(f, m))
+        future.add_done_callback(lambda f, k=key: _PENDING.pop(k, None))
+
+    try:
+        if future.result(timeout=timeout):
+            return path
+    except Exception as e:
+        current_app.logger.warning(f"Thumbnail rendering failed for {meta.get('id')}: {e}")
+    return None
+
+
+def attach_thumbnail_urls(items):
+    """Add our own thumbnailUrl to Drive listing items (returns new dicts, cached listings stay untouched)"""
+    result = []
+    for item in items:
+        if is_thumbnailable(item):
+            item = dict(item, thumbnailUrl=thumbnail_url(item))
+        result.append(item)
+    return result
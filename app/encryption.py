@@ -4,8 +4,13 @@ Implementiert AES-256-GCM Verschlüsselung für sichere Datenspeicherung
 """
 
 import os
+import hmac
 import base64
-from typing import Tuple, Optional
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Tuple, Optional, BinaryIO, Iterator, Callable, Any
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
@@ -23,6 +28,89 @@ class DecryptionError(Exception):
     pass
 
 
+class _KeyedCache:
+    """
+    Kleiner thread-sicherer LRU-Cache für abgeleitete Schlüssel und Cipher-Objekte
+    
+    Passwörter werden nie im Klartext als Cache-Key verwendet, sondern nur als
+    HMAC-Fingerprint mit einem zufälligen, prozesslokalen Secret. Cipher-Objekte
+    enthalten ihren Schlüssel ohnehin und werden direkt über ihn adressiert.
+    """
+    
+    _PEPPER = os.urandom(32)
+    
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @classmethod
+    def fingerprint(cls, *parts: bytes) -> bytes:
+        mac = hmac.new(cls._PEPPER, digestmod=hashlib.sha256)
+        for part in parts:
+            mac.update(struct.pack('>I', len(part)))
+            mac.update(part)
+        return mac.digest()
+    
+    def get_or_create(self, key: Any, factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        
+        # Teure Ableitung außerhalb des Locks (PBKDF2 blockiert sonst alle Threads)
+        value = factory()
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Prozessweite Caches (begrenzt)
+_DERIVED_KEY_CACHE = _KeyedCache(maxsize=64)   # PBKDF2-Ergebnisse
+_CIPHER_CACHE = _KeyedCache(maxsize=64)        # AESEncryption- und Fernet-Instanzen
+_TOKEN_CACHE = _KeyedCache(maxsize=256)        # Entschlüsselte Fernet-Tokens
+
+
+def clear_key_cache() -> None:
+    """
+    Verwirft alle zwischengespeicherten Schlüssel, Cipher-Objekte und
+    entschlüsselten Tokens (z.B. nach einer Schlüsselrotation oder beim
+    Widerruf von Zugangsdaten)
+    """
+    _DERIVED_KEY_CACHE.clear()
+    _CIPHER_CACHE.clear()
+    _TOKEN_CACHE.clear()
+
+
+def get_key_cache_stats() -> dict:
+    """
+    Liefert Trefferstatistiken der Schlüssel-Caches
+    
+    Returns:
+        dict: Hits/Misses/Größe je Cache
+    """
+    return {
+        name: {'hits': cache.hits, 'misses': cache.misses, 'size': len(cache)}
+        for name, cache in (('derived_keys', _DERIVED_KEY_CACHE),
+                            ('ciphers', _CIPHER_CACHE),
+                            ('tokens', _TOKEN_CACHE))
+    }
+
+
 class AESEncryption:
     """
     AES-256-GCM Verschlüsselung für L8teStudy
@@ -40,6 +128,16 @@ class AESEncryption:
     SALT_SIZE = 16  # 128 bits
     PBKDF2_ITERATIONS = 100000  # Anzahl der Iterationen für Key Derivation
     
+    # Konstanten für das Streaming-Format (chunked AES-GCM, STREAM-Konstruktion)
+    # Header: MAGIC (4) + Version (1) + Chunk-Größe (4, big endian) + Nonce-Präfix (7)
+    # Chunk-Nonce: Nonce-Präfix (7) + Chunk-Index (4, big endian) + Final-Flag (1)
+    STREAM_MAGIC = b'L8SC'
+    STREAM_VERSION = 1
+    STREAM_NONCE_PREFIX_SIZE = 7
+    STREAM_HEADER_SIZE = 16
+    STREAM_TAG_SIZE = 16
+    STREAM_CHUNK_SIZE = 64 * 1024  # 64 KiB Klartext pro Chunk
+    
     def __init__(self, master_key: Optional[bytes] = None):
         """
         Initialisiert das Verschlüsselungssystem
@@ -53,6 +151,8 @@ class AESEncryption:
             if len(master_key) != self.KEY_SIZE:
                 raise EncryptionError(f"Master Key muss {self.KEY_SIZE} bytes lang sein")
             self.master_key = master_key
+        # Cipher-Objekt einmal pro Instanz erzeugen und wiederverwenden
+        self._aesgcm = AESGCM(self.master_key)
     
     @staticmethod
     def _generate_key() -> bytes:
@@ -79,15 +179,20 @@ class AESEncryption:
         if salt is None:
             salt = os.urandom(AESEncryption.SALT_SIZE)
         
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=AESEncryption.KEY_SIZE,
-            salt=salt,
-            iterations=AESEncryption.PBKDF2_ITERATIONS,
-            backend=default_backend()
-        )
-        
-        key = kdf.derive(password.encode('utf-8'))
+        def derive() -> bytes:
+            kdf = PBKDF2HMAC(
+                algorithm=hashes.SHA256(),
+                length=AESEncryption.KEY_SIZE,
+                salt=salt,
+                iterations=AESEncryption.PBKDF2_ITERATIONS,
+                backend=default_backend()
+            )
+            return kdf.derive(password.encode('utf-8'))
+        
+        # PBKDF2 ist bei gleichem Passwort und Salt deterministisch -> Ergebnis cachen
+        cache_key = _KeyedCache.fingerprint(b'pbkdf2', salt, password.encode('utf-8'),
+                                            str(AESEncryption.PBKDF2_ITERATIONS).encode())
+        key = _DERIVED_KEY_CACHE.get_or_create(cache_key, derive)
         return key, salt
     
     def encrypt(self, plaintext: bytes, associated_data: Optional[bytes] = None) -> bytes:
@@ -108,11 +213,8 @@ class AESEncryption:
             # Generiere eine zufällige Nonce
             nonce = os.urandom(self.NONCE_SIZE)
             
-            # Erstelle AESGCM Cipher
-            aesgcm = AESGCM(self.master_key)
-            
-            # Verschlüssele die Daten
-            ciphertext = aesgcm.encrypt(nonce, plaintext, associated_data)
+            # Verschlüssele die Daten (wiederverwendetes AESGCM-Objekt)
+            ciphertext = self._aesgcm.encrypt(nonce, plaintext, associated_data)
             
             # Format: nonce + ciphertext (enthält bereits den Auth-Tag)
             return nonce + ciphertext
@@ -139,11 +241,8 @@ class AESEncryption:
             nonce = encrypted_data[:self.NONCE_SIZE]
             ciphertext = encrypted_data[self.NONCE_SIZE:]
             
-            # Erstelle AESGCM Cipher
-            aesgcm = AESGCM(self.master_key)
-            
-            # Entschlüssele die Daten
-            plaintext = aesgcm.decrypt(nonce, ciphertext, associated_data)
+            # Entschlüssele die Daten (wiederverwendetes AESGCM-Objekt)
+            plaintext = self._aesgcm.decrypt(nonce, ciphertext, associated_data)
             
             return plaintext
             
@@ -155,7 +254,10 @@ class AESEncryption:
     def encrypt_file(self, input_path: str, output_path: str, 
                      associated_data: Optional[bytes] = None) -> None:
         """
-        Verschlüsselt eine Datei
+        Verschlüsselt eine Datei im Streaming-Format (chunked AES-GCM)
+        
+        Die Datei wird chunkweise gelesen und geschrieben, der Speicherbedarf
+        ist unabhängig von der Dateigröße.
         
         Args:
             input_path: Pfad zur Eingabedatei
@@ -166,16 +268,9 @@ class AESEncryption:
             EncryptionError: Bei Verschlüsselungsfehlern
         """
         try:
-            # Lese die Datei
-            with open(input_path, 'rb') as f:
-                plaintext = f.read()
-            
-            # Verschlüssele die Daten
-            encrypted_data = self.encrypt(plaintext, associated_data)
-            
-            # Schreibe die verschlüsselten Daten
-            with open(output_path, 'wb') as f:
-                f.write(encrypted_data)
+            with open(input_path, 'rb') as f_in, open(output_path, 'wb') as f_out:
+                for block in self.encrypt_stream(f_in, associated_data):
+                    f_out.write(block)
                 
         except EncryptionError:
             raise
@@ -187,6 +282,9 @@ class AESEncryption:
         """
         Entschlüsselt eine Datei
         
+        Unterstützt das Streaming-Format und das alte Einzelnachrichten-Format
+        (nonce + ciphertext + tag).
+        
         Args:
             input_path: Pfad zur verschlüsselten Datei
             output_path: Pfad zur entschlüsselten Ausgabedatei
@@ -196,14 +294,18 @@ class AESEncryption:
             DecryptionError: Bei Entschlüsselungsfehlern
         """
         try:
-            # Lese die verschlüsselte Datei
-            with open(input_path, 'rb') as f:
-                encrypted_data = f.read()
+            with open(input_path, 'rb') as f_in:
+                if self.is_stream_format(f_in):
+                    with open(output_path, 'wb') as f_out:
+                        for block in self.decrypt_stream(f_in, associated_data):
+                            f_out.write(block)
+                    return
+                
+                # Altes Format: eine einzige GCM-Nachricht
+                encrypted_data = f_in.read()
             
-            # Entschlüssele die Daten
             plaintext = self.decrypt(encrypted_data, associated_data)
             
-            # Schreibe die entschlüsselten Daten
             with open(output_path, 'wb') as f:
                 f.write(plaintext)
                 
@@ -212,6 +314,197 @@ class AESEncryption:
         except Exception as e:
             raise DecryptionError(f"Datei-Entschlüsselung fehlgeschlagen: {str(e)}")
     
+    # --- Streaming (chunked AES-GCM) ---
+    
+    @classmethod
+    def is_stream_format(cls, reader: BinaryIO) -> bool:
+        """
+        Prüft, ob ein (seekbarer) Stream im Streaming-Format vorliegt
+        
+        Args:
+            reader: Geöffnete Datei; die Position wird nicht verändert
+        
+        Returns:
+            bool: True wenn der Header des Streaming-Formats vorhanden ist
+        """
+        pos = reader.tell()
+        head = reader.read(len(cls.STREAM_MAGIC) + 1)
+        reader.seek(pos)
+        return head == cls.STREAM_MAGIC + bytes([cls.STREAM_VERSION])
+    
+    @classmethod
+    def _stream_nonce(cls, prefix: bytes, index: int, final: bool) -> bytes:
+        if index > 0xFFFFFFFF:
+            raise EncryptionError("Zu viele Chunks für einen Stream")
+        return prefix + struct.pack('>IB', index, 1 if final else 0)
+    
+    @classmethod
+    def _parse_stream_header(cls, header: bytes) -> Tuple[int, bytes]:
+        if len(header) != cls.STREAM_HEADER_SIZE or not header.startswith(cls.STREAM_MAGIC):
+            raise DecryptionError("Ungültiger Stream-Header")
+        version = header[len(cls.STREAM_MAGIC)]
+        if version != cls.STREAM_VERSION:
+            raise DecryptionError(f"Nicht unterstützte Stream-Version: {version}")
+        chunk_size = struct.unpack('>I', header[5:9])[0]
+        if chunk_size == 0:
+            raise DecryptionError("Ungültige Chunk-Größe im Stream-Header")
+        return chunk_size, header[9:]
+    
+    @staticmethod
+    def _read_exact(reader: BinaryIO, size: int) -> bytes:
+        """Liest bis zu size Bytes (auch von Streams, die kürzere Blöcke liefern)"""
+        parts = []
+        remaining = size
+        while remaining > 0:
+            part = reader.read(remaining)
+            if not part:
+                break
+            parts.append(part)
+            remaining -= len(part)
+        return b''.join(parts)
+    
+    def encrypt_stream(self, reader: BinaryIO, associated_data: Optional[bytes] = None,
+                       chunk_size: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Verschlüsselt einen Stream chunkweise (Generator)
+        
+        Jeder Chunk ist eine eigene GCM-Nachricht. Chunk-Index und Final-Flag
+        stecken in der Nonce und sind damit authentifiziert: Vertauschen,
+        Abschneiden oder Anhängen von Chunks wird beim Entschlüsseln erkannt.
+        Der Header ist Teil der AAD jedes Chunks.
+        
+        Args:
+            reader: Lesbarer Binärstream (z.B. geöffnete Datei)
+            associated_data: Optional - Zusätzliche authentifizierte Daten (AAD)
+            chunk_size: Optional - Klartext-Bytes pro Chunk
+        
+        Yields:
+            bytes: Zuerst der Header, danach die verschlüsselten Chunks
+        
+        Raises:
+            EncryptionError: Bei Verschlüsselungsfehlern
+        """
+        chunk_size = chunk_size or self.STREAM_CHUNK_SIZE
+        prefix = os.urandom(self.STREAM_NONCE_PREFIX_SIZE)
+        header = self.STREAM_MAGIC + bytes([self.STREAM_VERSION]) + struct.pack('>I', chunk_size) + prefix
+        aad = header + (associated_data or b'')
+        aesgcm = self._aesgcm
+        
+        yield header
+        
+        index = 0
+        current = self._read_exact(reader, chunk_size)
+        while True:
+            # Vorauslesen, um den letzten Chunk als final markieren zu können
+            following = self._read_exact(reader, chunk_size) if len(current) == chunk_size else b''
+            final = not following
+            try:
+                yield aesgcm.encrypt(self._stream_nonce(prefix, index, final), current, aad)
+            except EncryptionError:
+                raise
+            except Exception as e:
+                raise EncryptionError(f"Verschlüsselung fehlgeschlagen: {str(e)}")
+            if final:
+                return
+            current = following
+            index += 1
+    
+    def decrypt_stream(self, reader: BinaryIO, associated_data: Optional[bytes] = None) -> Iterator[bytes]:
+        """
+        Entschlüsselt einen Stream im Streaming-Format chunkweise (Generator)
+        
+        Args:
+            reader: Lesbarer Binärstream, positioniert am Header
+            associated_data: Optional - Zusätzliche authentifizierte Daten (AAD)
+        
+        Yields:
+            bytes: Entschlüsselte Klartext-Chunks
+        
+        Raises:
+            DecryptionError: Bei Manipulation, Abschneiden oder falschem Schlüssel
+        """
+        header = self._read_exact(reader, self.STREAM_HEADER_SIZE)
+        chunk_size, prefix = self._parse_stream_header(header)
+        aad = header + (associated_data or b'')
+        aesgcm = self._aesgcm
+        enc_chunk_size = chunk_size + self.STREAM_TAG_SIZE
+        
+        index = 0
+        current = self._read_exact(reader, enc_chunk_size)
+        while True:
+            if len(current) < self.STREAM_TAG_SIZE:
+                raise DecryptionError("Stream wurde abgeschnitten")
+            following = self._read_exact(reader, enc_chunk_size) if len(current) == enc_chunk_size else b''
+            final = not following
+            try:
+                yield aesgcm.decrypt(self._stream_nonce(prefix, index, final), current, aad)
+            except InvalidTag:
+                raise DecryptionError("Authentifizierung fehlgeschlagen - Daten wurden möglicherweise manipuliert")
+            if final:
+                return
+            current = following
+            index += 1
+    
+    def stream_plaintext_size(self, reader: BinaryIO) -> int:
+        """
+        Berechnet die Klartextgröße eines seekbaren Streams ohne zu entschlüsseln
+        
+        Args:
+            reader: Seekbarer Binärstream im Streaming-Format
+        
+        Returns:
+            int: Größe des Klartexts in Bytes
+        """
+        reader.seek(0)
+        chunk_size, _ = self._parse_stream_header(self._read_exact(reader, self.STREAM_HEADER_SIZE))
+        reader.seek(0, os.SEEK_END)
+        body_size = reader.tell() - self.STREAM_HEADER_SIZE
+        enc_chunk_size = chunk_size + self.STREAM_TAG_SIZE
+        chunk_count = max(1, -(-body_size // enc_chunk_size))
+        return body_size - chunk_count * self.STREAM_TAG_SIZE
+    
+    def decrypt_range(self, reader: BinaryIO, start: int, end: int,
+                      associated_data: Optional[bytes] = None) -> Iterator[bytes]:
+        """
+        Entschlüsselt nur den Byte-Bereich [start, end] eines seekbaren Streams
+        (z.B. für HTTP Range Requests). Es werden nur die betroffenen Chunks
+        gelesen und authentifiziert.
+        
+        Args:
+            reader: Seekbarer Binärstream im Streaming-Format
+            start: Erstes Klartext-Byte (inklusive)
+            end: Letztes Klartext-Byte (inklusive)
+            associated_data: Optional - Zusätzliche authentifizierte Daten (AAD)
+        
+        Yields:
+            bytes: Klartext des angefragten Bereichs
+        
+        Raises:
+            DecryptionError: Bei ungültigem Bereich oder Authentifizierungsfehlern
+        """
+        total = self.stream_plaintext_size(reader)
+        if start < 0 or end < start or start >= max(total, 1):
+            raise DecryptionError("Ungültiger Byte-Bereich")
+        end = min(end, total - 1)
+        
+        reader.seek(0)
+        header = self._read_exact(reader, self.STREAM_HEADER_SIZE)
+        chunk_size, prefix = self._parse_stream_header(header)
+        aad = header + (associated_data or b'')
+        aesgcm = self._aesgcm
+        enc_chunk_size = chunk_size + self.STREAM_TAG_SIZE
+        last_index = max(0, (total - 1) // chunk_size) if total else 0
+        
+        for index in range(start // chunk_size, end // chunk_size + 1):
+            reader.seek(self.STREAM_HEADER_SIZE + index * enc_chunk_size)
+            encrypted = self._read_exact(reader, enc_chunk_size)
+            try:
+                plaintext = aesgcm.decrypt(self._stream_nonce(prefix, index, index == last_index), encrypted, aad)
+            except InvalidTag:
+                raise DecryptionError("Authentifizierung fehlgeschlagen - Daten wurden möglicherweise manipuliert")
+            chunk_start = index * chunk_size
+            yield plaintext[max(start - chunk_start, 0):end - chunk_start + 1]
+    
     def encrypt_string(self, text: str, associated_data: Optional[bytes] = None) -> str:
         """
         Verschlüsselt einen String und gibt ihn Base64-kodiert zurück
@@ -256,14 +549,16 @@ class AESEncryption:
         """
         Erstellt eine AESEncryption-Instanz aus einem Base64-kodierten Schlüssel
         
+        Instanzen werden pro Schlüssel gecacht (AESEncryption ist zustandslos).
+        
         Args:
             b64_key: Base64-kodierter Schlüssel
         
         Returns:
-            AESEncryption: Neue Instanz mit dem gegebenen Schlüssel
+            AESEncryption: Instanz mit dem gegebenen Schlüssel
         """
-        master_key = base64.b64decode(b64_key.encode('utf-8'))
-        return cls(master_key=master_key)
+        raw = b64_key.encode('utf-8')
+        return _CIPHER_CACHE.get_or_create(('aesgcm', cls, raw), lambda: cls(master_key=base64.b64decode(raw)))
 
 
 class FileEncryptionManager:
@@ -280,10 +575,18 @@ class FileEncryptionManager:
         """
         self.encryption = encryption
     
+    @staticmethod
+    def _metadata_aad(metadata: dict) -> bytes:
+        import json
+        return json.dumps(metadata, sort_keys=True).encode('utf-8')
+    
     def encrypt_with_metadata(self, file_path: str, metadata: dict) -> bytes:
         """
         Verschlüsselt eine Datei mit Metadaten als AAD
         
+        Hinweis: Liefert das Ergebnis komplett im Speicher. Für große Dateien
+        encrypt_file_with_metadata oder encrypt_stream_with_metadata verwenden.
+        
         Args:
             file_path: Pfad zur Datei
             metadata: Metadaten (z.B. Dateiname, Besitzer, Zeitstempel)
@@ -292,20 +595,43 @@ class FileEncryptionManager:
             bytes: Verschlüsselte Daten
         """
         # Konvertiere Metadaten zu bytes für AAD
-        import json
-        aad = json.dumps(metadata, sort_keys=True).encode('utf-8')
+        aad = self._metadata_aad(metadata)
         
         with open(file_path, 'rb') as f:
             plaintext = f.read()
         
         return self.encryption.encrypt(plaintext, associated_data=aad)
     
+    def encrypt_stream_with_metadata(self, reader: BinaryIO, metadata: dict) -> Iterator[bytes]:
+        """
+        Verschlüsselt einen Stream chunkweise mit Metadaten als AAD (Generator)
+        
+        Args:
+            reader: Lesbarer Binärstream
+            metadata: Metadaten (z.B. Dateiname, Besitzer, Zeitstempel)
+        
+        Yields:
+            bytes: Header und verschlüsselte Chunks
+        """
+        return self.encryption.encrypt_stream(reader, associated_data=self._metadata_aad(metadata))
+    
+    def encrypt_file_with_metadata(self, input_path: str, output_path: str, metadata: dict) -> None:
+        """
+        Verschlüsselt eine Datei chunkweise mit Metadaten als AAD (konstanter Speicherbedarf)
+        
+        Args:
+            input_path: Pfad zur Eingabedatei
+            output_path: Pfad zur verschlüsselten Ausgabedatei
+            metadata: Metadaten (z.B. Dateiname, Besitzer, Zeitstempel)
+        """
+        self.encryption.encrypt_file(input_path, output_path, associated_data=self._metadata_aad(metadata))
+    
     def decrypt_with_metadata(self, encrypted_data: bytes, metadata: dict) -> bytes:
         """
         Entschlüsselt Daten mit Metadaten-Validierung
         
         Args:
-            encrypted_data: Verschlüsselte Daten
+            encrypted_data: Verschlüsselte Daten (Einzelnachricht oder Streaming-Format)
             metadata: Erwartete Metadaten
         
         Returns:
@@ -314,10 +640,43 @@ class FileEncryptionManager:
         Raises:
             DecryptionError: Wenn Metadaten nicht übereinstimmen
         """
-        import json
-        aad = json.dumps(metadata, sort_keys=True).encode('utf-8')
+        from io import BytesIO
+        aad = self._metadata_aad(metadata)
+        
+        stream = BytesIO(encrypted_data)
+        if self.encryption.is_stream_format(stream):
+            return b''.join(self.encryption.decrypt_stream(stream, associated_data=aad))
         
         return self.encryption.decrypt(encrypted_data, associated_data=aad)
+    
+    def decrypt_file_with_metadata(self, input_path: str, output_path: str, metadata: dict) -> None:
+        """
+        Entschlüsselt eine Datei chunkweise mit Metadaten-Validierung
+        
+        Args:
+            input_path: Pfad zur verschlüsselten Datei
+            output_path: Pfad zur entschlüsselten Ausgabedatei
+            metadata: Erwartete Metadaten
+        
+        Raises:
+            DecryptionError: Wenn Metadaten nicht übereinstimmen
+        """
+        self.encryption.decrypt_file(input_path, output_path, associated_data=self._metadata_aad(metadata))
+    
+    def decrypt_range_with_metadata(self, reader: BinaryIO, start: int, end: int, metadata: dict) -> Iterator[bytes]:
+        """
+        Entschlüsselt einen Byte-Bereich [start, end] einer Datei im Streaming-Format
+        
+        Args:
+            reader: Seekbarer Binärstream
+            start: Erstes Klartext-Byte (inklusive)
+            end: Letztes Klartext-Byte (inklusive)
+            metadata: Erwartete Metadaten
+        
+        Yields:
+            bytes: Klartext des angefragten Bereichs
+        """
+        return self.encryption.decrypt_range(reader, start, end, associated_data=self._metadata_aad(metadata))
 
 
 # Utility-Funktionen für einfache Verwendung
@@ -375,3 +734,53 @@ def decrypt_data(encrypted_data: bytes, key: str, metadata: Optional[dict] = Non
         return enc.decrypt(encrypted_data, associated_data=aad)
     
     return enc.decrypt(encrypted_data)
+
+
+def get_fernet(key) -> 'Fernet':
+    """
+    Liefert eine gecachte Fernet-Instanz für den gegebenen Schlüssel
+    
+    Args:
+        key: Fernet-Schlüssel (str oder bytes, urlsafe Base64)
+    
+    Returns:
+        Fernet: Wiederverwendbare Instanz
+    """
+    from cryptography.fernet import Fernet
+    raw = key.encode('utf-8') if isinstance(key, str) else bytes(key)
+    return _CIPHER_CACHE.get_or_create(('fernet', raw), lambda: Fernet(raw))
+
+
+def fernet_encrypt(key, text: str) -> str:
+    """
+    Verschlüsselt einen String mit Fernet (gecachte Instanz)
+    
+    Args:
+        key: Fernet-Schlüssel
+        text: Klartext
+    
+    Returns:
+        str: Fernet-Token
+    """
+    return get_fernet(key).encrypt(text.encode()).decode()
+
+
+def fernet_decrypt(key, token: str) -> str:
+    """
+    Entschlüsselt einen Fernet-Token; das Ergebnis wird pro Schlüssel und Token gecacht
+    
+    Args:
+        key: Fernet-Schlüssel
+        token: Fernet-Token
+    
+    Returns:
+        str: Klartext
+    
+    Raises:
+        cryptography.fernet.InvalidToken: Bei falschem Schlüssel oder manipuliertem Token
+    """
+    raw_key = key.encode('utf-8') if isinstance(key, str) else bytes(key)
+    return _TOKEN_CACHE.get_or_create(
+        ('fernet-token', raw_key, token),
+        lambda: get_fernet(raw_key).decrypt(token.encode()).decode()
+    )
@@ -0,0 +1,387 @@
+"""
+FSRS
+Free Spaced Repetition Scheduler (FSRS-4.5), the alternative to SM-2.
+
+Every card has a memory state: stability S (days until the recall probability
+drops to 90%) and difficulty D (1-10). A review updates both from the rating
+and the recall probability at that moment; the next interval is the time until
+the predicted recall probability falls to the user's desired retention.
+For the same retention this needs fewer reviews than SM-2's fixed ease factors.
+
+The 17 weights can be fitted per user from the review log (optimize_user) and
+reschedule_user() recomputes state and due date of all of a user's cards in one
+vectorized replay of their histories. Both need numpy; single reviews are
+scheduled in plain Python, so the review endpoints work without it.
+"""
+import json
+import math
+from datetime import datetime, timedelta
+from flask import current_app
+from .models import db, CardReview, ReviewLog, SchedulerSettings
+from . import integrations
+
+DEFAULT_WEIGHTS = (
+    0.4872, 1.4003, 3.7145, 13.8206, 5.1618, 1.2298, 0.8975, 0.031, 1.6474,
+    0.1367, 1.0461, 2.1072, 0.0793, 0.3246, 1.587, 0.2272, 2.8755,
+)
+# Parameter ranges of the reference optimizer; the initial stabilities (w0-w3) are fitted on a log scale
+WEIGHT_BOUNDS = (
+    (0.1, 100.0), (0.1, 100.0), (0.1, 100.0), (0.1, 100.0), (1.0, 10.0), (0.001, 4.0),
+    (0.001, 4.0), (0.001, 0.75), (0.0, 4.5), (0.0, 0.8), (0.001, 3.5), (0.001, 5.0),
+    (0.001, 0.25), (0.001, 0.9), (0.0, 4.0), (0.0, 1.0), (1.0, 6.0),
+)
+LOG_SCALED = 4
+
+DECAY = -0.5
+FACTOR = 19 / 81  # R(S, S) = 90%
+MIN_STABILITY = 0.01
+MAX_INTERVAL = 36500  # Days
+RELEARN_DELAY = timedelta(minutes=1)  # "Again" shows the card again in the same session, like SM-2
+MIN_OPTIMIZE_REVIEWS = 400  # Log entries needed before fitting personal weights
+OPTIMIZE_ITERATIONS = 150
+LEARNING_RATE = 0.03
+FINITE_DIFFERENCE = 1e-4
+
+
+def numpy_available():
+    return integrations.available('numpy')
+
+
+def _numpy():
+    # Imported on first use: most workers only schedule single reviews
+    return integrations.load('numpy').np
+
+
+def rating_from_quality(quality):
+    """SM-2 quality (0-5) -> FSRS rating (1=Again, 2=Hard, 3=Good, 4=Easy)"""
+    if quality < 2:
+        return 1
+    if quality == 2:
+        return 2
+    if quality == 5:
+        return 4
+    return 3
+
+
+def weights_for(settings):
+    if settings is not None and settings.weights:
+        return json.loads(settings.weights)
+    return list(DEFAULT_WEIGHTS)
+
+
+def retrievability(elapsed_days, stability):
+    return (1 + FACTOR * elapsed_days / stability) ** DECAY
+
+
+def interval_days(stability, desired_retention):
+    """Days until the recall probability drops to desired_retention (at least one)"""
+    days = stability / FACTOR * (desired_retention ** (1 / DECAY) - 1)
+    return min(max(1, round(days)), MAX_INTERVAL)
+
+
+def _clamp_difficulty(d):
+    return min(max(d, 1.0), 10.0)
+
+
+def initial_state(w, rating):
+    return w[rating - 1], _clamp_difficulty(w[4] - (rating - 3) * w[5])
+
+
+def seed_state(interval, ease_factor, w=DEFAULT_WEIGHTS):
+    """Memory state for a card with SM-2 history only (no log to replay)"""
+    stability = max(interval or 0, 1.0)
+    # Ease 2.5 (SM-2 default) maps to the default difficulty, lower ease to harder cards
+    difficulty = _clamp_difficulty(w[4] - ((ease_factor or 2.5) - 2.5) * 4)
+    return stability, difficulty
+
+
+def next_state(w, stability, difficulty, elapsed_days, rating):
+    """Memory state after a review of a card with a state (elapsed_days >= 1)"""
+    r = retrievability(elapsed_days, stability)
+    if rating == 1:
+        new_s = w[11] * difficulty ** -w[12] * ((stability + 1) ** w[13] - 1) * math.exp(w[14] * (1 - r))
+        new_s = min(new_s, stability)
+    else:
+        bonus = (w[15] if rating == 2 else 1) * (w[16] if rating == 4 else 1)
+        new_s = stability * (1 + math.exp(w[8]) * (11 - difficulty) * stability ** -w[9]
+                             * (math.exp(w[10] * (1 - r)) - 1) * bonus)
+    new_d = difficulty - w[6] * (rating - 3)
+    new_d = w[7] * w[4] + (1 - w[7]) * new_d  # Mean reversion towards the default
+    return max(new_s, MIN_STABILITY), _clamp_difficulty(new_d)
+
+
+def apply_fsrs(review, quality, reviewed_at, elapsed_days, w, desired_retention):
+    """
+    Update a CardReview with one rating. elapsed_days is None for the card's first review.
+    Reviews less than a day apart (relearning after "Again") keep the memory state.
+    """
+    rating = rating_from_quality(quality)
+    if elapsed_days is None:
+        review.stability, review.difficulty = initial_state(w, rating)
+    else:
+        if review.stability is None:
+            review.stability, review.difficulty = seed_state(review.interval, review.ease_factor, w)
+        if elapsed_days >= 1:
+            review.stability, review.difficulty = next_state(w, review.stability, review.difficulty, elapsed_days, rating)
+
+    if rating == 1:
+        review.interval = 0
+        review.review_count = 0
+        review.next_review_at = reviewed_at + RELEARN_DELAY
+    else:
+        review.interval = interval_days(review.stability, desired_retention)
+        review.review_count = (review.review_count or 0) + 1
+        review.next_review_at = reviewed_at + timedelta(days=review.interval)
+    review.last_review_at = reviewed_at
+    return review
+
+
+# --- Vectorized replay (numpy) ---
+
+class History:
+    """Review logs of many cards as padded [cards, reviews] arrays"""
+
+    def __init__(self, rows):
+        # rows: (card_id, rating, elapsed_days, last_interval) ordered by card and time
+        cards = []
+        sequences = []
+        for card_id, rating, elapsed, last_interval in rows:
+            if not cards or cards[-1] != card_id:
+                cards.append(card_id)
+                sequences.append([])
+            sequences[-1].append((rating_from_quality(rating), elapsed, last_interval))
+
+        np = _numpy()
+        n = len(cards)
+        length = max((len(seq) for seq in sequences), default=0)
+        self.card_ids = cards
+        self.ratings = np.zeros((n, length), dtype=np.int8)
+        self.elapsed = np.zeros((n, length))
+        self.mask = np.zeros((n, length), dtype=bool)
+        # Cards reviewed before the log existed start from their logged interval
+        self.seeded = np.zeros(n, dtype=bool)
+        self.seed_stability = np.ones(n)
+        for i, seq in enumerate(sequences):
+            self.ratings[i, :len(seq)] = [rating for rating, _, _ in seq]
+            self.elapsed[i, :len(seq)] = [elapsed or 0 for _, elapsed, _ in seq]
+            self.mask[i, :len(seq)] = True
+            if seq[0][1] is not None:
+                self.seeded[i] = True
+                self.seed_stability[i] = max(seq[0][2] or 0, 1.0)
+
+    def __len__(self):
+        return len(self.card_ids)
+
+    def trainable(self):
+        """Only histories that start with the card's first review"""
+        return self.subset(~self.seeded)
+
+    def subset(self, selection):
+        part = object.__new__(History)
+        part.card_ids = [c for c, keep in zip(self.card_ids, selection) if keep]
+        for name in ('ratings', 'elapsed', 'mask', 'seeded', 'seed_stability'):
+            setattr(part, name, getattr(self, name)[selection])
+        return part
+
+
+def replay(history, weights):
+    """
+    Run all histories through FSRS at once. weights is (17,) or (P, 17) for P weight
+    vectors evaluated side by side (the optimizer's finite differences).
+    Returns stability, difficulty ([P, cards]) and the log loss per weight vector
+    of the recall predictions for reviews after the first one.
+    """
+    np = _numpy()
+    w = np.atleast_2d(np.asarray(weights, dtype=float))[:, :, None]  # [P, 17, 1]
+    p, n = w.shape[0], len(history)
+    s = np.broadcast_to(history.seed_stability, (p, n)).copy()
+    d = np.broadcast_to(w[:, 4], (p, n)).copy()
+    has_state = np.broadcast_to(history.seeded, (p, n)).copy()
+    loss = np.zeros(p)
+    count = 0
+
+    for step in range(history.ratings.shape[1]):
+        present = history.mask[:, step]
+        rating = history.ratings[:, step].astype(float)
+        elapsed = history.elapsed[:, step]
+
+        first = present & ~has_state
+        init_s = np.take_along_axis(w[:, :4, 0], np.clip(rating.astype(int) - 1, 0, 3)[None, :].repeat(p, 0), axis=1)
+        init_d = np.clip(w[:, 4] - (rating - 3) * w[:, 5], 1, 10)
+
+        update = present & has_state & (elapsed >= 1)
+        r = (1 + FACTOR * elapsed / s) ** DECAY
+        recalled = rating > 1
+        if update.any():
+            predicted = np.clip(r, 1e-6, 1 - 1e-6)
+            bce = -np.where(recalled, np.log(predicted), np.log(1 - predicted))
+            loss += np.where(update, bce, 0).sum(axis=1)
+            count += int(update[0].sum())
+
+        forget_s = np.minimum(
+            w[:, 11] * d ** -w[:, 12] * ((s + 1) ** w[:, 13] - 1) * np.exp(w[:, 14] * (1 - r)), s
+        )
+        bonus = np.where(rating == 2, w[:, 15], 1) * np.where(rating == 4, w[:, 16], 1)
+        recall_s = s * (1 + np.exp(w[:, 8]) * (11 - d) * s ** -w[:, 9] * (np.exp(w[:, 10] * (1 - r)) - 1) * bonus)
+        new_s = np.maximum(np.where(recalled, recall_s, forget_s), MIN_STABILITY)
+        new_d = d - w[:, 6] * (rating - 3)
+        new_d = np.clip(w[:, 7] * w[:, 4] + (1 - w[:, 7]) * new_d, 1, 10)
+
+        s = np.where(update, new_s, np.where(first, init_s, s))
+        d = np.where(update, new_d, np.where(first, init_d, d))
+        has_state = has_state | first
+
+    return s, d, loss / max(count, 1), count
+
+
+def _to_unit(w):
+    np = _numpy()
+    lo, hi = np.array(WEIGHT_BOUNDS).T
+    w = np.asarray(w, dtype=float)
+    x = (w - lo) / (hi - lo)
+    x[:LOG_SCALED] = np.log(w[:LOG_SCALED] / lo[:LOG_SCALED]) / np.log(hi[:LOG_SCALED] / lo[:LOG_SCALED])
+    return x
+
+
+def _from_unit(x):
+    np = _numpy()
+    lo, hi = np.array(WEIGHT_BOUNDS).T
+    x = np.clip(x, 0, 1)
+    w = lo + x * (hi - lo)
+    w[..., :LOG_SCALED] = lo[:LOG_SCALED] * (hi[:LOG_SCALED] / lo[:LOG_SCALED]) ** x[..., :LOG_SCALED]
+    return w
+
+
+def fit_weights(history, initial=DEFAULT_WEIGHTS, iterations=OPTIMIZE_ITERATIONS):
+    """
+    Fit the weights to a History with Adam on the log loss. The gradient comes from
+    forward differences, all 18 weight vectors replayed in one vectorized pass.
+    A small pull towards the starting weights keeps sparse histories from overfitting.
+    Returns (weights, loss before, loss after, reviews used).
+    """
+    np = _numpy()
+    x0 = _to_unit(initial)
+    x = x0.copy()
+    m = np.zeros_like(x)
+    v = np.zeros_like(x)
+    probes = np.vstack([np.zeros_like(x), np.eye(len(x)) * FINITE_DIFFERENCE])
+    _, _, start_loss, count = replay(history, initial)
+    if count == 0:
+        return list(initial), None, None, 0
+    pull = 10.0 / count
+
+    for t in range(1, iterations + 1):
+        candidates = np.clip(x + probes, 0, 1)
+        _, _, losses, _ = replay(history, _from_unit(candidates))
+        losses = losses + pull * ((candidates - x0) ** 2).sum(axis=1)
+        grad = (losses[1:] - losses[0]) / FINITE_DIFFERENCE
+        m = 0.9 * m + 0.1 * grad
+        v = 0.999 * v + 0.001 * grad ** 2
+        x = np.clip(x - LEARNING_RATE * (m / (1 - 0.9 ** t)) / (np.sqrt(v / (1 - 0.999 ** t)) + 1e-8), 0, 1)
+
+    weights = _from_unit(x)
+    _, _, end_loss, _ = replay(history, weights)
+    if end_loss[0] > start_loss[0]:
+        return list(initial), float(start_loss[0]), float(start_loss[0]), count
+    return [round(float(value), 4) for value in weights], float(start_loss[0]), float(end_loss[0]), count
+
+
+# --- Per user (needs an app context) ---
+
+def load_history(user_id):
+    rows = db.session.query(
+        ReviewLog.card_id, ReviewLog.rating, ReviewLog.elapsed_days, ReviewLog.last_interval
+    ).filter(ReviewLog.user_id == user_id).order_by(ReviewLog.card_id, ReviewLog.reviewed_at, ReviewLog.id)
+    return History(rows.all())
+
+
+def get_settings(user_id, create=False):
+    settings = SchedulerSettings.query.filter_by(user_id=user_id).first()
+    if settings is None and create:
+        settings = SchedulerSettings(user_id=user_id, scheduler='sm2', desired_retention=0.9)
+        db.session.add(settings)
+    return settings
+
+
+def optimize_user(user_id):
+    """Fit and store personal weights from the user's review log (not committed). Returns the fit summary."""
+    if not numpy_available():
+        raise RuntimeError('numpy is required for the FSRS optimizer')
+    settings = get_settings(user_id, create=True)
+    history = load_history(user_id).trainable()
+    total = int(history.mask.sum())
+    if total < MIN_OPTIMIZE_REVIEWS:
+        return {'optimized': False, 'reviews': total, 'required': MIN_OPTIMIZE_REVIEWS}
+
+    weights, loss_before, loss_after, used = fit_weights(history)
+    settings.weights = json.dumps(weights)
+    settings.optimized_at = datetime.utcnow()
+    settings.optimized_reviews = db.session.query(db.func.count(ReviewLog.id)).filter_by(user_id=user_id).scalar()
+    settings.log_loss = loss_after
+    return {'optimized': True, 'reviews': used, 'log_loss_before': loss_before, 'log_loss_after': loss_after}
+
+
+def reschedule_user(user_id, settings=None):
+    """
+    Recompute stability, difficulty and due date of all of the user's cards with their
+    current weights: logged cards by replaying the log, older cards from their SM-2 state.
+    Cards waiting for a relearning step keep their due date. One bulk UPDATE, not committed.
+    """
+    if not numpy_available():
+        raise RuntimeError('numpy is required to reschedule cards')
+    np = _numpy()
+    settings = settings or get_settings(user_id)
+    w = weights_for(settings)
+    retention = settings.desired_retention if settings else 0.9
+
+    reviews = db.session.query(
+        CardReview.id, CardReview.card_id, CardReview.last_review_at, CardReview.interval, CardReview.ease_factor
+    ).filter(CardReview.user_id == user_id).all()
+    if not reviews:
+        return 0
+
+    history = load_history(user_id)
+    row_of = {card_id: i for i, card_id in enumerate(history.card_ids)}
+    if len(history):
+        replayed_s, replayed_d, _, _ = replay(history, w)
+
+    n = len(reviews)
+    stability = np.empty(n)
+    difficulty = np.empty(n)
+    for i, review in enumerate(reviews):
+        row = row_of.get(review.card_id)
+        if row is not None:
+            stability[i], difficulty[i] = replayed_s[0, row], replayed_d[0, row]
+        else:
+            stability[i], difficulty[i] = seed_state(review.interval, review.ease_factor, w)
+    days = np.clip(np.round(stability / FACTOR * (retention ** (1 / DECAY) - 1)), 1, MAX_INTERVAL)
+
+    mappings = []
+    for i, review in enumerate(reviews):
+        values = {'id': review.id, 'stability': float(stability[i]), 'difficulty': float(difficulty[i])}
+        if review.interval and review.last_review_at:  # Interval 0: relearning step pending
+            values['interval'] = float(days[i])
+            values['next_review_at'] = review.last_review_at + timedelta(days=float(days[i]))
+        mappings.append(values)
+    db.session.execute(db.update(CardReview), mappings)
+    return n
+
+
+def optimize_due_users(min_new_reviews=MIN_OPTIMIZE_REVIEWS):
+    """Refit FSRS users whose log grew by min_new_reviews since the last fit; commits per user"""
+    if not numpy_available():
+        return 0
+    log_counts = dict(db.session.query(ReviewLog.user_id, db.func.count(ReviewLog.id)).group_by(ReviewLog.user_id))
+    refitted = 0
+    for settings in SchedulerSettings.query.filter_by(scheduler='fsrs').all():
+        if log_counts.get(settings.user_id, 0) - (settings.optimized_reviews or 0) < min_new_reviews:
+            continue
+        try:
+            if optimize_user(settings.user_id)['optimized']:
+                reschedule_user(settings.user_id, settings)
+                refitted += 1
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"FSRS optimization failed for user {settings.user_id}: {e}")
+    return refitted
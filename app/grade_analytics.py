@@ -0,0 +1,170 @@
+"""
+Grade Analytics
+Per-user grade summary for the grades view: weighted average, trend and
+running-average timeline per subject, and the overall average (mean of the
+subject averages, as the grades view has always shown it).
+
+Everything is computed in one pass over the user's grades and cached in
+GradeSummary. The grade routes call invalidate(), restores clear the table.
+"What grade do I need" projections come from the cached sums per request.
+
+invalidate() bumps the version of the cached row in the transaction that
+changes the grades. A summary is only stored if the version is still the one
+read before the grades were, so a request that computed from the old grades
+cannot store its result over the invalidation.
+"""
+import json
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from .models import db, Grade, GradeSummary
+
+TIMELINE_POINTS = 20  # Running averages kept per subject
+TREND_DAYS = 30  # Trend = change of the grade per this many days
+
+
+class _SubjectStats:
+    def __init__(self):
+        self.count = 0
+        self.weight = 0.0
+        self.weighted_sum = 0.0
+        # Weighted least squares of value over days since the first grade
+        self.first_date = None
+        self.sum_wt = 0.0
+        self.sum_wtt = 0.0
+        self.sum_wtv = 0.0
+        self.last_date = None
+        self.timeline = []
+
+    def add(self, value, weight, date):
+        if self.first_date is None:
+            self.first_date = date
+        t = (date - self.first_date).total_seconds() / 86400
+        self.count += 1
+        self.weight += weight
+        self.weighted_sum += value * weight
+        self.sum_wt += weight * t
+        self.sum_wtt += weight * t * t
+        self.sum_wtv += weight * t * value
+        self.last_date = date
+        if self.weight > 0:
+            self.timeline.append([date.strftime('%Y-%m-%d'), round(self.average, 2)])
+
+    @property
+    def average(self):
+        return self.weighted_sum / self.weight if self.weight > 0 else None
+
+    @property
+    def trend(self):
+        denominator = self.weight * self.sum_wtt - self.sum_wt ** 2
+        if self.count < 2 or denominator <= 1e-9:
+            return None
+        slope = (self.weight * self.sum_wtv - self.sum_wt * self.weighted_sum) / denominator
+        return round(slope * TREND_DAYS, 3)
+
+
+def compute_summary(user_id):
+    rows = db.session.query(Grade.subject, Grade.value, Grade.weight, Grade.date).filter(
+        Grade.user_id == user_id
+    ).order_by(Grade.date, Grade.id)
+
+    subjects = {}
+    overall_timeline = []
+    for subject, value, weight, date in rows:
+        date = date or datetime.utcnow()
+        stats = subjects.setdefault(subject, _SubjectStats())
+        stats.add(value, weight if weight is not None else 1.0, date)
+        averages = [s.average for s in subjects.values() if s.average is not None]
+        if averages:
+            day = date.strftime('%Y-%m-%d')
+            point = [day, round(sum(averages) / len(averages), 2)]
+            if overall_timeline and overall_timeline[-1][0] == day:
+                overall_timeline[-1] = point
+            else:
+                overall_timeline.append(point)
+
+    averages = [s.average for s in subjects.values() if s.average is not None]
+    return {
+        'overall_average': round(sum(averages) / len(averages), 2) if averages else None,
+        'grade_count': sum(s.count for s in subjects.values()),
+        'timeline': overall_timeline[-TIMELINE_POINTS:],
+        'subjects': [{
+            'subject': name,
+            'average': round(stats.average, 2) if stats.average is not None else None,
+            'grade_count': stats.count,
+            'total_weight': stats.weight,
+            'weighted_sum': stats.weighted_sum,
+            'trend': stats.trend,
+            'last_date': stats.last_date.strftime('%Y-%m-%d'),
+            'timeline': stats.timeline[-TIMELINE_POINTS:]
+        } for name, stats in sorted(subjects.items())],
+        'computed_at': datetime.utcnow().isoformat()
+    }
+
+
+def _dialect_insert():
+    """insert() with ON CONFLICT support for the session's dialect, None if it has none"""
+    name = db.session.get_bind().dialect.name
+    if name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    return insert
+
+
+def get_summary(user_id):
+    """The cached summary, computed and stored on a miss"""
+    # Read before the grades: the version the summary is computed for
+    cached = db.session.query(GradeSummary.version, GradeSummary.data).filter_by(user_id=user_id).first()
+    if cached is not None and cached.data is not None:
+        return json.loads(cached.data)
+    summary = compute_summary(user_id)
+
+    table = GradeSummary.__table__
+    values = {'data': json.dumps(summary), 'computed_at': datetime.utcnow()}
+    if cached is not None:
+        # No-op if the grades changed in the meantime
+        db.session.execute(table.update().where(
+            table.c.user_id == user_id, table.c.version == cached.version
+        ).values(**values))
+        db.session.commit()
+        return summary
+
+    insert = _dialect_insert()
+    if insert is not None:
+        db.session.execute(insert(table).values(user_id=user_id, version=0, **values)
+                           .on_conflict_do_nothing(index_elements=['user_id']))
+        db.session.commit()
+        return summary
+    try:
+        db.session.execute(table.insert().values(user_id=user_id, version=0, **values))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()  # Stored or invalidated concurrently by another request
+    return summary
+
+
+def invalidate(user_id):
+    """Mark the user's cached summary stale (part of the caller's transaction)"""
+    table = GradeSummary.__table__
+    stale = {'version': table.c.version + 1, 'data': None}
+    insert = _dialect_insert()
+    if insert is not None:
+        # The row is created if missing, so that a summary computed without one is not stored either
+        db.session.execute(insert(table).values(user_id=user_id, version=1, data=None)
+                           .on_conflict_do_update(index_elements=['user_id'], set_=stale))
+    elif not db.session.execute(table.update().where(table.c.user_id == user_id).values(**stale)).rowcount:
+        db.session.execute(table.insert().values(user_id=user_id, version=1, data=None))
+
+
+def forget(user_id):
+    """Delete the user's cached summary (before the user is deleted)"""
+    GradeSummary.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+
+
+def needed_grade(subject, target, weight=1.0):
+    """Grade with the given weight that brings the subject average to target"""
+    if weight <= 0:
+        return None
+    return round((target * (subject['total_weight'] + weight) - subject['weighted_sum']) / weight, 2)
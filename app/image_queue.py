@@ -0,0 +1,199 @@
+"""
+Image Processing Queue
+Uploads are written to disk unprocessed and a pending row is returned right away;
+EXIF transpose, resize and JPEG encoding run in a process pool, so request
+workers never spend CPU time on image encoding.
+
+Rows (TaskImage, MealPlan, TimetableImage) carry a status column:
+pending -> ready (or failed). Stale pending rows (e.g. after a worker restart)
+are picked up again by requeue_stale_images().
+"""
+import os
+import shutil
+import atexit
+import threading
+import multiprocessing
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+from .image_variants import write_variants, generate_variants_for_file, supported_formats
+
+STATUS_PENDING = 'pending'
+STATUS_READY = 'ready'
+STATUS_FAILED = 'failed'
+
+INCOMING_FOLDER = '_incoming'  # Raw uploads waiting for processing (inside UPLOAD_FOLDER)
+MAX_WIDTH = 2000
+STALE_AFTER = timedelta(minutes=10)  # Pending rows older than this are requeued
+
+_IMAGE_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def process_image_file(src_path, dest_path, max_width=MAX_WIDTH, variant_formats=()):
+    """
+    Convert a raw upload into an optimized JPEG plus its responsive variants
+    (runs in a pool process, no app context).
+    Files Pillow cannot read are moved unchanged, like the old synchronous fallback.
+    Returns True if the image was processed, False if it was stored as-is.
+    """
+    from PIL import Image, ImageOps
+
+    if not os.path.exists(src_path) and os.path.exists(dest_path):
+        return True  # Same content, already processed by a concurrent job (see upload_store)
+
+    tmp_path = f"{dest_path}.{os.getpid()}.tmp"
+    try:
+        with Image.open(src_path) as img:
+            # Correct orientation based on EXIF (crucial for mobile uploads)
+            img = ImageOps.exif_transpose(img)
+
+            if img.mode in ("RGBA", "P"):
+                img = img.convert("RGB")
+
+            # Resize/Compress if too large
+            if img.width > max_width:
+                ratio = max_width / img.width
+                new_h = int(img.height * ratio)
+                img = img.resize((max_width, new_h), Image.Resampling.LANCZOS)
+
+            img.save(tmp_path, "JPEG", quality=75, optimize=True)
+            if variant_formats:
+                write_variants(img, dest_path, variant_formats)
+        os.replace(tmp_path, dest_path)
+        _remove_incoming(src_path)
+        return True
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            shutil.move(src_path, dest_path)
+        except FileNotFoundError:
+            if os.path.exists(dest_path):
+                return True  # A concurrent job for the same key finished first
+            raise
+        return False
+
+
+def _remove_incoming(src_path):
+    # Identical uploads share one incoming file, a concurrent job may have removed it already
+    try:
+        os.remove(src_path)
+    except FileNotFoundError:
+        pass
+
+
+def start_pool(app):
+    """
+    Create the pool and fork its processes right away. create_app() calls this
+    before the scheduler or any request thread runs: forking a multi-threaded
+    process can hand the children locks another thread held at that moment
+    (e.g. the logging lock). fork is used where available, since spawn/forkserver
+    children re-import __main__ (run.py calls create_app).
+    """
+    global _IMAGE_EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _IMAGE_EXECUTOR is not None:
+            return _IMAGE_EXECUTOR
+        workers = app.config.get('IMAGE_WORKERS', 2)
+        forking = 'fork' in multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork') if forking else None
+        _IMAGE_EXECUTOR = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        atexit.register(_IMAGE_EXECUTOR.shutdown, wait=False)
+        if forking:
+            # A fork pool starts all its processes on the first submit, not on demand
+            _IMAGE_EXECUTOR.submit(os.getpid)
+        return _IMAGE_EXECUTOR
+
+
+def _get_executor():
+    return _IMAGE_EXECUTOR or start_pool(current_app)
+
+
+def incoming_path(upload_folder, filename):
+    return os.path.join(upload_folder, INCOMING_FOLDER, filename)
+
+
+def _finish(app, model, row_id, future):
+    """Pool callback (runs in a thread of this process): store the result status"""
+    with app.app_context():
+        from .models import db
+        try:
+            future.result()
+            status = STATUS_READY
+        except Exception as e:
+            app.logger.error(f"Image processing failed for {model.__name__} {row_id}: {e}")
+            status = STATUS_FAILED
+        try:
+            row = db.session.get(model, row_id)
+            if row is not None:
+                row.status = status
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Could not update image status for {model.__name__} {row_id}: {e}")
+        finally:
+            db.session.remove()
+
+
+def enqueue(model, row_id, filename):
+    """
+    Queue processing of the incoming file for a committed row.
+    The row's status is set to ready/failed when the pool is done.
+    """
+    app = current_app._get_current_object()
+    upload_folder = app.config['UPLOAD_FOLDER']
+    future = _get_executor().submit(
+        process_image_file,
+        incoming_path(upload_folder, filename),
+        os.path.join(upload_folder, filename),
+        MAX_WIDTH,
+        variant_formats()
+    )
+    future.add_done_callback(lambda f: _finish(app, model, row_id, f))
+    return future
+
+
+def enqueue_variants(filename):
+    """Queue variant generation for an image stored as-is (chat uploads)"""
+    app = current_app._get_current_object()
+    future = _get_executor().submit(
+        generate_variants_for_file,
+        os.path.join(app.config['UPLOAD_FOLDER'], filename),
+        variant_formats()
+    )
+
+    def log_failure(f):
+        if f.exception() is not None:
+            app.logger.warning(f"Variant generation failed for {filename}: {f.exception()}")
+    future.add_done_callback(log_failure)
+    return future
+
+
+def variant_formats():
+    """Variant formats from IMAGE_VARIANT_FORMATS that Pillow can encode"""
+    return supported_formats(current_app.config.get('IMAGE_VARIANT_FORMATS', ('avif', 'webp')))
+
+
+def image_filename(row):
+    return getattr(row, 'filename', None) or row.image_path
+
+
+def requeue_stale_images():
+    """Requeue pending rows whose job was lost (worker restart); needs an app context"""
+    from .models import TaskImage, MealPlan, TimetableImage
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    cutoff = datetime.utcnow() - STALE_AFTER
+    requeued = 0
+    for model in (TaskImage, MealPlan, TimetableImage):
+        for row in model.query.filter(model.status == STATUS_PENDING, model.created_at < cutoff).all():
+            filename = image_filename(row)
+            if os.path.exists(incoming_path(upload_folder, filename)):
+                enqueue(model, row.id, filename)
+                requeued += 1
+            else:
+                # Already processed (callback lost) or raw file gone
+                row.status = STATUS_READY if os.path.exists(os.path.join(upload_folder, filename)) else STATUS_FAILED
+    from .models import db
+    db.session.commit()
+    return requeued
@@ -0,0 +1,136 @@
+"""
+Responsive Image Variants
+Downscaled WebP (and AVIF, if Pillow supports it) copies of uploaded images,
+stored next to the original as <name>_w<width>.<ext>. Clients pick a size via
+srcset instead of always decoding the 2000px JPEG.
+
+Images are never upscaled: a variant is written for each standard width below
+the image width, plus one at the native width for images narrower than the
+largest one. srcset lists the variants found on disk.
+"""
+import os
+
+VARIANT_WIDTHS = (320, 640, 1280)
+VARIANT_MIMES = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+}
+# Encoder settings per format (AVIF gets the same visual quality at a lower number)
+VARIANT_SAVE_OPTIONS = {
+    'webp': {'quality': 72, 'method': 4},
+    'avif': {'quality': 55, 'speed': 8},
+}
+# Original formats we generate variants for (animated GIFs would lose their animation)
+SOURCE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+
+_SUPPORTED_FORMATS = None
+
+
+def supported_formats(configured=('avif', 'webp')):
+    """Configured variant formats the installed Pillow can encode (best first)"""
+    global _SUPPORTED_FORMATS
+    if _SUPPORTED_FORMATS is None:
+        from PIL import features
+        available = []
+        for fmt in VARIANT_MIMES:
+            try:
+                if features.check(fmt):
+                    available.append(fmt)
+            except ValueError:
+                pass  # Older Pillow without this feature
+        _SUPPORTED_FORMATS = available
+    return [fmt for fmt in _SUPPORTED_FORMATS if fmt in configured]
+
+
+def variant_filename(filename, width, fmt):
+    stem = os.path.splitext(filename)[0]
+    return f"{stem}_w{width}.{fmt}"
+
+
+def variant_widths(image_width):
+    """Widths written for an image of this width"""
+    widths = [w for w in VARIANT_WIDTHS if w < image_width]
+    if image_width <= VARIANT_WIDTHS[-1]:
+        widths.append(image_width)
+    return widths
+
+
+def existing_variants(upload_folder, filename, formats=tuple(VARIANT_MIMES)):
+    """{ fmt: [(width, variant filename)] by width } of the variants on disk"""
+    folder = os.path.join(upload_folder, os.path.dirname(filename))
+    prefix = os.path.basename(os.path.splitext(filename)[0]) + '_w'
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return {}
+    found = {}
+    for name in names:
+        if not name.startswith(prefix):
+            continue
+        width, _, fmt = name[len(prefix):].partition('.')
+        if width.isdigit() and fmt in formats:
+            found.setdefault(fmt, []).append((int(width), variant_filename(filename, int(width), fmt)))
+    for variants in found.values():
+        variants.sort()
+    return found
+
+
+def has_variants(filename):
+    return os.path.splitext(filename)[1].lower() in SOURCE_EXTENSIONS
+
+
+def write_variants(img, dest_path, formats):
+    """
+    Write the variants of an (already transposed, RGB) image next to dest_path
+    (see variant_widths). Runs in the image pool process.
+    """
+    from PIL import Image
+
+    folder = os.path.dirname(dest_path)
+    filename = os.path.basename(dest_path)
+    for width in variant_widths(img.width):
+        if width < img.width:
+            resized = img.resize((width, max(1, round(img.height * width / img.width))), Image.Resampling.LANCZOS)
+        else:
+            resized = img
+        for fmt in formats:
+            target = os.path.join(folder, variant_filename(filename, width, fmt))
+            tmp_path = f"{target}.{os.getpid()}.tmp"
+            resized.save(tmp_path, fmt.upper(), **VARIANT_SAVE_OPTIONS[fmt])
+            os.replace(tmp_path, target)
+
+
+def generate_variants_for_file(path, formats):
+    """Create variants for an image that is already stored (chat uploads keep their original)"""
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        write_variants(img, path, formats)
+    return True
+
+
+def srcset(variants):
+    return ', '.join(f"/uploads/{name} {width}w" for width, name in variants)
+
+
+def image_sources(upload_folder, filename, formats):
+    """
+    srcset strings per MIME type for a stored image, e.g. for <picture><source type=... srcset=...>.
+    Only variants already on disk are listed; {} for files without variants.
+    """
+    if not filename or not has_variants(filename):
+        return {}
+    found = existing_variants(upload_folder, filename, formats)
+    return {VARIANT_MIMES[fmt]: srcset(found[fmt]) for fmt in formats if fmt in found}
+
+
+def delete_variants(upload_folder, filename, formats=tuple(VARIANT_MIMES)):
+    for variants in existing_variants(upload_folder, filename, formats).values():
+        for _, name in variants:
+            try:
+                os.remove(os.path.join(upload_folder, name))
+            except OSError:
+                pass
@@ -0,0 +1,86 @@
+"""
+Optional Integrations
+Registry of the subsystems that depend on heavy or optional packages. Their
+modules are imported on first use instead of at worker boot, so a deployment
+that never configures Google Drive or WebUntis, and a worker that never sends
+a push notification, does not load google-api-python-client, webuntis or
+pywebpush (see benchmarks/bench_imports.py).
+
+    google = integrations.load('drive')   # imported once per process
+    google.build('drive', 'v3', credentials=...)
+    integrations.available('numpy')       # installed? (without importing it)
+
+A new integration is one register() call below; callers go through load().
+"""
+import importlib
+import importlib.util
+import threading
+from types import SimpleNamespace
+
+
+class IntegrationUnavailable(RuntimeError):
+    """The packages of an integration are not installed"""
+
+
+_REGISTRY = {}  # name -> (pip package, {attribute: 'module' or 'module:member'})
+_LOADED = {}
+_LOCK = threading.Lock()
+
+
+def register(name, package, **exports):
+    _REGISTRY[name] = (package, exports)
+
+
+register('webpush', 'pywebpush',
+         webpush='pywebpush:webpush',
+         WebPushException='pywebpush:WebPushException')
+register('drive', 'google-api-python-client google-auth-oauthlib',
+         Credentials='google.oauth2.credentials:Credentials',
+         Flow='google_auth_oauthlib.flow:Flow',
+         build='googleapiclient.discovery:build',
+         HttpError='googleapiclient.errors:HttpError')
+register('untis', 'webuntis',
+         Session='webuntis:Session',
+         RemoteError='webuntis.errors:RemoteError')
+register('markdown', 'Markdown',
+         markdown='markdown:markdown')
+register('numpy', 'numpy',  # FSRS optimizer and rescheduling
+         np='numpy')
+
+
+def registered():
+    return sorted(_REGISTRY)
+
+
+def is_loaded(name):
+    return name in _LOADED
+
+
+def available(name):
+    """Whether the packages of the integration are installed, without importing them"""
+    _, exports = _REGISTRY[name]
+    for target in exports.values():
+        top_level = target.partition(':')[0].split('.')[0]
+        if importlib.util.find_spec(top_level) is None:
+            return False
+    return True
+
+
+def load(name):
+    """Import the integration (once per process); returns a namespace of its exports"""
+    loaded = _LOADED.get(name)
+    if loaded is not None:
+        return loaded
+    package, exports = _REGISTRY[name]
+    with _LOCK:
+        if name not in _LOADED:
+            values = {}
+            try:
+                for attribute, target in exports.items():
+                    module_name, _, member = target.partition(':')
+                    module = importlib.import_module(module_name)
+                    values[attribute] = getattr(module, member) if member else module
+            except ImportError as e:
+                raise IntegrationUnavailable(f"{name} needs {package} on the server ({e})") from e
+            _LOADED[name] = SimpleNamespace(**values)
+    return _LOADED[name]
@@ -13,6 +13,7 @@ class TimetableImage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     class_id = db.Column(db.Integer, db.ForeignKey('school_class.id'), nullable=True)
     image_path = db.Column(db.String(512), nullable=False)
+    status = db.Column(db.String(16), default='ready')  # pending, ready, failed (see image_queue)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 # Junction table for subjects shared between classes
@@ -102,6 +103,10 @@ class PushSubscription(db.Model):
     p256dh_key = db.Column(db.String(128))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_push_subscription_user_id', 'user_id'),
+    )
+
 class Task(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -117,10 +122,19 @@ class Task(db.Model):
     deleted_at = db.Column(db.DateTime, nullable=True)
     images = db.relationship('TaskImage', backref='task', lazy='dynamic')
 
+    # Listings filter deleted_at IS NULL; the class OR shared-subject listing needs full
+    # indexes (SQLite's multi-index OR plan skips partial indexes), the rest the partial one
+    __table_args__ = (
+        db.Index('ix_task_class_live_due', 'class_id', 'deleted_at', 'due_date'),
+        db.Index('ix_task_subject_live', 'subject_id', 'deleted_at'),
+        db.Index('ix_task_live_due', 'due_date', sqlite_where=db.text('deleted_at IS NULL')),
+    )
+
 class TaskImage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
     filename = db.Column(db.String(256), nullable=False)
+    status = db.Column(db.String(16), default='ready')  # pending, ready, failed (see image_queue)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class TaskCompletion(db.Model):
@@ -129,6 +143,10 @@ class TaskCompletion(db.Model):
     task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
     is_done = db.Column(db.Boolean, default=False)
 
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'task_id', name='_user_task_completion_uc'),
+    )
+
 class Event(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -140,6 +158,13 @@ class Event(db.Model):
     description = db.Column(db.Text)
     deleted_at = db.Column(db.DateTime, nullable=True)
 
+    # Same access paths as Task
+    __table_args__ = (
+        db.Index('ix_event_class_live_date', 'class_id', 'deleted_at', 'date'),
+        db.Index('ix_event_subject_live', 'subject_id', 'deleted_at'),
+        db.Index('ix_event_live_date', 'date', sqlite_where=db.text('deleted_at IS NULL')),
+    )
+
 class Grade(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -152,6 +177,14 @@ class Grade(db.Model):
     date = db.Column(db.DateTime, default=datetime.utcnow)
     description = db.Column(db.Text)
 
+class GradeSummary(db.Model):
+    """Cached grade analytics of a user (grade_analytics.py), invalidated whenever their grades change"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, unique=True)
+    data = db.Column(db.Text)  # JSON, None = invalidated
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Bumped by every invalidation
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class AuditLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -159,6 +192,10 @@ class AuditLog(db.Model):
     action = db.Column(db.String(256), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_audit_log_class_timestamp', 'class_id', 'timestamp'),
+    )
+
 class Subject(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(128), nullable=False)
@@ -197,12 +234,20 @@ class TaskMessage(db.Model):
     task = db.relationship('Task', backref='messages')
     parent = db.relationship('TaskMessage', remote_side=[id], backref=db.backref('replies', lazy='dynamic'))
 
+    __table_args__ = (
+        db.Index('ix_task_message_task_created', 'task_id', 'created_at'),
+    )
+
 class TaskChatRead(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
     last_read_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'task_id', name='_user_task_chat_read_uc'),
+    )
+
 class GlobalSetting(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     key = db.Column(db.String(64), unique=True, nullable=False)
@@ -222,8 +267,8 @@ class GlobalSetting(db.Model):
         setting.value = value
         db.session.commit()
 
-from cryptography.fernet import Fernet
 from flask import current_app
+from .encryption import fernet_encrypt, fernet_decrypt
 
 class UntisCredential(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -239,15 +284,13 @@ class UntisCredential(db.Model):
     def set_password(self, password_text):
         if not password_text:
             return
-        f = Fernet(current_app.config['UNTIS_FERNET_KEY'])
-        self.password = f.encrypt(password_text.encode()).decode()
+        self.password = fernet_encrypt(current_app.config['UNTIS_FERNET_KEY'], password_text)
 
     def get_password(self):
         if not self.password:
             return ""
         try:
-            f = Fernet(current_app.config['UNTIS_FERNET_KEY'])
-            return f.decrypt(self.password.encode()).decode()
+            return fernet_decrypt(current_app.config['UNTIS_FERNET_KEY'], self.password)
         except Exception:
             # Fallback for old plain text passwords if decryption fails
             # This is only useful during transition.
@@ -275,8 +318,7 @@ class DriveOAuthToken(db.Model):
         if not token_text:
             return
         from flask import current_app
-        f = Fernet(current_app.config['UNTIS_FERNET_KEY'])
-        self.access_token = f.encrypt(token_text.encode()).decode()
+        self.access_token = fernet_encrypt(current_app.config['UNTIS_FERNET_KEY'], token_text)
     
     def get_access_token(self):
         """Decrypt and return access token"""
@@ -284,8 +326,7 @@ class DriveOAuthToken(db.Model):
             return ""
         try:
             from flask import current_app
-            f = Fernet(current_app.config['UNTIS_FERNET_KEY'])
-            return f.decrypt(self.access_token.encode()).decode()
+            return fernet_decrypt(current_app.config['UNTIS_FERNET_KEY'], self.access_token)
         except Exception:
             return self.access_token
     
@@ -294,8 +335,7 @@ class DriveOAuthToken(db.Model):
         if not token_text:
             return
         from flask import current_app
-        f = Fernet(current_app.config['UNTIS_FERNET_KEY'])
-        self.refresh_token = f.encrypt(token_text.encode()).decode()
+        self.refresh_token = fernet_encrypt(current_app.config['UNTIS_FERNET_KEY'], token_text)
     
     def get_refresh_token(self):
         """Decrypt and return refresh token"""
@@ -303,8 +343,7 @@ class DriveOAuthToken(db.Model):
             return ""
         try:
             from flask import current_app
-            f = Fernet(current_app.config['UNTIS_FERNET_KEY'])
-            return f.decrypt(self.refresh_token.encode()).decode()
+            return fernet_decrypt(current_app.config['UNTIS_FERNET_KEY'], self.refresh_token)
         except Exception:
             return self.refresh_token
 
@@ -318,6 +357,7 @@ class MealPlan(db.Model):
     image_path = db.Column(db.String(512), nullable=False)
     extracted_text = db.Column(db.Text, nullable=True)
     week_start = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(16), default='ready')  # pending, ready, failed (see image_queue)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class DriveFolder(db.Model):
@@ -342,6 +382,10 @@ class DriveFolder(db.Model):
     subject_rel = db.relationship('Subject', backref='drive_folders')
     school_class_rel = db.relationship('SchoolClass', backref='drive_folders_rel')
 
+    __table_args__ = (
+        db.Index('ix_drive_folder_folder_id', 'folder_id'),
+    )
+
 class DriveFile(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     drive_folder_id = db.Column(db.Integer, db.ForeignKey('drive_folder.id'), nullable=False)
@@ -388,13 +432,14 @@ class Deck(db.Model):
     is_public = db.Column(db.Boolean, default=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    card_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')  # Kept by decks.py
     
     user = db.relationship('User', backref='decks')
     cards = db.relationship('Flashcard', backref='deck', lazy='dynamic', cascade="all, delete-orphan")
 
 class Flashcard(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    deck_id = db.Column(db.Integer, db.ForeignKey('deck.id'), nullable=False)
+    deck_id = db.Column(db.Integer, db.ForeignKey('deck.id'), nullable=False, index=True)
     front = db.Column(db.Text, nullable=False)
     back = db.Column(db.Text, nullable=False)
     image_url = db.Column(db.String(512)) # Optional image
@@ -411,10 +456,115 @@ class CardReview(db.Model):
     interval = db.Column(db.Float, default=0.0) # Days (Float for more precision)
     ease_factor = db.Column(db.Float, default=2.5)
     review_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)  # First review (daily new-card limit)
+    # FSRS memory state (see fsrs.py), None until the card is reviewed with FSRS
+    stability = db.Column(db.Float)
+    difficulty = db.Column(db.Float)
     
     card = db.relationship('Flashcard', backref=db.backref('reviews', lazy='dynamic'))
     user = db.relationship('User', backref='card_reviews')
 
     __table_args__ = (
         db.UniqueConstraint('user_id', 'card_id', name='_user_card_review_uc'),
+        db.Index('ix_card_review_user_next_review', 'user_id', 'next_review_at'),  # Due cards per user
+    )
+
+class ReviewLog(db.Model):
+    """Every rating of a card (CardReview only keeps the current state); the FSRS optimizer fits on it"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    card_id = db.Column(db.Integer, db.ForeignKey('flashcard.id'), nullable=False)
+    rating = db.Column(db.Integer, nullable=False)  # SM-2 quality 0-5
+    reviewed_at = db.Column(db.DateTime, nullable=False)
+    elapsed_days = db.Column(db.Float)  # Since the previous review, None for the first review of the card
+    last_interval = db.Column(db.Float)  # Interval before this review
+    scheduler = db.Column(db.String(8))
+
+    __table_args__ = (
+        db.Index('ix_review_log_user_card_time', 'user_id', 'card_id', 'reviewed_at'),
+    )
+
+class SchedulerSettings(db.Model):
+    """Per-user spaced repetition scheduler ('sm2' or 'fsrs') and fitted FSRS weights"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, unique=True)
+    scheduler = db.Column(db.String(8), default='sm2')
+    desired_retention = db.Column(db.Float, default=0.9)
+    weights = db.Column(db.Text)  # JSON list, None = FSRS defaults
+    optimized_at = db.Column(db.DateTime)
+    optimized_reviews = db.Column(db.Integer, default=0)  # Log entries the weights were fitted on
+    log_loss = db.Column(db.Float)
+
+class ReviewBatch(db.Model):
+    """A processed batch of offline reviews; a retried request with the same key gets the stored response"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    idempotency_key = db.Column(db.String(64), nullable=False)
+    response = db.Column(db.Text)  # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'idempotency_key', name='_user_review_batch_uc'),
+    )
+
+class ChangeLog(db.Model):
+    """Row change journal for incremental backups (filled by the session listeners in backup.py)"""
+    id = db.Column(db.Integer, primary_key=True)  # Revision mark
+    table_name = db.Column(db.String(64), nullable=False)
+    row_pk = db.Column(db.Integer, nullable=True)  # None = whole table changed (bulk statement)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Revision marks must never be reused after old entries are pruned
+    __table_args__ = {'sqlite_autoincrement': True}
+
+
+class BackupRecord(db.Model):
+    """A produced backup archive; the manifest is the base for the next incremental/differential backup"""
+    id = db.Column(db.Integer, primary_key=True)
+    backup_id = db.Column(db.String(36), unique=True, nullable=False)
+    kind = db.Column(db.String(16), nullable=False)  # full, incremental, differential
+    parent_id = db.Column(db.String(36), nullable=True)  # backup_id of the base archive
+    revision = db.Column(db.Integer, default=0)  # Highest ChangeLog.id contained
+    manifest = db.Column(db.Text)  # JSON, includes the upload hash map
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class UploadBlob(db.Model):
+    """A content-addressed upload file (see upload_store); ref_count = rows pointing at it"""
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(128), unique=True, nullable=False)  # ab/cd/<sha256>.<ext> below UPLOAD_FOLDER
+    digest = db.Column(db.String(64), nullable=False, index=True)
+    size = db.Column(db.Integer, default=0)
+    ref_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)  # Last reference change (GC grace period)
+
+
+class ChunkedUpload(db.Model):
+    """A resumable upload in progress (see chunked_upload); removed once completed or expired"""
+    id = db.Column(db.Integer, primary_key=True)
+    upload_id = db.Column(db.String(32), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    purpose = db.Column(db.String(16), nullable=False)  # chat, deck_import
+    target_id = db.Column(db.Integer, nullable=True)  # Task id for chat attachments
+    filename = db.Column(db.String(256), nullable=False)
+    total_size = db.Column(db.BigInteger, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    sha256 = db.Column(db.String(64), nullable=True)  # Expected checksum of the whole file (optional)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    parts = db.relationship('ChunkedUploadPart', backref='upload', lazy='dynamic', cascade='all, delete-orphan')
+
+
+class ChunkedUploadPart(db.Model):
+    """A received and verified chunk of a ChunkedUpload"""
+    id = db.Column(db.Integer, primary_key=True)
+    upload_id = db.Column(db.Integer, db.ForeignKey('chunked_upload.id'), nullable=False)
+    index = db.Column(db.Integer, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    sha256 = db.Column(db.String(64), nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('upload_id', 'index', name='_chunked_upload_part_uc'),
     )
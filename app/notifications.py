@@ -10,7 +10,8 @@ except ImportError:
 
 from app import db, scheduler
 from app.models import User, PushSubscription, NotificationSetting, Task, Event
-from pywebpush import webpush, WebPushException
+from app import integrations
+from sqlalchemy.exc import IntegrityError
 
 def get_local_now():
     """Returns the current time in Europe/Berlin timezone"""
@@ -95,18 +96,32 @@ def get_or_create_vapid_keys():
         # Fallback (should not happen in prod ideally, but prevents crash)
         return None, None
 
-VAPID_PRIVATE_KEY, VAPID_PUBLIC_KEY = get_or_create_vapid_keys()
+_VAPID_KEYS = None
+
+def get_vapid_keys():
+    """(private_key, public_key), loaded or generated on first use (not at import: every worker imports this module)"""
+    global _VAPID_KEYS
+    if _VAPID_KEYS is None:
+        _VAPID_KEYS = get_or_create_vapid_keys()
+    return _VAPID_KEYS
+
 VAPID_CLAIMS = {"sub": "mailto:admin@l8testudy.app"}
 
 def send_web_push(subscription_info, message_body):
+    """True if sent (or failed for a passing reason), False if the subscription is invalid, None without pywebpush"""
     try:
-        webpush(
+        push = integrations.load('webpush')
+    except integrations.IntegrationUnavailable as e:
+        logger.error(f"WebPush error: {e}")
+        return None
+    try:
+        push.webpush(
             subscription_info=subscription_info,
             data=json.dumps(message_body),
-            vapid_private_key=VAPID_PRIVATE_KEY,
+            vapid_private_key=get_vapid_keys()[0],
             vapid_claims=VAPID_CLAIMS
         )
-    except WebPushException as ex:
+    except push.WebPushException as ex:
         # Attempt to get status code from response
         status_code = None
         if ex.response and hasattr(ex.response, 'status_code'):
@@ -131,7 +146,7 @@ def send_web_push(subscription_info, message_body):
     return True
 
 def notify_user(user, title, body, url='/'):
-    """Sends a notification to a specific user via all their subscriptions. Returns True if at least one sub exists."""
+    """Sends a notification to a specific user via all their subscriptions. Returns True if it went to at least one."""
     subs = PushSubscription.query.filter_by(user_id=user.id).all()
     if not subs:
         logger.info(f"Notification skipped: User {user.username} has no push subscriptions.")
@@ -145,6 +160,7 @@ def notify_user(user, title, body, url='/'):
     }
     
     sent_count = 0
+    removed = False
     for sub in subs:
         sub_info = {
             "endpoint": sub.endpoint,
@@ -157,35 +173,45 @@ def notify_user(user, title, body, url='/'):
         if success is False:
             logger.info(f"Removing invalid subscription for user {user.username}")
             db.session.delete(sub)
-        else:
+            removed = True
+        elif success:
             sent_count += 1
     
-    db.session.commit()
+    # Only write when something changed: a commit per recipient serialized the
+    # fan-out on the SQLite write lock
+    if removed:
+        db.session.commit()
     return sent_count > 0
 
+def ensure_notification_settings(users):
+    """Create missing default settings for the users, in one commit"""
+    for _ in range(3):
+        missing = [user for user in users if not user.notification_settings]
+        if not missing:
+            return
+        for user in missing:
+            user.notification_settings = NotificationSetting(user_id=user.id)
+            db.session.add(user.notification_settings)
+        try:
+            db.session.commit()
+            return
+        except IntegrityError:
+            # Some were created concurrently by another worker: reload and create the rest
+            db.session.rollback()
+
 def notify_new_task(task):
     """Notify all users (except author) that a new task was created"""
     users = User.query.filter(User.id != task.user_id).all()
+    ensure_notification_settings(users)
     for user in users:
-        # Check settings
-        if not user.notification_settings:
-             # Create default settings if missing
-             user.notification_settings = NotificationSetting(user_id=user.id)
-             db.session.add(user.notification_settings)
-             db.session.commit()
-        
         if user.notification_settings.notify_new_task:
             notify_user(user, "Neue Aufgabe", f"{task.author.username} hat '{task.title}' erstellt.", url='/tasks')
 
 def notify_new_event(event):
     """Notify all users (except author) that a new event was created"""
     users = User.query.filter(User.id != event.user_id).all()
+    ensure_notification_settings(users)
     for user in users:
-        if not user.notification_settings:
-             user.notification_settings = NotificationSetting(user_id=user.id)
-             db.session.add(user.notification_settings)
-             db.session.commit()
-
         if user.notification_settings.notify_new_event:
             notify_user(user, "Neuer Termin", f"{event.author.username} hat '{event.title}' erstellt.", url='/calendar')
 
@@ -204,12 +230,8 @@ def notify_chat_message(message):
     if len(msg_preview) > 50:
         msg_preview = msg_preview[:47] + "..."
 
+    ensure_notification_settings(users)
     for user in users:
-        if not user.notification_settings:
-             user.notification_settings = NotificationSetting(user_id=user.id)
-             db.session.add(user.notification_settings)
-             db.session.commit()
-        
         if user.notification_settings.notify_chat_message:
             notify_user(user, f"Chat: {task.title}", f"{message.user.username}: {msg_preview}", url='/tasks')
 
@@ -224,13 +246,10 @@ def check_reminders():
         
         # 1. Check all users
         users = User.query.all()
+        # Create defaults if entirely missing
+        ensure_notification_settings(users)
         for user in users:
             settings = user.notification_settings
-            if not settings:
-                # Create defaults if entirely missing
-                settings = NotificationSetting(user_id=user.id)
-                db.session.add(settings)
-                db.session.commit()
             
             # Refresh to avoid races with other Gunicorn workers
             db.session.refresh(settings)
@@ -263,7 +282,7 @@ def check_reminders():
                             db.session.commit()
                             logger.info(f"[Scheduler] Homework notification sent to {user.username} (Count: {count})")
                         else:
-                            logger.info(f"[Scheduler] Could not send homework reminder to {user.username} (No subscriptions).")
+                            logger.info(f"[Scheduler] Could not send homework reminder to {user.username} (No subscriptions or push unavailable).")
                     else:
                         # We DON'T mark it as sent today if there were no tasks.
                         # This allows the user to add a task later and still get the reminder if it's past the time.
@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for, current_app, send_file, send_from_directory
+from flask import Blueprint, render_template, request, jsonify, redirect, url_for, current_app, send_file, send_from_directory, Response, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
 from .models import (
     User, Task, TaskImage, Event, Grade, NotificationSetting, 
@@ -9,47 +9,69 @@ from .models import (
     subject_classes, db, MealPlan, TimetableImage
 )
 from app.notifications import notify_new_task, notify_new_event
+from .upload_serving import serve_upload
+from .backup import iter_backup_zip, find_backup_base, open_backup_zip, BackupReader, restore_uploads, restore_database
 from werkzeug.utils import secure_filename
+from sqlalchemy.exc import IntegrityError
 import os
 import json
 import zipfile
-import sqlite3
 import csv
 from io import BytesIO, StringIO
 from datetime import datetime, date, timedelta
-import webuntis
-try:
-    import markdown as md_lib
-except ImportError:
-    md_lib = None
-from . import login_manager, limiter, csrf
+from . import login_manager, limiter, csrf, image_queue, image_variants, upload_store, chunked_upload, spaced_repetition, fsrs, decks, anki_import, grade_analytics, integrations
 from .untis_service import get_timetable
-from PIL import Image, ImageOps
 
-def process_and_save_image(file_stream, save_path, max_width=2000):
-    try:
-        # Seek to start just in case
-        file_stream.seek(0)
-        img = Image.open(file_stream)
-        
-        # Correct orientation based on EXIF (crucial for mobile uploads)
-        img = ImageOps.exif_transpose(img)
-        
-        if img.mode in ("RGBA", "P"): 
-            img = img.convert("RGB")
-            
-        # Resize/Compress if too large
-        if img.width > max_width:
-            ratio = max_width / img.width
-            new_h = int(img.height * ratio)
-            img = img.resize((max_width, new_h), Image.Resampling.LANCZOS)
-            
-        # Save as optimized JPEG
-        img.save(save_path, "JPEG", quality=75, optimize=True)
-        return True
-    except Exception as e:
-        current_app.logger.error(f"Image processing error: {e}")
-        return False
+def queue_task_images(task_id, files):
+    """Store uploaded task images unprocessed as pending rows; enqueue the pending ones after the commit"""
+    images = []
+    for file in files:
+        if file and file.filename:
+            # Identical images are stored once (see upload_store); known content is ready right away
+            filename, new = upload_store.store_upload(file, '.jpg', process_image=True)
+            status = image_queue.STATUS_PENDING if new else image_queue.STATUS_READY
+            img = TaskImage(task_id=task_id, filename=filename, status=status)
+            db.session.add(img)
+            images.append(img)
+    return images
+
+def image_sources(filename):
+    """
+    srcset per MIME type for an upload (see image_variants), listing the
+    variants the background job has written so far; {} for old uploads.
+    Legacy flat uploads are skipped without listing the (flat) upload folder.
+    """
+    formats = image_queue.variant_formats()
+    if not formats or not upload_store.is_blob_key(filename):
+        return {}
+    return image_variants.image_sources(current_app.config['UPLOAD_FOLDER'], filename, formats)
+
+
+def chat_image_sources(msg):
+    if msg.message_type != 'image' or not msg.file_url:
+        return {}
+    return image_sources(upload_store.upload_name(msg.file_url))
+
+def save_user_task_row(model, task_id, update):
+    """
+    Get or create the current user's row of a per-user task table (TaskCompletion,
+    TaskChatRead), apply update(row) and commit. Two requests of the user may create
+    the row at once (double click, second tab): the one that loses on the unique
+    constraint rolls back and applies its update to the row the other one created.
+    """
+    for attempt in range(3):
+        row = model.query.filter_by(user_id=current_user.id, task_id=task_id).first()
+        if row is None:
+            row = model(user_id=current_user.id, task_id=task_id)
+            db.session.add(row)
+        update(row)
+        try:
+            db.session.commit()
+            return row
+        except IntegrityError:
+            db.session.rollback()
+            if attempt == 2:
+                raise
 
 main_bp = Blueprint('main', __name__)
 auth_bp = Blueprint('auth', __name__)
@@ -83,10 +105,10 @@ def sw():
 def manifest():
     return current_app.send_static_file('manifest.json')
 
-@main_bp.route('/uploads/<filename>')
+@main_bp.route('/uploads/<path:filename>')
 @login_required
 def uploaded_file(filename):
-    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
+    return serve_upload(filename)
 
 @main_bp.route('/')
 def index():
@@ -246,8 +268,8 @@ Sie haben jederzeit das Recht auf Auskunft, Berichtigung oder Löschung Ihrer Da
 """
     content = GlobalSetting.get('privacy_policy', default_text)
     
-    if md_lib:
-        html_content = md_lib.markdown(content)
+    if integrations.available('markdown'):
+        html_content = integrations.load('markdown').markdown(content)
     else:
         # Simple manual conversion if library is missing
         import re
@@ -340,8 +362,8 @@ def imprint():
     default_text = "Hinterlegen Sie hier Ihr Impressum im Admin-Bereich."
     content = GlobalSetting.get('imprint', default_text)
     
-    if md_lib:
-        html_content = md_lib.markdown(content)
+    if integrations.available('markdown'):
+        html_content = integrations.load('markdown').markdown(content)
     else:
         # Simple manual conversion if library is missing
         import re
@@ -492,7 +514,12 @@ def get_tasks():
                 'description': t.description,
                 'is_done': is_done,
                 # Updated to use secure route /uploads/<filename>
-                'images': [{'id': img.id, 'url': f"/uploads/{img.filename}"} for img in t.images],
+                'images': [{
+                    'id': img.id,
+                    'url': f"/uploads/{img.filename}",
+                    'status': img.status or 'ready',
+                    'sources': image_sources(img.filename)
+                } for img in t.images],
                 'unread_chat_count': TaskMessage.query.filter(
                     TaskMessage.task_id == t.id,
                     TaskMessage.created_at > (
@@ -548,26 +575,10 @@ def create_task():
         db.session.add(new_task)
         db.session.flush() # get ID
 
-        # Handle Images
+        # Handle Images (processed in the background, see image_queue)
+        images = []
         if request.files:
-            files = request.files.getlist('images')
-            for file in files:
-                if file and file.filename:
-                    filename = secure_filename(f"{current_user.id}_{int(datetime.utcnow().timestamp())}_{file.filename}")
-                    if not filename.lower().endswith('.jpg') and not filename.lower().endswith('.jpeg'):
-                        filename += '.jpg'
-                    
-                    upload_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                    
-                    if process_and_save_image(file, upload_path):
-                        img = TaskImage(task_id=new_task.id, filename=filename)
-                        db.session.add(img)
-                    else:
-                        # Fallback to direct save if processing fails
-                        file.seek(0)
-                        file.save(upload_path)
-                        img = TaskImage(task_id=new_task.id, filename=filename)
-                        db.session.add(img)
+            images = queue_task_images(new_task.id, request.files.getlist('images'))
         
         # Audit Log
         from .models import AuditLog
@@ -576,11 +587,18 @@ def create_task():
         db.session.add(log)
         
         db.session.commit()
+        for img in images:
+            if img.status == image_queue.STATUS_PENDING:
+                image_queue.enqueue(TaskImage, img.id, img.filename)
         
         # Trigger Notification
         notify_new_task(new_task)
         
-        return jsonify({'success': True, 'id': new_task.id})
+        return jsonify({
+            'success': True,
+            'id': new_task.id,
+            'images': [{'id': img.id, 'status': img.status} for img in images]
+        })
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error in create_task: {str(e)}")
@@ -598,18 +616,15 @@ def update_task(id):
         
         # Handle Completion Status (Per User) - usually JSON
         if 'is_done' in data:
-            from .models import TaskCompletion
-            completion = TaskCompletion.query.filter_by(user_id=current_user.id, task_id=task.id).first()
-            if not completion:
-                completion = TaskCompletion(user_id=current_user.id, task_id=task.id)
-                db.session.add(completion)
             # Handle string 'true'/'false' from FormData or boolean from JSON
             is_done_val = data['is_done']
             if isinstance(is_done_val, str):
                 is_done_val = is_done_val.lower() == 'true'
-            completion.is_done = bool(is_done_val)
+            # Committed on its own, before the content updates below
+            save_user_task_row(TaskCompletion, task.id, lambda c: setattr(c, 'is_done', bool(is_done_val)))
         
         # Handle Content Updates (Only Author or Class/Super Admin)
+        images = []
         if task.user_id == current_user.id or current_user.is_admin or current_user.is_super_admin:
             if 'title' in data:
                 task.title = data['title']
@@ -635,38 +650,19 @@ def update_task(id):
                 if del_ids:
                     imgs_to_del = TaskImage.query.filter(TaskImage.id.in_(del_ids), TaskImage.task_id == task.id).all()
                     for img in imgs_to_del:
-                        # Remove from FS
-                        path = os.path.join(current_app.config['UPLOAD_FOLDER'], img.filename)
-                        if os.path.exists(path):
-                            try:
-                                os.remove(path)
-                            except:
-                                pass
+                        # Shared files are removed by the upload garbage collector
+                        upload_store.discard(img.filename)
                         db.session.delete(img)
 
-            # Handle New Images
+            # Handle New Images (processed in the background, see image_queue)
             if request.files:
-                files = request.files.getlist('images')
-                from datetime import datetime
-                for file in files:
-                    if file and file.filename:
-                        filename = secure_filename(f"{current_user.id}_{int(datetime.utcnow().timestamp())}_{file.filename}")
-                        if not filename.lower().endswith('.jpg') and not filename.lower().endswith('.jpeg'):
-                            filename += '.jpg'
-                        
-                        upload_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                        
-                        if process_and_save_image(file, upload_path):
-                            img = TaskImage(task_id=task.id, filename=filename)
-                            db.session.add(img)
-                        else:
-                            file.seek(0)
-                            file.save(upload_path)
-                            img = TaskImage(task_id=task.id, filename=filename)
-                            db.session.add(img)
+                images = queue_task_images(task.id, request.files.getlist('images'))
         
         db.session.commit()
-        return jsonify({'success': True})
+        for img in images:
+            if img.status == image_queue.STATUS_PENDING:
+                image_queue.enqueue(TaskImage, img.id, img.filename)
+        return jsonify({'success': True, 'images': [{'id': img.id, 'status': img.status} for img in images]})
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error in update_task: {str(e)}")
@@ -705,27 +701,8 @@ def toggle_task(id):
         if task.class_id != current_user.class_id and not current_user.is_super_admin:
             return jsonify({'success': False, 'message': 'No permission'}), 403
         
-        from .models import TaskCompletion
-        
-        # Find or create completion record
-        completion = TaskCompletion.query.filter_by(
-            user_id=current_user.id,
-            task_id=id
-        ).first()
-        
-        if completion:
-            # Toggle existing
-            completion.is_done = not completion.is_done
-        else:
-            # Create new completion
-            completion = TaskCompletion(
-                user_id=current_user.id,
-                task_id=id,
-                is_done=True
-            )
-            db.session.add(completion)
-        
-        db.session.commit()
+        # Find or create completion record (a new one starts as not done) and toggle it
+        completion = save_user_task_row(TaskCompletion, id, lambda c: setattr(c, 'is_done', not c.is_done))
         
         return jsonify({
             'success': True,
@@ -758,6 +735,7 @@ def get_task_chat(id):
             'content': m.content,
             'message_type': m.message_type,
             'file_url': m.file_url,
+            'sources': chat_image_sources(m),
             'file_name': m.file_name,
             'created_at': m.created_at.isoformat(),
             'is_own': m.user_id == current_user.id,
@@ -770,18 +748,74 @@ def get_task_chat(id):
         current_app.logger.error(f"Chat error: {e}")
         return jsonify({'error': str(e)}), 500
 
+def chat_disabled_response():
+    """403 response if the current user's class has the chat switched off, else None"""
+    sc = SchoolClass.query.get(current_user.class_id) if current_user.class_id else None
+    chat_enabled = sc.chat_enabled if sc else False
+    if not current_user.is_super_admin and not chat_enabled:
+        return jsonify({'error': 'Chat disabled'}), 403
+    return None
+
+def chat_file_message(task_id, filename, original_name):
+    """TaskMessage for an attachment already in the upload store"""
+    ext = upload_store.normalize_ext(secure_filename(original_name), '.bin')
+    msg_type = 'image' if ext in ['.png', '.jpg', '.jpeg', '.gif', '.webp'] else 'file'
+    msg = TaskMessage(
+        task_id=task_id, 
+        user_id=current_user.id, 
+        message_type=msg_type,
+        file_url=f"/uploads/{filename}",
+        file_name=original_name
+    )
+    db.session.add(msg)
+    return msg
+
+def finish_chat_post(task_id, posted_msgs, new_files):
+    """After the commit: variants, notifications, read mark for the sender; returns the message list"""
+    from datetime import datetime
+
+    # Responsive variants for new chat images (original stays as uploaded)
+    for m in posted_msgs:
+        filename = upload_store.upload_name(m.file_url)
+        if m.message_type == 'image' and filename in new_files and image_variants.has_variants(filename):
+            image_queue.enqueue_variants(filename)
+    
+    # Trigger notifications
+    from app.notifications import notify_chat_message
+    for m in posted_msgs:
+        try:
+            notify_chat_message(m)
+        except Exception as e:
+            current_app.logger.error(f"Failed to notify chat message: {e}")
+
+    # Mark as read for sender
+    save_user_task_row(TaskChatRead, task_id, lambda r: setattr(r, 'last_read_at', datetime.utcnow()))
+
+    return jsonify([{
+        'id': m.id,
+        'user_id': m.user_id,
+        'user_name': current_user.username,
+        'content': m.content,
+        'message_type': m.message_type,
+        'file_url': m.file_url,
+        'sources': chat_image_sources(m),
+        'file_name': m.file_name,
+        'created_at': m.created_at.isoformat(),
+        'is_own': True,
+        'parent_id': m.parent_id,
+        'parent_user': m.parent.user.username if m.parent else None,
+        'parent_content': m.parent.content if m.parent else (m.parent.file_name if m.parent and m.parent.file_name else None)
+    } for m in posted_msgs])
+
 @api_bp.route('/tasks/<int:id>/chat', methods=['POST'])
 @login_required
 def post_task_chat(id):
     try:
         task = Task.query.get_or_404(id)
-        sc = SchoolClass.query.get(current_user.class_id) if current_user.class_id else None
-        chat_enabled = sc.chat_enabled if sc else False
-        
-        if not current_user.is_super_admin and not chat_enabled:
-             return jsonify({'error': 'Chat disabled'}), 403
+        disabled = chat_disabled_response()
+        if disabled:
+            return disabled
              
-        from datetime import datetime
         content = request.form.get('content')
         files = request.files.getlist('files')
         
@@ -797,58 +831,18 @@ def post_task_chat(id):
             db.session.add(msg)
             posted_msgs.append(msg)
 
-        # 2. Files
+        # 2. Files (stored once per content, see upload_store; large files use /api/uploads)
+        new_files = set()
         for file in files:
             if file and file.filename:
-                filename = secure_filename(f"chat_{current_user.id}_{int(datetime.utcnow().timestamp())}_{file.filename}")
-                file.save(os.path.join(current_app.config['UPLOAD_FOLDER'], filename))
-                
-                # Determine type
-                ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
-                msg_type = 'image' if ext in ['png', 'jpg', 'jpeg', 'gif', 'webp'] else 'file'
-                
-                msg = TaskMessage(
-                    task_id=id, 
-                    user_id=current_user.id, 
-                    message_type=msg_type,
-                    file_url=f"/uploads/{filename}",
-                    file_name=file.filename
-                )
-                db.session.add(msg)
-                posted_msgs.append(msg)
+                ext = upload_store.normalize_ext(secure_filename(file.filename), '.bin')
+                filename, new = upload_store.store_upload(file, ext)
+                if new:
+                    new_files.add(filename)
+                posted_msgs.append(chat_file_message(id, filename, file.filename))
 
         db.session.commit()
-        
-        # Trigger notifications
-        from app.notifications import notify_chat_message
-        for m in posted_msgs:
-            try:
-                notify_chat_message(m)
-            except Exception as e:
-                current_app.logger.error(f"Failed to notify chat message: {e}")
-
-        # Mark as read for sender
-        read_stat = TaskChatRead.query.filter_by(user_id=current_user.id, task_id=id).first()
-        if not read_stat:
-            read_stat = TaskChatRead(user_id=current_user.id, task_id=id)
-            db.session.add(read_stat)
-        read_stat.last_read_at = datetime.utcnow()
-        db.session.commit()
-
-        return jsonify([{
-            'id': m.id,
-            'user_id': m.user_id,
-            'user_name': current_user.username,
-            'content': m.content,
-            'message_type': m.message_type,
-            'file_url': m.file_url,
-            'file_name': m.file_name,
-            'created_at': m.created_at.isoformat(),
-            'is_own': True,
-            'parent_id': m.parent_id,
-            'parent_user': m.parent.user.username if m.parent else None,
-            'parent_content': m.parent.content if m.parent else (m.parent.file_name if m.parent and m.parent.file_name else None)
-        } for m in posted_msgs])
+        return finish_chat_post(id, posted_msgs, new_files)
 
     except Exception as e:
         db.session.rollback()
@@ -864,14 +858,10 @@ def delete_chat_message(msg_id):
         if msg.user_id != current_user.id and not current_user.is_super_admin:
             return jsonify({'success': False, 'message': 'Nicht autorisiert'}), 403
             
-        # Delete physical file if exists
+        # Delete physical file if exists (shared files are removed by the upload garbage collector)
         if msg.message_type in ['image', 'file'] and msg.file_url:
             try:
-                # Extract filename from /uploads/filename
-                filename = msg.file_url.split('/')[-1]
-                path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                if os.path.exists(path):
-                    os.remove(path)
+                upload_store.discard(msg.file_url)
             except Exception as e:
                 current_app.logger.error(f"Error deleting chat file: {e}")
         
@@ -900,13 +890,7 @@ def get_class_members():
 def mark_task_chat_read(id):
     try:
         from datetime import datetime
-        read_stat = TaskChatRead.query.filter_by(user_id=current_user.id, task_id=id).first()
-        if not read_stat:
-            read_stat = TaskChatRead(user_id=current_user.id, task_id=id)
-            db.session.add(read_stat)
-        
-        read_stat.last_read_at = datetime.utcnow()
-        db.session.commit()
+        save_user_task_row(TaskChatRead, id, lambda r: setattr(r, 'last_read_at', datetime.utcnow()))
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1081,7 +1065,10 @@ def delete_event(id):
 @api_bp.route('/grades', methods=['GET'])
 @login_required
 def get_grades():
-    grades = Grade.query.filter_by(user_id=current_user.id).order_by(Grade.date.desc()).all()
+    query = Grade.query.filter_by(user_id=current_user.id)
+    if request.args.get('subject'):
+        query = query.filter_by(subject=request.args['subject'])
+    grades = query.order_by(Grade.date.desc()).all()
     return jsonify([{
         'id': g.id,
         'subject': g.subject,
@@ -1092,6 +1079,18 @@ def get_grades():
         'description': g.description
     } for g in grades])
 
+@api_bp.route('/grades/summary', methods=['GET'])
+@login_required
+def get_grade_summary():
+    """Averages, trends and timelines (cached); ?target=&weight= adds the grade needed per subject"""
+    summary = grade_analytics.get_summary(current_user.id)
+    target = request.args.get('target', type=float)
+    if target is not None:
+        weight = request.args.get('weight', 1.0, type=float)
+        for subject in summary['subjects']:
+            subject['needed'] = grade_analytics.needed_grade(subject, target, weight)
+    return jsonify(summary)
+
 @api_bp.route('/grades', methods=['POST'])
 @login_required
 def create_grade():
@@ -1112,6 +1111,7 @@ def create_grade():
             description=data.get('description', '')
         )
         db.session.add(new_grade)
+        grade_analytics.invalidate(current_user.id)
         
         # Audit Log
         from .models import AuditLog
@@ -1145,6 +1145,7 @@ def update_grade(id):
         if 'date' in data:
             from datetime import datetime
             grade.date = datetime.strptime(data['date'], '%Y-%m-%d')
+        grade_analytics.invalidate(current_user.id)
             
         # Audit Log
         from .models import AuditLog
@@ -1165,6 +1166,7 @@ def delete_grade(id):
         return jsonify({'success': False}), 403
         
     db.session.delete(grade)
+    grade_analytics.invalidate(current_user.id)
     
     # Audit Log
     from .models import AuditLog
@@ -1342,189 +1344,49 @@ def export_backup():
     if not current_user.is_super_admin:
         return jsonify({'success': False, 'message': 'Unauthorized'}), 403
     
-    def serialize(obj):
-        data = {}
-        for col in obj.__table__.columns:
-            val = getattr(obj, col.name)
-            if isinstance(val, (datetime, date)):
-                data[col.name] = val.isoformat()
-            else:
-                data[col.name] = val
-        return data
-
-    # 1. Gather Database Data
-    backup_data = {
-        'version': '2.0',
-        'timestamp': datetime.utcnow().isoformat(),
-        
-        # Core
-        'school_classes': [serialize(c) for c in SchoolClass.query.all()],
-        'users': [serialize(u) for u in User.query.all()],
-        'subjects': [serialize(s) for s in Subject.query.all()],
-        'subject_classes': [{'subject_id': a.subject_id, 'class_id': a.class_id} for a in db.session.query(subject_classes).all()],
-        
-        # Tasks & Events
-        'tasks': [serialize(t) for t in Task.query.all()],
-        'task_completions': [serialize(tc) for tc in TaskCompletion.query.all()],
-        'task_images': [serialize(ti) for ti in TaskImage.query.all()],
-        'events': [serialize(e) for e in Event.query.all()],
-        
-        # Communication
-        'task_messages': [serialize(tm) for tm in TaskMessage.query.all()],
-        'task_chat_reads': [serialize(tcr) for tcr in TaskChatRead.query.all()],
-        'blackboard_items': [serialize(bi) for bi in BlackboardItem.query.all()],
-        
-        # Grades & User Data
-        'grades': [serialize(g) for g in Grade.query.all()],
-        'notification_settings': [serialize(ns) for ns in NotificationSetting.query.all()],
-        'push_subscriptions': [serialize(ps) for ps in PushSubscription.query.all()],
-        'audit_logs': [serialize(al) for al in AuditLog.query.all()],
-        'meal_plans': [serialize(mp) for mp in MealPlan.query.all()],
-        
-        # Settings & Integrations
-        'global_settings': [serialize(gs) for gs in GlobalSetting.query.all()],
-        'subject_teachers': [serialize(st) for st in SubjectTeacher.query.all()],
-        'untis_credentials': [serialize(uc) for uc in UntisCredential.query.all()],
-        
-        # Drive Integration
-        'drive_oauth_tokens': [serialize(dot) for dot in DriveOAuthToken.query.all()],
-        'drive_folders': [serialize(df) for df in DriveFolder.query.all()],
-        'drive_files': [serialize(df) for df in DriveFile.query.all()],
-        'drive_file_contents': [serialize(dfc) for dfc in DriveFileContent.query.all()],
-    }
-
-    # 2. Create ZIP
-    buffer = BytesIO()
-    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-        # Add Database JSON
-        zf.writestr('database.json', json.dumps(backup_data, indent=4))
-        
-        # Add Uploaded Files
-        upload_folder = current_app.config.get('UPLOAD_FOLDER')
-        if upload_folder and os.path.exists(upload_folder):
-            for root, dirs, files in os.walk(upload_folder):
-                for file in files:
-                    abs_path = os.path.join(root, file)
-                    # Use 'uploads/' prefix in zip
-                    rel_path = os.path.relpath(abs_path, upload_folder)
-                    zf.write(abs_path, arcname=os.path.join('uploads', rel_path))
-
-    buffer.seek(0)
-    
-    filename = f"l8testudy_full_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
-    return send_file(buffer, as_attachment=True, download_name=filename, mimetype='application/zip')
+    # full (default), incremental (since last backup) or differential (since last full backup)
+    mode = request.args.get('mode', 'full')
+    if mode not in ('full', 'incremental', 'differential'):
+        return jsonify({'success': False, 'message': 'Invalid backup mode'}), 400
+    if find_backup_base(mode) is None:
+        mode = 'full'
+    
+    filename = f"l8testudy_{mode}_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    # Streamed: rows and upload chunks go out as soon as they are compressed
+    return Response(
+        stream_with_context(iter_backup_zip(mode=mode)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
 
 
 def perform_restore(file, app_config):
     """Reusable restore logic for both Admin and Setup"""
     filename = file.filename.lower()
-    data = None
-    is_zip = filename.endswith('.zip')
     
     try:
-        if is_zip:
-            with zipfile.ZipFile(file) as zf:
-                # 1. Read Database JSON
-                if 'database.json' not in zf.namelist():
+        if filename.endswith(('.zip', '.zip.zst')):
+            # The ZIP stays open while restoring: NDJSON tables are read lazily
+            with open_backup_zip(file, filename) as zf:
+                reader = BackupReader.from_zip(zf)
+                if reader is None:
                     return False, 'Invalid backup: missing database.json'
-                
-                with zf.open('database.json') as f:
-                    data = json.load(f)
-                
-                # 2. Restore Uploads
-                upload_folder = app_config['UPLOAD_FOLDER']
-                os.makedirs(upload_folder, exist_ok=True)
-                
-                for member in zf.namelist():
-                    if member.startswith('uploads/') and not member.endswith('/'):
-                        content = zf.read(member)
-                        rel_path = member[8:] 
-                        target_path = os.path.join(upload_folder, rel_path)
-                        os.makedirs(os.path.dirname(target_path), exist_ok=True)
-                        with open(target_path, 'wb') as f_out:
-                            f_out.write(content)
+                if reader.kind != 'full':
+                    return False, f'{reader.kind.capitalize()} backups must be restored as a chain with restore_chain.py'
+                restore_uploads(zf, app_config['UPLOAD_FOLDER'])
+                return _restore_database(reader)
         else:
-            data = json.load(file)
-            
+            reader = BackupReader(legacy_data=json.load(file))
     except Exception as e:
         return False, f'Invalid file format: {str(e)}'
 
-    try:
-        # Clear existing data
-        db.session.query(DriveFileContent).delete()
-        db.session.query(DriveFile).delete()
-        db.session.query(DriveFolder).delete()
-        db.session.query(UntisCredential).delete()
-        db.session.query(SubjectTeacher).delete()
-        db.session.query(MealPlan).delete()
-        db.session.query(AuditLog).delete()
-        db.session.query(DriveOAuthToken).delete()
-        db.session.query(BlackboardItem).delete()
-        
-        db.session.query(TaskChatRead).delete()
-        db.session.query(TaskMessage).delete()
-        db.session.query(TaskCompletion).delete()
-        db.session.query(Grade).delete()
-        db.session.query(TaskImage).delete()
-        db.session.query(Task).delete()
-        db.session.query(Event).delete()
-        db.session.query(NotificationSetting).delete()
-        db.session.query(PushSubscription).delete()
-        db.session.execute(subject_classes.delete())
-        db.session.query(User).delete()
-        db.session.query(Subject).delete()
-        db.session.query(SchoolClass).delete()
-        db.session.query(GlobalSetting).delete()
-        db.session.commit()
+    return _restore_database(reader)
 
-        # Helper to parse dates
-        def parse_val(val):
-            if isinstance(val, str) and (len(val) >= 10):
-                if val.count('-') == 2:
-                    try: return datetime.fromisoformat(val)
-                    except: 
-                        try: return datetime.strptime(val, '%Y-%m-%d').date()
-                        except: pass
-            return val
-
-        def restore_table(model, key):
-            for d in data.get(key, []):
-                obj = model()
-                for k, v in d.items():
-                     if hasattr(obj, k):
-                        setattr(obj, k, parse_val(v))
-                db.session.add(obj)
-            db.session.flush()
-
-        # Restore sequence
-        restore_table(SchoolClass, 'school_classes')
-        restore_table(User, 'users')
-        restore_table(Subject, 'subjects')
-        restore_table(GlobalSetting, 'global_settings')
-        
-        for d in data.get('subject_classes', []):
-            db.session.execute(subject_classes.insert().values(subject_id=d['subject_id'], class_id=d['class_id']))
-
-        restore_table(Task, 'tasks')
-        restore_table(TaskImage, 'task_images')
-        restore_table(TaskCompletion, 'task_completions')
-        restore_table(Event, 'events')
-        restore_table(Grade, 'grades')
-        restore_table(NotificationSetting, 'notification_settings')
-        restore_table(PushSubscription, 'push_subscriptions')
-        restore_table(TaskMessage, 'task_messages')
-        restore_table(TaskChatRead, 'task_chat_reads')
-        
-        restore_table(BlackboardItem, 'blackboard_items')
-        restore_table(AuditLog, 'audit_logs')
-        restore_table(MealPlan, 'meal_plans')
-        restore_table(SubjectTeacher, 'subject_teachers')
-        restore_table(UntisCredential, 'untis_credentials')
-        restore_table(DriveOAuthToken, 'drive_oauth_tokens')
-        restore_table(DriveFolder, 'drive_folders')
-        restore_table(DriveFile, 'drive_files')
-        restore_table(DriveFileContent, 'drive_file_contents')
 
+def _restore_database(reader):
+    """Replace all tables with the rows of a backup (BackupReader)"""
+    try:
+        restore_database(reader)
         db.session.commit()
         return True, "Restore successful"
         
@@ -1582,6 +1444,10 @@ def delete_user(id):
 
     if id == current_user.id:
         return jsonify({'success': False, 'message': 'Cannot delete self'}), 400
+    grade_analytics.forget(user.id)
+    from .models import CardReview, ReviewLog, SchedulerSettings, ReviewBatch
+    for model in (ReviewLog, CardReview, SchedulerSettings, ReviewBatch):
+        model.query.filter_by(user_id=user.id).delete(synchronize_session=False)
     db.session.delete(user)
     db.session.commit()
     return jsonify({'success': True})
@@ -1749,8 +1615,8 @@ def update_notification_settings():
 
 @api_bp.route('/vapid_public_key')
 def get_vapid_key():
-    from app.notifications import VAPID_PUBLIC_KEY
-    return jsonify({'publicKey': VAPID_PUBLIC_KEY})
+    from app.notifications import get_vapid_keys
+    return jsonify({'publicKey': get_vapid_keys()[1]})
 
 @api_bp.route('/notifications/test', methods=['POST'])
 @login_required
@@ -2176,6 +2042,11 @@ def get_untis_schedule():
 @login_required
 def import_subjects_from_untis():
     """Import subjects from WebUntis timetable"""
+    # Loaded before the try: its except clause refers to untis.RemoteError
+    try:
+        untis = integrations.load('untis')
+    except integrations.IntegrationUnavailable:
+        return jsonify({'success': False, 'message': 'WebUntis ist auf diesem Server nicht verfügbar'}), 501
     try:
         data = request.get_json()
         class_id = data.get('class_id')
@@ -2198,7 +2069,7 @@ def import_subjects_from_untis():
         server = creds.server.replace('https://', '').replace('http://', '').strip('/')
         
         # Connect to WebUntis
-        s = webuntis.Session(
+        s = untis.Session(
             server=server,
             school=creds.school,
             username=creds.username,
@@ -2280,7 +2151,7 @@ def import_subjects_from_untis():
             'message': f'{imported_count} Fächer importiert, {skipped_count} bereits vorhanden'
         })
         
-    except webuntis.errors.RemoteError as e:
+    except untis.RemoteError as e:
         return jsonify({'success': False, 'message': f'Untis-Fehler: {str(e)}'}), 500
     except Exception as e:
         import traceback
@@ -2408,13 +2279,9 @@ def upload_meal_plan():
         
     if file:
         try:
-            filename = secure_filename(f"mealplan_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg")
-            upload_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-            
-            if not process_and_save_image(file, upload_path):
-                return jsonify({'success': False, 'message': 'Image processing failed'}), 500
-             
+            filename, new = upload_store.store_upload(file, '.jpg', process_image=True)
             
+
             # Save to DB
             today = date.today()
             # Calculate start of week (Monday)
@@ -2429,13 +2296,18 @@ def upload_meal_plan():
                 class_id=class_id,
                 image_path=filename,
                 extracted_text=None,
-                week_start=monday
+                week_start=monday,
+                status=image_queue.STATUS_PENDING if new else image_queue.STATUS_READY
             )
             db.session.add(plan)
             db.session.commit()
+            if new:
+                image_queue.enqueue(MealPlan, plan.id, filename)
             
             return jsonify({
                 'success': True, 
+                'id': plan.id,
+                'status': plan.status,
                 'text': None, 
                 'image_url': f'/uploads/{filename}'
             })
@@ -2453,16 +2325,20 @@ def get_latest_meal_plan():
     if current_user.class_id:
         query = query.filter_by(class_id=current_user.class_id)
     
-    plan = query.order_by(MealPlan.created_at.desc()).first()
+    # Newest processed plan; a newer upload still in the queue is reported as pending
+    plan = query.filter(MealPlan.status == image_queue.STATUS_READY).order_by(MealPlan.created_at.desc()).first()
+    pending = query.filter(MealPlan.status == image_queue.STATUS_PENDING).count() > 0
     
     if not plan:
-        return jsonify({'success': False, 'found': False})
+        return jsonify({'success': False, 'found': False, 'pending': pending})
         
     return jsonify({
         'success': True,
         'found': True,
         'image_url': f'/uploads/{plan.image_path}',
+        'sources': image_sources(plan.image_path),
         'text': plan.extracted_text,
+        'pending': pending,
     })
 
 # --- Timetable Image Routes ---
@@ -2474,16 +2350,20 @@ def get_latest_stundenplan_image():
     if current_user.class_id:
         query = query.filter_by(class_id=current_user.class_id)
     
-    img = query.order_by(TimetableImage.created_at.desc()).first()
+    # Newest processed image; a newer upload still in the queue is reported as pending
+    img = query.filter(TimetableImage.status == image_queue.STATUS_READY).order_by(TimetableImage.created_at.desc()).first()
+    pending = query.filter(TimetableImage.status == image_queue.STATUS_PENDING).count() > 0
     
     if not img:
-        return jsonify({'success': False, 'found': False})
+        return jsonify({'success': False, 'found': False, 'pending': pending})
         
     return jsonify({
         'success': True,
         'found': True,
         'image_url': f'/uploads/{img.image_path}',
-        'created_at': img.created_at.isoformat()
+        'sources': image_sources(img.image_path),
+        'created_at': img.created_at.isoformat(),
+        'pending': pending
     })
 
 @api_bp.route('/stundenplan/upload', methods=['POST'])
@@ -2501,11 +2381,7 @@ def upload_stundenplan_image():
         
     if file:
         try:
-            filename = secure_filename(f"timetable_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg")
-            upload_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-            
-            if not process_and_save_image(file, upload_path):
-                return jsonify({'success': False, 'message': 'Image processing failed'}), 500
+            filename, new = upload_store.store_upload(file, '.jpg', process_image=True)
             
             class_id = current_user.class_id
             if not class_id and current_user.is_super_admin:
@@ -2513,13 +2389,18 @@ def upload_stundenplan_image():
 
             img = TimetableImage(
                 class_id=class_id,
-                image_path=filename
+                image_path=filename,
+                status=image_queue.STATUS_PENDING if new else image_queue.STATUS_READY
             )
             db.session.add(img)
             db.session.commit()
+            if new:
+                image_queue.enqueue(TimetableImage, img.id, filename)
             
             return jsonify({
                 'success': True, 
+                'id': img.id,
+                'status': img.status,
                 'image_url': f'/uploads/{filename}'
             })
         except Exception as e:
@@ -2675,48 +2556,22 @@ def update_blackboard_item(id):
 @api_bp.route('/decks', methods=['GET'])
 @login_required
 def get_decks():
-    from .models import Deck, Flashcard, CardReview
-    
-    # 1. My Decks
-    my_decks = Deck.query.filter_by(user_id=current_user.id).all()
-    
-    # 2. Public Decks (excluding mine)
-    public_decks = Deck.query.filter(Deck.is_public == True, Deck.user_id != current_user.id).all()
-    
-    def serialize_deck(d):
-        # Count due cards
-        # Join with CardReview to find cards due driven by algorithm
-        # For simplicity in list view, maybe just total cards
-        card_count = d.cards.count()
-        
-        # Calculate due count efficiently? 
-        # For now, let's keep it simple.
-        return {
-            'id': d.id,
-            'title': d.title,
-            'description': d.description,
-            'is_public': d.is_public,
-            'is_own': d.user_id == current_user.id,
-            'author_name': d.user.username,
-            'card_count': card_count,
-            'created_at': d.created_at.isoformat()
-        }
-
+    """Own decks and one page of the public catalogue (?q= search, ?page=, ?per_page=, ?scope=public)"""
+    search = request.args.get('q', '').strip()[:100]
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', decks.PUBLIC_PAGE_SIZE, type=int)
+    public, total = decks.public_decks(current_user.id, search, page, per_page)
     return jsonify({
-        'my_decks': [serialize_deck(d) for d in my_decks],
-        'public_decks': [serialize_deck(d) for d in public_decks]
+        'my_decks': decks.own_decks(current_user.id) if page == 1 and request.args.get('scope') != 'public' else [],
+        'public_decks': public,
+        'public_total': total,
+        'page': page,
+        'has_more': page * min(max(per_page, 1), decks.MAX_PAGE_SIZE) < total
     })
 
-@api_bp.route('/decks/import', methods=['POST'])
-@login_required
-def import_deck():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
-    
-    filename = secure_filename(file.filename)
+def import_deck_file(stream, filename):
+    """Create a deck from a .csv/.txt/.apkg file object (form upload or completed chunked upload)"""
+    filename = secure_filename(filename)
     name, ext = os.path.splitext(filename)
     ext = ext.lower()
 
@@ -2727,12 +2582,12 @@ def import_deck():
         # CSV / TXT Import
         if ext in ['.csv', '.txt']:
             # Read into string
+            raw = stream.read()
             try:
-                content = file.stream.read().decode("utf-8")
+                content = raw.decode("utf-8")
             except UnicodeDecodeError:
                 # Fallback to simple latin-1 if utf-8 fails
-                file.stream.seek(0)
-                content = file.stream.read().decode("latin-1")
+                content = raw.decode("latin-1")
 
             stream = StringIO(content, newline=None)
             
@@ -2751,45 +2606,16 @@ def import_deck():
                     if front and back:
                         imported_cards.append({'front': front, 'back': back})
         
-        # Anki .apkg Import
+        # Anki .apkg Import (bulk insert, media and scheduling state, see anki_import)
         elif ext == '.apkg':
-            # Need to save to temp file to use zipfile/sqlite3 easily on file paths or BytesIO
-            temp_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f"temp_anki_{current_user.id}_{int(datetime.utcnow().timestamp())}.apkg")
-            file.save(temp_path)
-            
-            try:
-                with zipfile.ZipFile(temp_path, 'r') as z:
-                    # Extract collection.anki2 to a temp location
-                    if 'collection.anki2' in z.namelist():
-                        z.extract('collection.anki2', path=os.path.dirname(temp_path))
-                        db_path = os.path.join(os.path.dirname(temp_path), 'collection.anki2')
-                        
-                        conn = sqlite3.connect(db_path)
-                        cursor = conn.cursor()
-                        
-                        # Fetch notes (cards content)
-                        # fields are \x1f separated
-                        cursor.execute("SELECT flds FROM notes")
-                        rows = cursor.fetchall()
-                        
-                        for row in rows:
-                            fields = row[0].split('\x1f')
-                            if len(fields) >= 2:
-                                imported_cards.append({
-                                    'front': fields[0],
-                                    'back': fields[1]
-                                })
-                        
-                        conn.close()
-                        
-                        # Cleanup extracted DB
-                        if os.path.exists(db_path):
-                            os.remove(db_path)
-            
-            finally:
-                # Cleanup zip
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
+            result = anki_import.import_apkg(
+                stream, current_user.id, deck_title + " (Importiert)",
+                f"Importiert am {date.today().strftime('%d.%m.%Y')}",
+                max_size=current_app.config['ANKI_MAX_COLLECTION_SIZE']
+            )
+            db.session.commit()
+            return jsonify({'success': True, 'id': result.deck_id, 'count': result.cards,
+                            'reviews': result.reviews, 'media': result.media})
 
         else:
              return jsonify({'error': 'Unsupported file type. Use .csv, .txt or .apkg'}), 400
@@ -2822,12 +2648,127 @@ def import_deck():
         
         return jsonify({'success': True, 'id': new_deck.id, 'count': count})
 
+    except anki_import.AnkiImportError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(f"Import error: {e}")
         import traceback
         current_app.logger.error(traceback.format_exc())
         return jsonify({'error': f'Import failed: {str(e)}'}), 500
 
+@api_bp.route('/decks/import', methods=['POST'])
+@login_required
+def import_deck():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file part'}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+    return import_deck_file(file.stream, file.filename)
+
+# --- Chunked Upload Routes (see chunked_upload) ---
+
+def _get_own_upload(upload_id):
+    from .models import ChunkedUpload
+    return ChunkedUpload.query.filter_by(upload_id=upload_id, user_id=current_user.id).first_or_404()
+
+def _upload_status(upload):
+    return {
+        'success': True,
+        'upload_id': upload.upload_id,
+        'chunk_size': upload.chunk_size,
+        'chunk_count': chunked_upload.chunk_count(upload),
+        'missing': chunked_upload.missing_chunks(upload)
+    }
+
+@api_bp.route('/uploads', methods=['POST'])
+@login_required
+def init_chunked_upload():
+    data = request.get_json() or {}
+    purpose = data.get('purpose')
+    target_id = None
+    if purpose == 'chat':
+        try:
+            target_id = int(data.get('task_id'))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'task_id required'}), 400
+        Task.query.get_or_404(target_id)
+        disabled = chat_disabled_response()
+        if disabled:
+            return disabled
+    try:
+        upload = chunked_upload.start_upload(
+            current_user.id, purpose, data.get('filename'), data.get('size'),
+            sha256=data.get('sha256'), target_id=target_id
+        )
+        db.session.commit()
+    except chunked_upload.ChunkedUploadError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': e.message}), e.status
+    return jsonify(_upload_status(upload))
+
+@api_bp.route('/uploads/<upload_id>', methods=['GET'])
+@login_required
+def get_chunked_upload(upload_id):
+    return jsonify(_upload_status(_get_own_upload(upload_id)))
+
+@api_bp.route('/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+@login_required
+def put_upload_chunk(upload_id, index):
+    upload = _get_own_upload(upload_id)
+    try:
+        # Raw body, read straight from the WSGI stream
+        chunked_upload.write_chunk(upload, index, request.stream, request.content_length,
+                                   request.headers.get('X-Chunk-SHA256'))
+        db.session.commit()
+    except chunked_upload.ChunkedUploadError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': e.message}), e.status
+    return jsonify({'success': True, 'index': index})
+
+@api_bp.route('/uploads/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_chunked_upload(upload_id):
+    upload = _get_own_upload(upload_id)
+    try:
+        path, digest = chunked_upload.finish_upload(upload)
+    except chunked_upload.ChunkedUploadError as e:
+        return jsonify({'success': False, 'message': e.message}), e.status
+
+    if upload.purpose == 'deck_import':
+        with open(path, 'rb') as f:
+            response = import_deck_file(f, upload.filename)
+        chunked_upload.discard_upload(upload)
+        db.session.commit()
+        return response
+
+    # Chat attachment
+    try:
+        Task.query.get_or_404(upload.target_id)
+        disabled = chat_disabled_response()
+        if disabled:
+            return disabled
+        ext = upload_store.normalize_ext(secure_filename(upload.filename), '.bin')
+        filename, new = upload_store.store_file(path, ext, digest=digest)
+        msg = chat_file_message(upload.target_id, filename, upload.filename)
+        task_id = upload.target_id
+        chunked_upload.discard_upload(upload)
+        db.session.commit()
+        return finish_chat_post(task_id, [msg], {filename} if new else set())
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Chunked chat upload error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def abort_chunked_upload(upload_id):
+    chunked_upload.discard_upload(_get_own_upload(upload_id))
+    db.session.commit()
+    return jsonify({'success': True})
+
 @api_bp.route('/decks', methods=['POST'])
 @login_required
 def create_deck():
@@ -2856,8 +2797,12 @@ def get_deck_details(id):
     if not deck.is_public and deck.user_id != current_user.id and not current_user.is_super_admin:
         return jsonify({'error': 'Access denied'}), 403
         
-    # Get Cards
-    cards = deck.cards.all()
+    # Cards with the user's review state in one query (no review = new card)
+    rows = db.session.query(
+        Flashcard.id, Flashcard.front, Flashcard.back, Flashcard.image_url, CardReview.next_review_at
+    ).outerjoin(
+        CardReview, db.and_(CardReview.card_id == Flashcard.id, CardReview.user_id == current_user.id)
+    ).filter(Flashcard.deck_id == deck.id).order_by(Flashcard.id).all()
     
     # Calculate Due Cards for Study Mode
     # If user has reviewed a card, use that state. Else, it's new.
@@ -2867,21 +2812,20 @@ def get_deck_details(id):
     
     cards_data = []
     
-    for c in cards:
-        review = CardReview.query.filter_by(user_id=current_user.id, card_id=c.id).first()
+    for card_id, front, back, image_url, next_review_at in rows:
         is_due = False
-        if not review:
+        if next_review_at is None:
             new_count += 1
             is_due = True # New cards are available to study
-        elif review.next_review_at <= now:
+        elif next_review_at <= now:
             due_count += 1
             is_due = True
             
         cards_data.append({
-            'id': c.id,
-            'front': c.front,
-            'back': c.back,
-            'image_url': c.image_url,
+            'id': card_id,
+            'front': front,
+            'back': back,
+            'image_url': image_url,
             'is_due': is_due
         })
         
@@ -2895,8 +2839,27 @@ def get_deck_details(id):
         'stats': {
             'new': new_count,
             'due': due_count,
-            'total': len(cards)
-        }
+            'total': len(cards_data)
+        },
+        # What a study session serves right now (new cards capped per day)
+        'study': spaced_repetition.study_counts(deck.id, current_user.id, now)
+    })
+
+@api_bp.route('/decks/<int:id>/study/next', methods=['GET'])
+@login_required
+def get_next_study_cards(id):
+    from .models import Deck
+    deck = Deck.query.get_or_404(id)
+    if not deck.is_public and deck.user_id != current_user.id and not current_user.is_super_admin:
+        return jsonify({'error': 'Access denied'}), 403
+
+    limit = request.args.get('limit', 20, type=int)
+    # Card ids the client still has queued (not rated yet)
+    exclude = [int(x) for x in request.args.get('exclude', '').split(',') if x.strip().isdigit()][:spaced_repetition.MAX_BATCH]
+    now = datetime.utcnow()
+    return jsonify({
+        'cards': spaced_repetition.next_study_cards(deck.id, current_user.id, limit, exclude, now),
+        'counts': spaced_repetition.study_counts(deck.id, current_user.id, now)
     })
 
 @api_bp.route('/decks/<int:id>/cards', methods=['POST'])
@@ -2928,11 +2891,15 @@ def add_card(id):
 @api_bp.route('/decks/<int:id>/delete', methods=['DELETE'])
 @login_required
 def delete_deck(id):
-    from .models import Deck
+    from .models import Deck, Flashcard, CardReview, ReviewLog
     deck = Deck.query.get_or_404(id)
     if deck.user_id != current_user.id and not current_user.is_super_admin:
         return jsonify({'error': 'Permission denied'}), 403
         
+    # Reviews of all users, not cascaded by the relationships
+    card_ids = db.session.query(Flashcard.id).filter_by(deck_id=deck.id)
+    for model in (ReviewLog, CardReview):
+        model.query.filter(model.card_id.in_(card_ids)).delete(synchronize_session=False)
     db.session.delete(deck)
     db.session.commit()
     return jsonify({'success': True})
@@ -2940,11 +2907,14 @@ def delete_deck(id):
 @api_bp.route('/cards/<int:id>', methods=['DELETE'])
 @login_required
 def delete_card(id):
-    from .models import Flashcard
+    from .models import Flashcard, CardReview, ReviewLog
     card = Flashcard.query.get_or_404(id)
     if card.deck.user_id != current_user.id and not current_user.is_super_admin:
         return jsonify({'error': 'Permission denied'}), 403
         
+    # Reviews of all users, not cascaded by the relationships
+    for model in (ReviewLog, CardReview):
+        model.query.filter_by(card_id=card.id).delete(synchronize_session=False)
     db.session.delete(card)
     db.session.commit()
     return jsonify({'success': True})
@@ -2963,44 +2933,10 @@ def review_card(id):
     
     review = CardReview.query.filter_by(user_id=current_user.id, card_id=id).first()
     if not review:
-        review = CardReview(
-            user_id=current_user.id,
-            card_id=id,
-            interval=0,
-            ease_factor=2.5,
-            review_count=0
-        )
+        review = spaced_repetition.new_review(current_user.id, id)
         db.session.add(review)
     
-    # --- SM-2 Algorithm ---
-    # Quality: 0=Blackout, 1=Incorrect, 2=Hard, 3=Pass, 4=Good, 5=Bright
-    # NOTE: User input is mapped: 1(Fail) -> 1, 2(Hard) -> 2, 3(Good) -> 4, 4(Easy) -> 5
-    # Let's assume frontend sends 1, 2, 3, 4 map to standard SM-2 
-    
-    if quality < 2:
-        # Failed / Again (< 1m)
-        review.interval = 0 # 0 days
-        review.review_count = 0
-        review.next_review_at = datetime.utcnow() + timedelta(minutes=1)
-    else:
-        if review.review_count == 0:
-            review.interval = 1
-        elif review.review_count == 1:
-            review.interval = 6
-        else:
-            review.interval = round(review.interval * review.ease_factor)
-        
-        review.review_count += 1
-        review.next_review_at = datetime.utcnow() + timedelta(days=review.interval)
-
-    # Update Ease
-    # EF' = EF + (0.1 - (5 - q) * (0.08 + (5 - q) * 0.02))
-    review.ease_factor = review.ease_factor + (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
-    if review.ease_factor < 1.3:
-        review.ease_factor = 1.3
-        
-    # Set last review date
-    review.last_review_at = datetime.utcnow()
+    spaced_repetition.record_review(review, quality, settings=fsrs.get_settings(current_user.id))
     
     db.session.commit()
     
@@ -3010,6 +2946,111 @@ def review_card(id):
         'interval': review.interval
     })
 
+@api_bp.route('/cards/reviews/batch', methods=['POST'])
+@login_required
+def review_cards_batch():
+    """
+    Reviews recorded offline, in the order they were made:
+    {idempotency_key, reviews: [{card_id, quality, reviewed_at}]}.
+    Applied in one transaction; a retry with the same key returns the first response.
+    """
+    from .models import ReviewBatch
+    data = request.get_json(silent=True) or {}
+    key = str(data.get('idempotency_key') or '')
+    entries = data.get('reviews')
+    if not key or len(key) > 64:
+        return jsonify({'success': False, 'message': 'idempotency_key required (max. 64 characters)'}), 400
+    if not isinstance(entries, list):
+        return jsonify({'success': False, 'message': 'reviews must be a list'}), 400
+    if len(entries) > spaced_repetition.MAX_REVIEW_BATCH:
+        return jsonify({'success': False, 'message': f'At most {spaced_repetition.MAX_REVIEW_BATCH} reviews per batch'}), 413
+
+    done = ReviewBatch.query.filter_by(user_id=current_user.id, idempotency_key=key).first()
+    if done:
+        return current_app.response_class(done.response, mimetype='application/json')
+
+    results, skipped = spaced_repetition.apply_review_batch(current_user, entries)
+    response = json.dumps({'success': True, 'applied': len(results), 'results': results, 'skipped': skipped})
+    # Keys only need to outlive the client's retries. Pruned before the add: the
+    # bulk delete autoflushes, and a duplicate key must only fail in the commit below
+    ReviewBatch.query.filter(
+        ReviewBatch.user_id == current_user.id,
+        ReviewBatch.created_at < datetime.utcnow() - timedelta(days=30)
+    ).delete(synchronize_session=False)
+    db.session.add(ReviewBatch(user_id=current_user.id, idempotency_key=key, response=response))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # The same batch was sent twice at once; the other request applied it
+        db.session.rollback()
+        done = ReviewBatch.query.filter_by(user_id=current_user.id, idempotency_key=key).first_or_404()
+        response = done.response
+    return current_app.response_class(response, mimetype='application/json')
+
+def scheduler_settings_json(settings):
+    from .models import ReviewLog
+    review_count = db.session.query(db.func.count(ReviewLog.id)).filter_by(user_id=current_user.id).scalar()
+    return {
+        'scheduler': settings.scheduler if settings else 'sm2',
+        'desired_retention': settings.desired_retention if settings else 0.9,
+        'personalized': bool(settings and settings.weights),
+        'optimized_at': settings.optimized_at.isoformat() if settings and settings.optimized_at else None,
+        'review_count': review_count,
+        'min_reviews_to_optimize': fsrs.MIN_OPTIMIZE_REVIEWS,
+        'can_optimize': fsrs.numpy_available() and review_count >= fsrs.MIN_OPTIMIZE_REVIEWS
+    }
+
+@api_bp.route('/flashcards/scheduler', methods=['GET'])
+@login_required
+def get_scheduler_settings():
+    return jsonify(scheduler_settings_json(fsrs.get_settings(current_user.id)))
+
+@api_bp.route('/flashcards/scheduler', methods=['PUT'])
+@login_required
+def update_scheduler_settings():
+    data = request.get_json(silent=True) or {}
+    scheduler = data.get('scheduler')
+    if scheduler is not None and scheduler not in spaced_repetition.SCHEDULERS:
+        return jsonify({'success': False, 'message': 'Unknown scheduler'}), 400
+    retention = data.get('desired_retention')
+    if retention is not None:
+        try:
+            retention = float(retention)
+        except (TypeError, ValueError):
+            retention = None
+        if retention is None or not 0.7 <= retention <= 0.97:
+            return jsonify({'success': False, 'message': 'desired_retention must be between 0.7 and 0.97'}), 400
+
+    settings = fsrs.get_settings(current_user.id, create=True)
+    changed = (scheduler or settings.scheduler) != settings.scheduler or \
+        (retention is not None and retention != settings.desired_retention)
+    if scheduler:
+        settings.scheduler = scheduler
+    if retention is not None:
+        settings.desired_retention = retention
+
+    rescheduled = 0
+    if changed and settings.scheduler == 'fsrs' and fsrs.numpy_available():
+        # Otherwise cards switch over one by one as they are reviewed
+        rescheduled = fsrs.reschedule_user(current_user.id, settings)
+    db.session.commit()
+    return jsonify({'success': True, 'rescheduled': rescheduled, **scheduler_settings_json(settings)})
+
+@api_bp.route('/flashcards/scheduler/optimize', methods=['POST'])
+@login_required
+@limiter.limit("3 per hour")
+def optimize_scheduler():
+    if not fsrs.numpy_available():
+        return jsonify({'success': False, 'message': 'Optimizer not available on this server'}), 501
+    result = fsrs.optimize_user(current_user.id)
+    if not result['optimized']:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f"At least {result['required']} reviews needed", **result}), 400
+    settings = fsrs.get_settings(current_user.id)
+    result['rescheduled'] = fsrs.reschedule_user(current_user.id, settings) if settings.scheduler == 'fsrs' else 0
+    db.session.commit()
+    return jsonify({'success': True, **result})
+
 @api_bp.route('/decks/<int:id>', methods=['PUT'])
 @login_required
 def update_deck(id):
@@ -0,0 +1,87 @@
+"""
+Schema Version Gate
+Startup check of the database schema against the Alembic head of this code.
+A database at SCHEMA_REVISION costs one query per worker boot; only otherwise
+the schema is brought up to date (under a file lock, so one of the gunicorn
+workers migrates while the others wait):
+
+    empty database      db.create_all(), stamped as head
+    no alembic_version  created by db.create_all() and the old startup
+                        migrations: stamped at LEGACY_REVISION, then upgraded
+                        (the revisions after it check what already exists)
+    older revision      upgraded
+
+Schema changes go into a new revision under migrations/versions; bump
+SCHEMA_REVISION to its id.
+"""
+import os
+import logging
+from contextlib import contextmanager
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from . import db
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_REVISION = 'a7c3e9f1d264'
+LEGACY_REVISION = 'e4286b21a303'  # Last revision before the startup migrations moved to Alembic
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+
+def stored_revisions():
+    """Revisions in alembic_version, None if the table does not exist"""
+    try:
+        with db.engine.connect() as conn:
+            return {row[0] for row in conn.execute(text('SELECT version_num FROM alembic_version'))}
+    except (OperationalError, ProgrammingError):
+        return None
+
+
+def is_current():
+    return stored_revisions() == {SCHEMA_REVISION}
+
+
+@contextmanager
+def _migration_lock(app):
+    try:
+        import fcntl
+    except ImportError:
+        yield  # Windows: a single process
+        return
+    os.makedirs(app.instance_path, exist_ok=True)
+    with open(os.path.join(app.instance_path, 'schema_migration.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def migrate():
+    """Create or upgrade the schema to SCHEMA_REVISION (app context)"""
+    from flask_migrate import stamp, upgrade
+
+    tables = set(inspect(db.engine).get_table_names()) - {'alembic_version'}
+    revisions = stored_revisions()
+    db.create_all()
+    if not tables:
+        logger.info("Schema: new database, stamping as %s", SCHEMA_REVISION)
+        stamp(directory=MIGRATIONS_DIR, revision='head')
+        return
+    if not revisions:
+        logger.info("Schema: database without revision, continuing from %s", LEGACY_REVISION)
+        stamp(directory=MIGRATIONS_DIR, revision=LEGACY_REVISION)
+    logger.info("Schema: upgrading %s to %s", ', '.join(sorted(revisions or [LEGACY_REVISION])), SCHEMA_REVISION)
+    upgrade(directory=MIGRATIONS_DIR)
+
+
+def ensure_schema(app):
+    """Fast path for an up-to-date database; returns True if a migration ran"""
+    with app.app_context():
+        if is_current():
+            return False
+        with _migration_lock(app):
+            if is_current():  # Migrated by another worker meanwhile
+                return False
+            migrate()
+        return True
@@ -0,0 +1,226 @@
+"""
+Spaced Repetition
+Scheduling shared by the single and the batched review endpoint (SM-2, or FSRS
+per user, see fsrs.py; every rating is written to the review log), and the
+server-side study queue: the next due cards of a deck (most overdue first),
+followed by new cards up to the daily new-card limit. Only the cards of the
+current batch are sent, so study sessions cost the same for any deck size.
+"""
+from datetime import datetime, time, timedelta
+from flask import current_app
+from .models import db, Deck, Flashcard, CardReview, ReviewLog
+from . import fsrs
+
+MAX_BATCH = 100
+MAX_REVIEW_BATCH = 1000  # Reviews per batch request
+SCHEDULERS = ('sm2', 'fsrs')
+
+
+def new_review(user_id, card_id, reviewed_at=None):
+    return CardReview(
+        user_id=user_id,
+        card_id=card_id,
+        interval=0,
+        ease_factor=2.5,
+        review_count=0,
+        created_at=reviewed_at or datetime.utcnow()
+    )
+
+
+def apply_sm2(review, quality, reviewed_at=None):
+    """
+    Update a CardReview with one SM-2 rating at reviewed_at (default: now).
+    Quality: 0=Blackout, 1=Incorrect, 2=Hard, 3=Pass, 4=Good, 5=Bright
+    (the UI maps 1(Again) -> 1, 2(Hard) -> 2, 3(Good) -> 4, 4(Easy) -> 5).
+    """
+    reviewed_at = reviewed_at or datetime.utcnow()
+    if quality < 2:
+        # Failed / Again (< 1m)
+        review.interval = 0 # 0 days
+        review.review_count = 0
+        review.next_review_at = reviewed_at + timedelta(minutes=1)
+    else:
+        if not review.review_count:
+            review.interval = 1
+        elif review.review_count == 1:
+            review.interval = 6
+        else:
+            review.interval = round(review.interval * review.ease_factor)
+        
+        review.review_count = (review.review_count or 0) + 1
+        review.next_review_at = reviewed_at + timedelta(days=review.interval)
+
+    # Update Ease
+    # EF' = EF + (0.1 - (5 - q) * (0.08 + (5 - q) * 0.02))
+    review.ease_factor = review.ease_factor + (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    if review.ease_factor < 1.3:
+        review.ease_factor = 1.3
+        
+    review.last_review_at = reviewed_at
+    return review
+
+
+def record_review(review, quality, reviewed_at=None, settings=None):
+    """
+    Log a rating and apply it with the user's scheduler (settings: their
+    SchedulerSettings, None = SM-2). Not committed.
+    """
+    reviewed_at = reviewed_at or datetime.utcnow()
+    scheduler = settings.scheduler if settings is not None and settings.scheduler in SCHEDULERS else 'sm2'
+    # last_review_at is only unset on a CardReview that was just created
+    elapsed_days = None
+    if review.last_review_at is not None:
+        elapsed_days = max(0.0, (reviewed_at - review.last_review_at).total_seconds() / 86400)
+    db.session.add(ReviewLog(
+        user_id=review.user_id,
+        card_id=review.card_id,
+        rating=quality,
+        reviewed_at=reviewed_at,
+        elapsed_days=elapsed_days,
+        last_interval=review.interval,
+        scheduler=scheduler
+    ))
+
+    if scheduler == 'fsrs':
+        return fsrs.apply_fsrs(review, quality, reviewed_at, elapsed_days,
+                               fsrs.weights_for(settings), settings.desired_retention or 0.9)
+    return apply_sm2(review, quality, reviewed_at)
+
+
+def _parse_reviewed_at(value, now):
+    if not value:
+        return now
+    reviewed_at = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if reviewed_at.tzinfo is not None:
+        # Stored times are naive UTC
+        reviewed_at = (reviewed_at - reviewed_at.utcoffset()).replace(tzinfo=None)
+    return min(reviewed_at, now)  # Clock skew: never schedule from the future
+
+
+def apply_review_batch(user, entries, now=None):
+    """
+    Apply an ordered list of {card_id, quality, reviewed_at} in the current transaction.
+    Cards the user may not study, invalid entries and reviews older than the stored
+    last review (already synced from another device) are skipped.
+    Returns (results, skipped). Loads all cards and reviews with two queries.
+    """
+    now = now or datetime.utcnow()
+    parsed = []
+    skipped = []
+    for position, entry in enumerate(entries):
+        try:
+            card_id = int(entry['card_id'])
+            quality = int(entry['quality'])
+            if not 0 <= quality <= 5:
+                raise ValueError('quality must be 0-5')
+            parsed.append((card_id, quality, _parse_reviewed_at(entry.get('reviewed_at'), now)))
+        except (KeyError, TypeError, ValueError) as e:
+            skipped.append({'index': position, 'reason': str(e)})
+
+    card_ids = {card_id for card_id, _, _ in parsed}
+    accessible = set()
+    if card_ids:
+        query = db.session.query(Flashcard.id).join(Deck, Deck.id == Flashcard.deck_id).filter(Flashcard.id.in_(card_ids))
+        if not user.is_super_admin:
+            query = query.filter(db.or_(Deck.is_public == True, Deck.user_id == user.id))
+        accessible = {card_id for (card_id,) in query}
+    reviews = {r.card_id: r for r in CardReview.query.filter(
+        CardReview.user_id == user.id, CardReview.card_id.in_(accessible)
+    )} if accessible else {}
+
+    settings = fsrs.get_settings(user.id)
+    results = {}
+    for card_id, quality, reviewed_at in parsed:
+        if card_id not in accessible:
+            skipped.append({'card_id': card_id, 'reason': 'not found'})
+            continue
+        review = reviews.get(card_id)
+        if review is None:
+            review = reviews[card_id] = new_review(user.id, card_id, reviewed_at)
+            db.session.add(review)
+        elif review.last_review_at and reviewed_at < review.last_review_at:
+            skipped.append({'card_id': card_id, 'reason': 'outdated'})
+            continue
+        record_review(review, quality, reviewed_at, settings)
+        results[card_id] = {
+            'card_id': card_id,
+            'next_review': review.next_review_at.isoformat(),
+            'interval': review.interval
+        }
+    return list(results.values()), skipped
+
+
+def _start_of_day(now):
+    return datetime.combine(now.date(), time.min)
+
+
+def _unseen(query, deck_id, user_id):
+    """Restrict a query to the cards of a deck the user has never reviewed"""
+    return query.outerjoin(
+        CardReview, db.and_(CardReview.card_id == Flashcard.id, CardReview.user_id == user_id)
+    ).filter(Flashcard.deck_id == deck_id, CardReview.id.is_(None))
+
+
+def new_cards_left_today(deck_id, user_id, now=None):
+    """New cards the user may still start in this deck today (NEW_CARDS_PER_DAY)"""
+    now = now or datetime.utcnow()
+    limit = current_app.config['NEW_CARDS_PER_DAY']
+    started_today = db.session.query(db.func.count(CardReview.id)).join(
+        Flashcard, Flashcard.id == CardReview.card_id
+    ).filter(
+        Flashcard.deck_id == deck_id,
+        CardReview.user_id == user_id,
+        CardReview.created_at >= _start_of_day(now)
+    ).scalar()
+    return max(0, limit - started_today)
+
+
+def study_counts(deck_id, user_id, now=None):
+    """{'due': reviews due now, 'new': new cards available today (capped)}"""
+    now = now or datetime.utcnow()
+    due = db.session.query(db.func.count(CardReview.id)).join(
+        Flashcard, Flashcard.id == CardReview.card_id
+    ).filter(
+        Flashcard.deck_id == deck_id,
+        CardReview.user_id == user_id,
+        CardReview.next_review_at <= now
+    ).scalar()
+    unseen = _unseen(db.session.query(db.func.count(Flashcard.id)), deck_id, user_id).scalar()
+    return {'due': due, 'new': min(unseen, new_cards_left_today(deck_id, user_id, now))}
+
+
+def next_study_cards(deck_id, user_id, limit, exclude=(), now=None):
+    """
+    Up to `limit` cards to study next: due reviews ordered by next_review_at,
+    then new cards in creation order within today's new-card allowance.
+    `exclude` are card ids the client still has queued.
+    """
+    now = now or datetime.utcnow()
+    limit = max(0, min(limit, MAX_BATCH))
+    columns = (Flashcard.id, Flashcard.front, Flashcard.back, Flashcard.image_url)
+
+    due_query = db.session.query(*columns).join(
+        CardReview, CardReview.card_id == Flashcard.id
+    ).filter(
+        CardReview.user_id == user_id,
+        CardReview.next_review_at <= now,
+        Flashcard.deck_id == deck_id
+    )
+    if exclude:
+        due_query = due_query.filter(Flashcard.id.notin_(exclude))
+    cards = [dict(zip(('id', 'front', 'back', 'image_url'), row), is_new=False)
+             for row in due_query.order_by(CardReview.next_review_at).limit(limit)]
+
+    allowance = new_cards_left_today(deck_id, user_id, now)
+    new_query = _unseen(db.session.query(*columns), deck_id, user_id)
+    if exclude and allowance > 0:
+        # New cards already queued on the client count against today's allowance
+        allowance -= _unseen(db.session.query(db.func.count(Flashcard.id)), deck_id, user_id).filter(
+            Flashcard.id.in_(exclude)
+        ).scalar()
+        new_query = new_query.filter(Flashcard.id.notin_(exclude))
+    remaining = min(limit - len(cards), allowance)
+    if remaining > 0:
+        cards.extend(dict(zip(('id', 'front', 'back', 'image_url'), row), is_new=True)
+                     for row in new_query.order_by(Flashcard.id).limit(remaining))
+    return cards
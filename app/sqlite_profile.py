@@ -0,0 +1,62 @@
+"""
+SQLite Profile
+Connection pragmas for the SQLite database, set on every new connection of
+the engine. The default profile is for several gunicorn workers writing to
+the same file:
+
+    journal_mode=WAL      readers no longer block the writer (and vice versa)
+    synchronous=NORMAL    commits append to the WAL without an fsync; only
+                          checkpoints sync (durable against app crashes, the
+                          last commits may be lost on power loss)
+    busy_timeout          wait for the write lock instead of failing with
+                          "database is locked"
+    mmap_size/cache_size  fewer read syscalls, larger page cache per connection
+
+SQLITE_JOURNAL_MODE=delete with SQLITE_SYNCHRONOUS=full restores the old
+rollback-journal behaviour. Other databases are left untouched.
+"""
+import logging
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_MODES = ('wal', 'delete', 'truncate', 'persist', 'memory', 'off')
+SYNCHRONOUS = ('off', 'normal', 'full', 'extra')
+
+
+def pragmas(config):
+    """The pragma statements for the app config, in the order they are applied"""
+    journal_mode = config['SQLITE_JOURNAL_MODE'].lower()
+    synchronous = config['SQLITE_SYNCHRONOUS'].lower()
+    if journal_mode not in JOURNAL_MODES:
+        raise ValueError(f"SQLITE_JOURNAL_MODE must be one of {', '.join(JOURNAL_MODES)}")
+    if synchronous not in SYNCHRONOUS:
+        raise ValueError(f"SQLITE_SYNCHRONOUS must be one of {', '.join(SYNCHRONOUS)}")
+    return [
+        # First, so that switching the journal mode waits for other workers
+        f"PRAGMA busy_timeout = {int(config['SQLITE_BUSY_TIMEOUT'])}",
+        f"PRAGMA journal_mode = {journal_mode}",
+        f"PRAGMA synchronous = {synchronous}",
+        f"PRAGMA mmap_size = {int(config['SQLITE_MMAP_SIZE'])}",
+        f"PRAGMA cache_size = {-int(config['SQLITE_CACHE_SIZE_KB'])}",  # Negative = KiB
+    ]
+
+
+def configure(engine, config):
+    """Apply the profile to every new connection of a SQLite engine"""
+    if engine.dialect.name != 'sqlite':
+        return
+    statements = pragmas(config)
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                try:
+                    cursor.execute(statement)
+                except Exception as e:
+                    # e.g. journal_mode while another process holds the database exclusively
+                    logger.warning(f"SQLite pragma failed ({statement}): {e}")
+        finally:
+            cursor.close()
@@ -1,7 +1,7 @@
 
-import webuntis
 from datetime import datetime, date, timedelta
 import logging
+from . import integrations
 
 logger = logging.getLogger(__name__)
 
@@ -29,7 +29,7 @@ def fetch_timetable_live(creds, target_date):
             
         logger.debug(f"Untis creds for class {creds.class_id}: server='{server_url}', school='{school_name}', user='{user_name}', target_class='{creds.untis_class_name}'")
         
-        s = webuntis.Session(
+        s = integrations.load('untis').Session(
             server=server_url,
             username=user_name,
             password=pwd,
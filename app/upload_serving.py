@@ -0,0 +1,62 @@
+"""
+Upload Serving
+Flask checks the login, the bytes can be sent by the reverse proxy:
+
+    UPLOAD_SERVE_MODE=flask       send_from_directory (default, no proxy needed)
+    UPLOAD_SERVE_MODE=x-accel     nginx: X-Accel-Redirect to an internal location
+    UPLOAD_SERVE_MODE=x-sendfile  Apache mod_xsendfile / lighttpd: X-Sendfile with the file path
+
+nginx needs an internal location matching UPLOAD_ACCEL_PREFIX:
+
+    location /_protected_uploads/ {
+        internal;
+        alias /data/uploads/;
+    }
+
+Upload names never get reused, so responses may be cached privately for a long time.
+"""
+import os
+import hashlib
+import mimetypes
+from flask import current_app, request, abort, Response, send_from_directory
+from werkzeug.security import safe_join
+from .image_queue import INCOMING_FOLDER
+
+SERVE_MODES = ('flask', 'x-accel', 'x-sendfile')
+
+
+def upload_etag(stat):
+    """Weak validator from size and mtime (same inputs nginx uses for static files)"""
+    raw = f"{stat.st_mtime_ns}-{stat.st_size}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20]
+
+
+def serve_upload(filename):
+    """Response for an upload below UPLOAD_FOLDER (the caller has done the access check)"""
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    path = safe_join(upload_folder, filename)
+    # Raw uploads waiting for the image queue are not served
+    if path is None or filename.startswith(INCOMING_FOLDER) or not os.path.isfile(path):
+        abort(404)
+
+    max_age = current_app.config['UPLOAD_CACHE_MAX_AGE']
+    mode = current_app.config['UPLOAD_SERVE_MODE']
+
+    if mode == 'flask':
+        response = send_from_directory(upload_folder, filename, max_age=max_age)
+    else:
+        stat = os.stat(path)
+        etag = upload_etag(stat)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+            if mode == 'x-accel':
+                prefix = current_app.config['UPLOAD_ACCEL_PREFIX'].rstrip('/')
+                response.headers['X-Accel-Redirect'] = f"{prefix}/{filename}"
+            else:
+                response.headers['X-Sendfile'] = os.path.abspath(path)
+        response.set_etag(etag)
+
+    response.headers['Cache-Control'] = f'private, max-age={max_age}'
+    return response
@@ -0,0 +1,404 @@
+"""
+Upload Store
+Content-addressed upload storage. Files are stored once per content under
+sharded paths below UPLOAD_FOLDER:
+
+    ab/cd/abcd1234...<sha256>.jpg
+
+The key (that relative path) is what TaskImage.filename, MealPlan.image_path,
+TimetableImage.image_path, TaskMessage.file_url and Flashcard.image_url
+("/uploads/<key>") store.
+The same worksheet uploaded in three classes is one file with ref_count 3.
+
+Images that get re-encoded by the image queue are hashed together with the
+processing profile, so a raw chat copy and a processed task image of the same
+bytes never share a key.
+
+Reference counts are kept by a session listener (ORM inserts/deletes of the
+referencing rows); collect_garbage() recounts them, since bulk deletes and
+restores bypass the listener, and removes unreferenced blobs and stray files.
+Old flat uploads keep working; migrate_legacy_uploads() moves them over.
+"""
+import os
+import re
+import uuid
+import hashlib
+import shutil
+from collections import Counter
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import bindparam, event, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from .models import db, UploadBlob, TaskImage, TaskMessage, MealPlan, TimetableImage, Flashcard
+from .image_queue import incoming_path, INCOMING_FOLDER
+from .image_variants import variant_filename, existing_variants, delete_variants, VARIANT_MIMES
+
+# Processing profile of the image queue (MAX_WIDTH, JPEG quality); change it when the pipeline changes
+IMAGE_PROFILE = 'jpeg-2000-q75'
+URL_PREFIX = '/uploads/'
+GC_GRACE = timedelta(hours=6)  # Unreferenced blobs and stray files younger than this are kept
+CHUNK_SIZE = 1024 * 1024
+
+_KEY_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.[a-z0-9]{1,10}$')
+
+# Referencing columns per model (TaskMessage and Flashcard store a URL)
+BLOB_REFERENCES = {
+    TaskImage: 'filename',
+    MealPlan: 'image_path',
+    TimetableImage: 'image_path',
+    TaskMessage: 'file_url',
+    Flashcard: 'image_url',
+}
+
+
+def blob_key(digest, ext):
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+
+def is_blob_key(name):
+    return bool(name) and _KEY_RE.match(name) is not None
+
+
+def upload_name(value):
+    """Path below UPLOAD_FOLDER for a stored value (filename or /uploads/ URL)"""
+    if value and value.startswith(URL_PREFIX):
+        return value[len(URL_PREFIX):]
+    return value
+
+
+def normalize_ext(filename, default=''):
+    ext = os.path.splitext(filename or '')[1].lower()
+    if not re.match(r'^\.[a-z0-9]{1,10}$', ext):
+        return default
+    return ext
+
+
+def _hash_to_temp(file_storage, temp_path, profile):
+    digest = hashlib.sha256()
+    if profile:
+        digest.update(profile.encode('utf-8') + b'\0')
+    size = 0
+    file_storage.seek(0)
+    with open(temp_path, 'wb') as out:
+        for chunk in iter(lambda: file_storage.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def _conflict_insert(dialect_name):
+    """insert() with on_conflict_do_nothing() for the dialect, None if it has none"""
+    if dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    return insert
+
+
+def _ensure_blob(key, digest, size):
+    """
+    Add the blob row unless it exists, in the caller's transaction. The same content may be
+    stored concurrently by another worker: INSERT .. ON CONFLICT DO NOTHING instead of a
+    savepoint, since pysqlite opens its transaction lazily (a SAVEPOINT as the first write
+    would begin it and the RELEASE commit it, whatever the caller does afterwards).
+    """
+    if UploadBlob.query.filter_by(key=key).first() is not None:
+        return
+    connection = db.session.connection()
+    insert = _conflict_insert(connection.dialect.name)
+    if insert is None:
+        try:
+            with db.session.begin_nested():
+                db.session.add(UploadBlob(key=key, digest=digest, size=size, ref_count=0))
+        except IntegrityError:
+            pass  # Stored concurrently by another worker
+        return
+
+    table = UploadBlob.__table__
+    now = datetime.utcnow()
+    blob_id = connection.execute(
+        insert(table)
+        .values(key=key, digest=digest, size=size, ref_count=0, created_at=now, updated_at=now)
+        .on_conflict_do_nothing(index_elements=['key'])
+        .returning(table.c.id)
+    ).scalar()
+    if blob_id is not None:
+        from .backup import journal_rows
+        journal_rows(connection, table.name, [blob_id])
+
+
+def store_upload(file_storage, ext, process_image=False):
+    """
+    Store an uploaded file by content. Returns (key, new):
+    process_image=False: the file is stored as-is; new is False if the content was already there.
+    process_image=True: new means the raw upload was put into the image queue's incoming
+    folder and the row must be enqueued; False means the processed file already exists.
+    The blob row is added to the session, the caller commits it with the referencing row.
+    """
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    temp_dir = os.path.join(upload_folder, INCOMING_FOLDER)
+    os.makedirs(temp_dir, exist_ok=True)
+    temp_path = os.path.join(temp_dir, f"{uuid.uuid4().hex}.part")
+    try:
+        digest, size = _hash_to_temp(file_storage, temp_path, IMAGE_PROFILE if process_image else '')
+        key = blob_key(digest, ext)
+        final_path = os.path.join(upload_folder, key)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+
+        if os.path.exists(final_path):
+            new = False
+        elif process_image:
+            target = incoming_path(upload_folder, key)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(temp_path, target)
+            new = True
+        else:
+            os.replace(temp_path, final_path)
+            new = True
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    _ensure_blob(key, digest, size)
+    return key, new
+
+
+def discard(name):
+    """
+    A referencing row was deleted: content-addressed files are left to the
+    garbage collector (other rows may share them), old flat uploads are removed directly.
+    """
+    name = upload_name(name)
+    if not name or is_blob_key(name):
+        return
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    path = os.path.join(upload_folder, name)
+    if os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    delete_variants(upload_folder, name)
+
+
+def _referenced_keys(obj, attr, history_side):
+    """Blob keys one side ('added'/'deleted') of an attribute's history refers to"""
+    history = inspect(obj).attrs[attr].history
+    return [upload_name(v) for v in getattr(history, history_side) if is_blob_key(upload_name(v))]
+
+
+@event.listens_for(Session, 'after_flush')
+def _count_blob_references(session, flush_context):
+    """Keep UploadBlob.ref_count in step with ORM inserts, deletes and path changes"""
+    deltas = Counter()
+    for obj in session.new:
+        attr = BLOB_REFERENCES.get(type(obj))
+        if attr:
+            key = upload_name(getattr(obj, attr))
+            if is_blob_key(key):
+                deltas[key] += 1
+    for obj in session.deleted:
+        attr = BLOB_REFERENCES.get(type(obj))
+        if attr:
+            key = upload_name(getattr(obj, attr))
+            if is_blob_key(key):
+                deltas[key] -= 1
+    for obj in session.dirty:
+        attr = BLOB_REFERENCES.get(type(obj))
+        if attr:
+            for key in _referenced_keys(obj, attr, 'added'):
+                deltas[key] += 1
+            for key in _referenced_keys(obj, attr, 'deleted'):
+                deltas[key] -= 1
+
+    adjust_references(session.connection(), deltas)
+
+
+def adjust_references(connection, deltas):
+    """Apply { key: change } to the reference counts (for bulk inserts that bypass the listener)"""
+    table = UploadBlob.__table__
+    now = datetime.utcnow()
+    for key, delta in deltas.items():
+        if delta:
+            connection.execute(
+                table.update().where(table.c.key == key)
+                .values(ref_count=table.c.ref_count + delta, updated_at=now)
+            )
+
+
+def count_references():
+    """{ key: number of rows referring to it }, from the referencing tables"""
+    counts = Counter()
+    for model, attr in BLOB_REFERENCES.items():
+        column = getattr(model, attr)
+        for (value,) in db.session.query(column).filter(column.isnot(None)).yield_per(1000):
+            key = upload_name(value)
+            if is_blob_key(key):
+                counts[key] += 1
+    return counts
+
+
+def _add_missing_blobs(counts):
+    """
+    Blob rows for referenced keys that have none (not committed). A restore replaces
+    upload_blob, but timetable_image and flashcard are not in the backup: their rows
+    survive it and may refer to files whose blob row is gone.
+    """
+    known = {key for (key,) in db.session.query(UploadBlob.key)}
+    missing = [key for key in counts if key not in known]
+    if not missing:
+        return
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    now = datetime.utcnow()
+    rows = []
+    for key in missing:
+        path = os.path.join(upload_folder, key)
+        rows.append({'key': key, 'digest': os.path.basename(key)[:64], 'ref_count': counts[key],
+                     'size': os.path.getsize(path) if os.path.exists(path) else 0,
+                     'created_at': now, 'updated_at': now})
+    db.session.execute(UploadBlob.__table__.insert(), rows)
+
+
+def recount_references():
+    """
+    Set every blob's ref_count from the referencing tables (not committed).
+    Restores insert the referencing rows past the listener, and the backup journal
+    does not see adjust_references(), so restored counts are recomputed instead.
+    Referenced keys without a blob row get one.
+    """
+    table = UploadBlob.__table__
+    db.session.execute(table.update().values(ref_count=0))
+    counts = count_references()
+    _add_missing_blobs(counts)
+    if counts:
+        db.session.execute(
+            table.update().where(table.c.key == bindparam('blob_key')).values(ref_count=bindparam('refs')),
+            [{'blob_key': key, 'refs': refs} for key, refs in counts.items()]
+        )
+
+
+def collect_garbage(grace=GC_GRACE):
+    """
+    Recount references, delete blobs nobody refers to (files, variants, row) and
+    remove stray files in the shard folders that have no blob row (e.g. from a
+    failed request). Needs an app context. Returns (blobs removed, stray files removed).
+    """
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    table = UploadBlob.__table__
+    cutoff = datetime.utcnow() - grace
+
+    counts = count_references()
+    _add_missing_blobs(counts)
+    for blob in UploadBlob.query.all():
+        actual = counts.get(blob.key, 0)
+        if blob.ref_count != actual:
+            blob.ref_count = actual
+            blob.updated_at = datetime.utcnow()
+    db.session.commit()
+
+    removed = 0
+    candidates = db.session.query(UploadBlob.id, UploadBlob.key).filter(
+        UploadBlob.ref_count <= 0, UploadBlob.updated_at < cutoff
+    ).all()
+    for blob_id, key in candidates:
+        # Conditional delete: a request may have picked the blob up again in the meantime
+        result = db.session.execute(table.delete().where(table.c.id == blob_id, table.c.ref_count <= 0))
+        db.session.commit()
+        if result.rowcount:
+            path = os.path.join(upload_folder, key)
+            if os.path.exists(path):
+                os.remove(path)
+            delete_variants(upload_folder, key)
+            removed += 1
+
+    # Referenced files are kept even without a blob row
+    known = {digest for (digest,) in db.session.query(UploadBlob.digest)}
+    known.update(os.path.basename(key)[:64] for key in counts)
+    stray = 0
+    cutoff_ts = cutoff.timestamp()
+    for shard in os.listdir(upload_folder) if os.path.isdir(upload_folder) else []:
+        if not re.match(r'^[0-9a-f]{2}$', shard):
+            continue
+        for root, dirs, files in os.walk(os.path.join(upload_folder, shard)):
+            for name in files:
+                path = os.path.join(root, name)
+                if name[:64] in known or os.path.getmtime(path) >= cutoff_ts:
+                    continue
+                os.remove(path)
+                stray += 1
+    return removed, stray
+
+
+def store_file(path, ext, digest=None):
+    """
+    Move a file that is already on disk (completed chunked upload, legacy upload)
+    into the store, stored as-is. Returns (key, new) like store_upload.
+    """
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    if digest is None:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+    key = blob_key(digest, ext)
+    final_path = os.path.join(upload_folder, key)
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    size = os.path.getsize(path)
+
+    if os.path.exists(final_path):
+        os.remove(path)  # Duplicate content
+        new = False
+    else:
+        shutil.move(path, final_path)
+        new = True
+    _ensure_blob(key, digest, size)
+    return key, new
+
+
+def _store_existing_file(path, ext):
+    """Legacy migration: store a flat upload and carry its variants over; returns the key"""
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    old_name = os.path.relpath(path, upload_folder)
+    formats = tuple(VARIANT_MIMES)
+    key, new = store_file(path, ext)
+    if not new:
+        delete_variants(upload_folder, old_name, formats)
+        return key
+    for fmt, variants in existing_variants(upload_folder, old_name, formats).items():
+        for width, old_variant in variants:
+            os.replace(os.path.join(upload_folder, old_variant), os.path.join(upload_folder, variant_filename(key, width, fmt)))
+    return key
+
+
+def migrate_legacy_uploads():
+    """
+    Move flat uploads referenced by rows into the content-addressed store and
+    rewrite the rows (committed per row, so an interrupted run can simply be repeated).
+    Unreferenced flat files are left alone. Returns the number of rows updated.
+    """
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    migrated = {}  # old name -> key (rows sharing one legacy file)
+    updated = 0
+    for model, attr in BLOB_REFERENCES.items():
+        column = getattr(model, attr)
+        rows = model.query.filter(column.isnot(None)).all()
+        for row in rows:
+            value = getattr(row, attr)
+            name = upload_name(value)
+            if not name or is_blob_key(name) or '/' in name:
+                continue
+            if name not in migrated:
+                path = os.path.join(upload_folder, name)
+                if not os.path.isfile(path):
+                    continue
+                migrated[name] = _store_existing_file(path, normalize_ext(name, '.bin'))
+            key = migrated[name]
+            setattr(row, attr, f"{URL_PREFIX}{key}" if value.startswith(URL_PREFIX) else key)
+            db.session.commit()
+            updated += 1
+    return updated
@@ -0,0 +1,77 @@
+"""
+Benchmark: per-call crypto overhead with and without key/cipher caching
+Measures the paths hit on every request: Fernet token decryption
+(UntisCredential.get_password, DriveOAuthToken.get_access_token), key
+derivation (derive_key_from_password) and encrypt_data/decrypt_data.
+
+Usage:
+    python benchmarks/bench_crypto_overhead.py [--iterations 2000]
+"""
+import os
+import sys
+import time
+import base64
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from app.encryption import (
+    AESEncryption, encrypt_data, decrypt_data, fernet_decrypt,
+    generate_encryption_key, clear_key_cache, get_key_cache_stats
+)
+
+
+def per_call_us(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def report(label, before, after):
+    print(f"{label:<34} {before:>12.1f} us   {after:>10.1f} us   x{before / after:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--kdf-iterations', type=int, default=5, help='PBKDF2 calls in the uncached run (slow)')
+    args = parser.parse_args()
+    n = args.iterations
+
+    fernet_key = base64.urlsafe_b64encode(os.urandom(32))
+    token = Fernet(fernet_key).encrypt(b'ya29.some-access-token').decode()
+    aes_key = generate_encryption_key()
+    payload = os.urandom(1024)
+    blob = encrypt_data(payload, aes_key)
+    salt = os.urandom(AESEncryption.SALT_SIZE)
+
+    def uncached_fernet():
+        # Behaviour before caching: new Fernet instance and decrypt per call
+        Fernet(fernet_key).decrypt(token.encode()).decode()
+
+    def uncached_decrypt_data():
+        AESEncryption(master_key=base64.b64decode(aes_key)).decrypt(blob)
+
+    def uncached_derive():
+        PBKDF2HMAC(algorithm=hashes.SHA256(), length=AESEncryption.KEY_SIZE, salt=salt,
+                   iterations=AESEncryption.PBKDF2_ITERATIONS).derive(b'password')
+
+    clear_key_cache()
+    print(f"{'path':<34} {'before':>15} {'after':>13} {'speedup':>9}")
+    report("Fernet token decrypt", per_call_us(uncached_fernet, n),
+           per_call_us(lambda: fernet_decrypt(fernet_key, token), n))
+    report("decrypt_data (1 KB)", per_call_us(uncached_decrypt_data, n),
+           per_call_us(lambda: decrypt_data(blob, aes_key), n))
+    report("derive_key_from_password", per_call_us(uncached_derive, args.kdf_iterations),
+           per_call_us(lambda: AESEncryption.derive_key_from_password('password', salt), n))
+
+    print()
+    for name, stats in get_key_cache_stats().items():
+        print(f"cache {name:<13} hits={stats['hits']:<8} misses={stats['misses']:<4} size={stats['size']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark: file encryption throughput and peak memory
+Compares the legacy single-message AES-GCM (whole file in RAM) with the
+chunked streaming format of app.encryption.
+
+Usage:
+    python benchmarks/bench_encryption.py [--size-mb 256] [--chunk-kb 64]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.encryption import AESEncryption
+
+
+def legacy_encrypt_file(enc, input_path, output_path):
+    # Behaviour of AESEncryption.encrypt_file before the streaming format
+    with open(input_path, 'rb') as f:
+        plaintext = f.read()
+    with open(output_path, 'wb') as f:
+        f.write(enc.encrypt(plaintext))
+
+
+def legacy_decrypt_file(enc, input_path, output_path):
+    with open(input_path, 'rb') as f:
+        data = f.read()
+    with open(output_path, 'wb') as f:
+        f.write(enc.decrypt(data))
+
+
+def measure(label, func, size_bytes):
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<28} {size_bytes / elapsed / 1024 / 1024:>9.1f} MB/s   peak {peak / 1024 / 1024:>8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--chunk-kb', type=int, default=AESEncryption.STREAM_CHUNK_SIZE // 1024)
+    args = parser.parse_args()
+
+    enc = AESEncryption()
+    size = args.size_mb * 1024 * 1024
+    chunk_size = args.chunk_kb * 1024
+
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = os.path.join(tmp, 'plain.bin')
+        with open(plain, 'wb') as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        legacy_out = os.path.join(tmp, 'legacy.enc')
+        stream_out = os.path.join(tmp, 'stream.enc')
+        restored = os.path.join(tmp, 'restored.bin')
+
+        def stream_encrypt():
+            with open(plain, 'rb') as f_in, open(stream_out, 'wb') as f_out:
+                for block in enc.encrypt_stream(f_in, chunk_size=chunk_size):
+                    f_out.write(block)
+
+        def range_decrypt():
+            # 1 MB window from the middle of the file (typical Range request)
+            with open(stream_out, 'rb') as f:
+                for _ in enc.decrypt_range(f, size // 2, size // 2 + 1024 * 1024 - 1):
+                    pass
+
+        print(f"File size: {args.size_mb} MB, chunk size: {args.chunk_kb} KB")
+        measure("legacy encrypt", lambda: legacy_encrypt_file(enc, plain, legacy_out), size)
+        measure("legacy decrypt", lambda: legacy_decrypt_file(enc, legacy_out, restored), size)
+        measure("streaming encrypt", stream_encrypt, size)
+        measure("streaming decrypt", lambda: enc.decrypt_file(stream_out, restored), size)
+
+        start = time.perf_counter()
+        range_decrypt()
+        print(f"{'streaming 1 MB range':<28} {(time.perf_counter() - start) * 1000:>9.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark: worker boot with lazy optional integrations
+Starts --runs fresh interpreters under `python -X importtime` and boots the
+app twice per run: as a worker does now (integrations imported on first use,
+see app/integrations.py) and eagerly, importing every registered integration
+right after create_app() like the module-level imports used to. Reports boot
+time, total import time, peak RSS and what each integration costs, plus the
+heaviest imports that remain in a lazy boot.
+
+Usage:
+    python benchmarks/bench_imports.py [--runs 5] [--top 10]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BOOT = """
+import json, time, resource
+start = time.perf_counter()
+from app import create_app, integrations
+app = create_app()
+booted = time.perf_counter()
+
+def rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+loads = {}
+if %r:
+    for name in integrations.registered():
+        before, t = rss_kb(), time.perf_counter()
+        try:
+            integrations.load(name)
+        except integrations.IntegrationUnavailable:
+            continue
+        loads[name] = (time.perf_counter() - t, rss_kb() - before)
+done = time.perf_counter()
+print(json.dumps({'boot': done - start, 'create_app': booted - start, 'rss_kb': rss_kb(), 'loads': loads}))
+"""
+
+
+def parse_importtime(stderr):
+    """[(cumulative seconds, module, depth)] from the -X importtime output"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        entries.append((int(cumulative) / 1e6, name.strip(), (len(name) - len(name.lstrip()) - 1) // 2))
+    return entries
+
+
+def boot(env, eager):
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', BOOT % eager],
+                         cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result['process'] = time.perf_counter() - start
+    result['imports'] = parse_importtime(out.stderr)
+    result['import_total'] = sum(c for c, _, depth in result['imports'] if depth == 0)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='Heaviest imports of a lazy boot to list')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ,
+                   DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                   UPLOAD_FOLDER=os.path.join(tmp, 'uploads'),
+                   SCHEDULER_ENABLED='false',
+                   PYTHONPATH=ROOT)
+        boot(env, False)  # Creates the schema
+        results = {'lazy': [], 'eager': []}
+        for _ in range(args.runs):
+            for mode in results:  # Interleaved, so that drift hits both alike
+                results[mode].append(boot(env, mode == 'eager'))
+
+    def median(mode, key, scale=1):
+        return statistics.median(r[key] * scale for r in results[mode])
+
+    print(f"  {f'{args.runs} boots each (median)':<28}   lazy      eager")
+    for label, key, scale, unit in (('boot until ready', 'boot', 1000, 'ms'),
+                                    ('process (incl. interpreter)', 'process', 1000, 'ms'),
+                                    ('imports (-X importtime)', 'import_total', 1000, 'ms'),
+                                    ('peak RSS', 'rss_kb', 1 / 1024, 'MB')):
+        lazy, eager = median('lazy', key, scale), median('eager', key, scale)
+        print(f"  {label:<28} {lazy:>6.0f} {unit} {eager:>6.0f} {unit}   saved {eager - lazy:.0f} {unit}")
+
+    print("\nintegrations, loaded on first use (median time / RSS growth):")
+    for name in results['eager'][0]['loads']:
+        seconds = statistics.median(r['loads'][name][0] for r in results['eager']) * 1000
+        rss = statistics.median(r['loads'][name][1] for r in results['eager']) / 1024
+        print(f"  {name:<12} {seconds:>6.0f} ms {rss:>6.1f} MB")
+
+    print("\nheaviest imports of a lazy boot (cumulative, first run):")
+    heaviest = sorted(results['lazy'][0]['imports'], reverse=True)[:args.top]
+    for cumulative, module, depth in heaviest:
+        print(f"  {cumulative * 1000:>6.0f} ms  {'  ' * depth}{module}")
+
+
+if __name__ == '__main__':
+    main()
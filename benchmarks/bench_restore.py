@@ -0,0 +1,106 @@
+"""
+Benchmark: restore throughput of the bulk restore engine
+Builds an NDJSON backup with --rows audit log rows (plus the users they
+reference), restores it into a temporary SQLite database and compares it
+with the previous ORM restore (one object per row, parse_val heuristics).
+
+Usage:
+    python benchmarks/bench_restore.py [--rows 1000000] [--legacy-rows 50000]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import zipfile
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def build_backup(path, rows, users=50):
+    start = datetime(2025, 9, 1)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        with zf.open('database/school_classes.ndjson', 'w') as f:
+            f.write(json.dumps({'id': 1, 'name': '10a'}).encode() + b'\n')
+        with zf.open('database/users.ndjson', 'w') as f:
+            for i in range(1, users + 1):
+                f.write(json.dumps({'id': i, 'username': f'user{i}', 'password_hash': 'x',
+                                    'role': 'student', 'class_id': 1, 'dark_mode': False}).encode() + b'\n')
+        with zf.open('database/audit_logs.ndjson', 'w', force_zip64=True) as f:
+            batch = []
+            for i in range(1, rows + 1):
+                batch.append(json.dumps({'id': i, 'user_id': i % users + 1, 'class_id': 1,
+                                         'action': f'Edited task {i}',
+                                         'timestamp': (start + timedelta(seconds=i)).isoformat()}))
+                if len(batch) >= 10000:
+                    f.write(('\n'.join(batch) + '\n').encode())
+                    batch = []
+            if batch:
+                f.write(('\n'.join(batch) + '\n').encode())
+        zf.writestr('manifest.json', json.dumps({'version': '3.0', 'format': 'ndjson'}))
+
+
+def legacy_restore(db, model, rows):
+    # Behaviour of perform_restore before the bulk engine
+    def parse_val(val):
+        if isinstance(val, str) and (len(val) >= 10):
+            if val.count('-') == 2:
+                try: return datetime.fromisoformat(val)
+                except:
+                    try: return datetime.strptime(val, '%Y-%m-%d').date()
+                    except: pass
+        return val
+
+    for d in rows:
+        obj = model()
+        for k, v in d.items():
+            if hasattr(obj, k):
+                setattr(obj, k, parse_val(v))
+        db.session.add(obj)
+    db.session.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--legacy-rows', type=int, default=50_000, help='Rows for the (slow) ORM comparison, 0 to skip')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ['UPLOAD_FOLDER'] = os.path.join(tmp, 'uploads')
+        from app import create_app
+        from app.models import db, AuditLog
+        from app.backup import BackupReader, restore_database
+
+        backup_path = os.path.join(tmp, 'backup.zip')
+        build_backup(backup_path, args.rows)
+        print(f"Backup: {args.rows} audit log rows, {os.path.getsize(backup_path) / 1024 / 1024:.1f} MB zipped")
+
+        app = create_app()
+        with app.app_context():
+            with zipfile.ZipFile(backup_path) as zf:
+                start = time.perf_counter()
+                counts = restore_database(BackupReader.from_zip(zf))
+                db.session.commit()
+                elapsed = time.perf_counter() - start
+            total = sum(counts.values())
+            print(f"{'bulk restore':<16} {total:>9} rows  {elapsed:>8.2f} s  {total / elapsed:>10.0f} rows/s")
+
+            if args.legacy_rows:
+                db.session.execute(AuditLog.__table__.delete())
+                db.session.commit()
+                with zipfile.ZipFile(backup_path) as zf:
+                    reader = BackupReader.from_zip(zf)
+                    rows = (r for i, r in zip(range(args.legacy_rows), reader.get('audit_logs')))
+                    start = time.perf_counter()
+                    legacy_restore(db, AuditLog, rows)
+                    db.session.commit()
+                    elapsed = time.perf_counter() - start
+                print(f"{'legacy ORM':<16} {args.legacy_rows:>9} rows  {elapsed:>8.2f} s  {args.legacy_rows / elapsed:>10.0f} rows/s")
+
+
+if __name__ == '__main__':
+    main()
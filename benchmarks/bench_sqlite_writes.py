@@ -0,0 +1,124 @@
+"""
+Benchmark: concurrent writes, rollback journal vs. WAL profile
+--workers processes (like gunicorn workers) share one SQLite file and each
+sends --requests rounds of "create a task" + "post a chat message" through
+the app. Run once with the old rollback-journal settings
+(journal_mode=delete, synchronous=full, 5 s busy timeout = pysqlite's
+default) and once with the default profile from sqlite_profile.
+
+Reports requests/s, latency percentiles and failed requests
+("database is locked" surfaces as a 400/500 from the route). fsync cost
+depends on the disk: use --dir to put the database on the data volume.
+
+Usage:
+    python benchmarks/bench_sqlite_writes.py [--workers 4] [--requests 100] [--users 30] [--dir /data]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PROFILES = {
+    'rollback': {'SQLITE_JOURNAL_MODE': 'delete', 'SQLITE_SYNCHRONOUS': 'full', 'SQLITE_BUSY_TIMEOUT': '5000'},
+    'wal': {},  # Defaults of create_app
+}
+
+
+def setup(users):
+    from app import create_app
+    from app.models import db, User, SchoolClass
+
+    app = create_app()
+    with app.app_context():
+        school_class = SchoolClass(name='Bench', chat_enabled=True)
+        db.session.add(school_class)
+        db.session.flush()
+        for i in range(users):
+            user = User(username=f'bench{i}', class_id=school_class.id, has_accepted_privacy=True,
+                        needs_password_change=False)
+            user.set_password('bench-password')
+            db.session.add(user)
+        db.session.commit()
+        return school_class.code
+
+
+def worker(index, class_code, requests, barrier, results):
+    from app import create_app
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATELIMIT_ENABLED'] = False
+    client = app.test_client()
+    resp = client.post('/login', json={'username': f'bench{index}', 'password': 'bench-password', 'class_code': class_code})
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+
+    latencies = []
+    failed = 0
+    barrier.wait()
+    for i in range(requests):
+        start = time.perf_counter()
+        resp = client.post('/api/tasks', json={'title': f'Aufgabe {index}-{i}', 'due_date': '2026-12-01'})
+        latencies.append(time.perf_counter() - start)
+        if resp.status_code != 200:
+            failed += 1
+            continue
+        task_id = resp.get_json()['id']
+
+        start = time.perf_counter()
+        resp = client.post(f'/api/tasks/{task_id}/chat', data={'content': f'Nachricht {i}'})
+        latencies.append(time.perf_counter() - start)
+        if resp.status_code != 200:
+            failed += 1
+    results.put((latencies, failed))
+
+
+def run(profile, args):
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ['UPLOAD_FOLDER'] = os.path.join(tmp, 'uploads')
+        os.environ['SCHEDULER_ENABLED'] = 'false'
+        for key in ('SQLITE_JOURNAL_MODE', 'SQLITE_SYNCHRONOUS', 'SQLITE_BUSY_TIMEOUT'):
+            os.environ.pop(key, None)
+        os.environ.update(PROFILES[profile])
+        class_code = setup(args.users)
+
+        ctx = multiprocessing.get_context('spawn')
+        barrier = ctx.Barrier(args.workers + 1)
+        results = ctx.Queue()
+        procs = [ctx.Process(target=worker, args=(i, class_code, args.requests, barrier, results)) for i in range(args.workers)]
+        for p in procs:
+            p.start()
+        barrier.wait()
+        start = time.perf_counter()
+        collected = [results.get(timeout=3600) for _ in procs]
+        elapsed = time.perf_counter() - start
+        for p in procs:
+            p.join()
+
+    latencies = sorted(l for lat, _ in collected for l in lat)
+    failed = sum(f for _, f in collected)
+    pct = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    print(f"{profile:<9} {len(latencies) / elapsed:>8.1f} req/s  p50 {pct(0.5):>7.1f} ms  "
+          f"p95 {pct(0.95):>7.1f} ms  max {latencies[-1] * 1000:>8.1f} ms  failed {failed}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=100, help='Task + chat rounds per worker')
+    parser.add_argument('--users', type=int, default=30, help='Class members (notification fan-out)')
+    parser.add_argument('--dir', default=None, help='Directory for the database (default: system temp)')
+    args = parser.parse_args()
+    args.users = max(args.users, args.workers)
+
+    print(f"{args.workers} workers x {args.requests} rounds (task + chat), {args.users} users in the class")
+    for profile in PROFILES:
+        run(profile, args)
+
+
+if __name__ == '__main__':
+    main()
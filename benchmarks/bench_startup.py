@@ -0,0 +1,96 @@
+"""
+Benchmark: cold worker boot
+Starts --runs fresh interpreters (like gunicorn spawning workers) against one
+database and reports the time to import the app (including the modules
+create_app() imports) and to run create_app(). The first boot creates the
+schema; the following ones take the fast path (the database is at the
+current revision, see app/schema.py).
+
+--rows fills the database first, so that schema work that scales with the
+database shows up. Run it on an older checkout to compare.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 10] [--rows 20000]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BOOT = """
+import json, time
+start = time.perf_counter()
+from app import create_app
+# Modules create_app imports, so that create_app below is the setup work only
+import app.routes, app.drive_routes, app.notifications, app.drive_oauth_client, app.untis_service
+imported = time.perf_counter()
+app = create_app()
+done = time.perf_counter()
+print(json.dumps({'import': imported - start, 'create_app': done - imported}))
+"""
+
+FILL = """
+from datetime import datetime
+from app import create_app
+from app.models import db, SchoolClass, User, Task
+app = create_app()
+with app.app_context():
+    school_class = SchoolClass(name='Bench')
+    db.session.add(school_class)
+    db.session.flush()
+    user = User(username='bench', password_hash='x', class_id=school_class.id)
+    db.session.add(user)
+    db.session.flush()
+    db.session.execute(db.insert(Task), [
+        {'user_id': user.id, 'class_id': school_class.id, 'title': f'Aufgabe {i}', 'due_date': datetime(2026, 1, 1)}
+        for i in range(%d)
+    ])
+    db.session.commit()
+"""
+
+
+def boot(env, code=BOOT):
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    wall = time.perf_counter() - start
+    if code is not BOOT:
+        return wall
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result['process'] = wall
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--rows', type=int, default=20000, help='Tasks in the database before the boots')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ,
+                   DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                   UPLOAD_FOLDER=os.path.join(tmp, 'uploads'),
+                   SCHEDULER_ENABLED='false',
+                   PYTHONPATH=ROOT)
+
+        first = boot(env)
+        if args.rows:
+            boot(env, FILL % args.rows)
+        runs = [boot(env) for _ in range(args.runs)]
+
+    print(f"first boot (new database): import {first['import'] * 1000:.0f} ms, "
+          f"create_app {first['create_app'] * 1000:.0f} ms, process {first['process'] * 1000:.0f} ms")
+    print(f"{args.runs} cold boots, {args.rows} tasks in the database (median / max):")
+    for key in ('import', 'create_app', 'process'):
+        values = [r[key] * 1000 for r in runs]
+        print(f"  {key:<11} {statistics.median(values):>8.0f} ms {max(values):>8.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
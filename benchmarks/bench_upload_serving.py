@@ -0,0 +1,86 @@
+"""
+Benchmark: worker time per upload request, Flask vs. reverse proxy
+Stores --files images of --size KB, logs in and fetches them through
+/uploads/<filename> with UPLOAD_SERVE_MODE=flask and =x-accel. In flask mode
+the worker reads and sends every byte; with x-accel it only checks the login
+and returns a header, nginx sends the file.
+
+--client-mbit models a slow client: a sync gunicorn worker is blocked until
+the response has been written, so occupancy ~ CPU time + size / bandwidth
+(only for flask mode; with x-accel nginx buffers the slow client).
+
+Usage:
+    python benchmarks/bench_upload_serving.py [--files 200] [--size 400] [--client-mbit 10]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run(mode, filenames, rounds):
+    os.environ['UPLOAD_SERVE_MODE'] = mode
+    from app import create_app
+    from app.models import db, User
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATELIMIT_ENABLED'] = False
+    with app.app_context():
+        if not User.query.filter_by(username='bench').first():
+            user = User(username='bench', role='super_admin', has_accepted_privacy=True)
+            user.set_password('bench-password')
+            db.session.add(user)
+            db.session.commit()
+
+    client = app.test_client()
+    resp = client.post('/login', json={'username': 'bench', 'password': 'bench-password'})
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+
+    sent = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for name in filenames:
+            resp = client.get(f'/uploads/{name}')
+            assert resp.status_code == 200, resp.status_code
+            sent += len(resp.get_data())  # Consume the body like a WSGI server would
+    elapsed = time.perf_counter() - start
+    return elapsed / (rounds * len(filenames)), sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--size', type=int, default=400, help='File size in KB')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--client-mbit', type=float, default=0, help='Model a client with this bandwidth (0 = off)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ['UPLOAD_FOLDER'] = os.path.join(tmp, 'uploads')
+        os.environ['SCHEDULER_ENABLED'] = 'false'
+        os.makedirs(os.environ['UPLOAD_FOLDER'])
+
+        filenames = []
+        for i in range(args.files):
+            name = f'bench_{i}.jpg'
+            with open(os.path.join(os.environ['UPLOAD_FOLDER'], name), 'wb') as f:
+                f.write(os.urandom(args.size * 1024))
+            filenames.append(name)
+
+        print(f"{args.files} files x {args.size} KB, {args.rounds} rounds")
+        for mode in ('flask', 'x-accel'):
+            per_request, sent = run(mode, filenames, args.rounds)
+            line = f"{mode:<8} {per_request * 1000:>8.3f} ms/request  {sent / 1024 / 1024:>9.1f} MB through the worker"
+            if args.client_mbit:
+                transfer = sent / (args.rounds * args.files) * 8 / (args.client_mbit * 1_000_000) if mode == 'flask' else 0
+                line += f"  occupancy at {args.client_mbit:g} Mbit/s: {(per_request + transfer) * 1000:>8.1f} ms"
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,8 @@
+import os
 import sys
+
+os.environ.setdefault('IMAGE_POOL_PREFORK', 'false')  # No image pool for a one-off script
+
 from app import create_app, db
 from app.models import User, UserRole
 
@@ -0,0 +1,32 @@
+"""
+Move old flat uploads (chat_<uid>_<ts>_<name>, mealplan_<ts>.jpg, ...) into the
+content-addressed upload store (ab/cd/<sha256>.<ext>) and update the rows
+referring to them. Duplicate files are stored once. Safe to run repeatedly.
+
+Usage:
+    python migrate_uploads.py
+"""
+import os
+import sys
+
+os.environ.setdefault('IMAGE_POOL_PREFORK', 'false')  # No image pool for a one-off script
+
+from app import create_app, db
+from app.upload_store import migrate_legacy_uploads
+
+
+def main():
+    app = create_app()
+    with app.app_context():
+        try:
+            updated = migrate_legacy_uploads()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error: Migration failed: {e}")
+            return 1
+    print(f"Successfully migrated {updated} upload reference(s).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
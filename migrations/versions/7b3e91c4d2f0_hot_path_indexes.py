@@ -0,0 +1,88 @@
+"""Hot-path indexes, unique task completion / chat read per user
+
+Revision ID: 7b3e91c4d2f0
+Revises: e4286b21a303
+Create Date: 2026-10-19 10:12:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b3e91c4d2f0'
+down_revision = 'e4286b21a303'
+branch_labels = None
+depends_on = None
+
+
+# (name, table, columns, partial WHERE clause)
+INDEXES = [
+    ('ix_task_class_live_due', 'task', ['class_id', 'deleted_at', 'due_date'], None),
+    ('ix_task_subject_live', 'task', ['subject_id', 'deleted_at'], None),
+    ('ix_task_live_due', 'task', ['due_date'], 'deleted_at IS NULL'),
+    ('ix_event_class_live_date', 'event', ['class_id', 'deleted_at', 'date'], None),
+    ('ix_event_subject_live', 'event', ['subject_id', 'deleted_at'], None),
+    ('ix_event_live_date', 'event', ['date'], 'deleted_at IS NULL'),
+    ('ix_task_message_task_created', 'task_message', ['task_id', 'created_at'], None),
+    ('ix_audit_log_class_timestamp', 'audit_log', ['class_id', 'timestamp'], None),
+    ('ix_push_subscription_user_id', 'push_subscription', ['user_id'], None),
+    ('ix_card_review_user_next_review', 'card_review', ['user_id', 'next_review_at'], None),
+    ('ix_drive_folder_folder_id', 'drive_folder', ['folder_id'], None),
+]
+
+UNIQUE_CONSTRAINTS = [
+    ('_user_task_completion_uc', 'task_completion', ['user_id', 'task_id']),
+    ('_user_task_chat_read_uc', 'task_chat_read', ['user_id', 'task_id']),
+]
+
+
+def _existing(inspector, table):
+    names = {i['name'] for i in inspector.get_indexes(table)}
+    names.update(c['name'] for c in inspector.get_unique_constraints(table))
+    return names
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+
+    # Keep one row per (user, task) before the unique constraints:
+    # the latest completion and the latest read time
+    if 'task_chat_read' in tables:
+        op.execute("""
+            UPDATE task_chat_read SET last_read_at = (
+                SELECT MAX(r.last_read_at) FROM task_chat_read r
+                WHERE r.user_id = task_chat_read.user_id AND r.task_id = task_chat_read.task_id
+            )
+        """)
+    for _, table, columns in UNIQUE_CONSTRAINTS:
+        if table in tables:
+            op.execute(f"""
+                DELETE FROM {table} WHERE id NOT IN (
+                    SELECT MAX(id) FROM {table} GROUP BY {', '.join(columns)}
+                )
+            """)
+
+    for name, table, columns in UNIQUE_CONSTRAINTS:
+        if table in tables and name not in _existing(inspector, table):
+            with op.batch_alter_table(table, schema=None) as batch_op:
+                batch_op.create_unique_constraint(name, columns)
+
+    # Databases created by db.create_all() already have the indexes
+    for name, table, columns, where in INDEXES:
+        if table in tables and name not in _existing(inspector, table):
+            op.create_index(name, table, columns, sqlite_where=sa.text(where) if where else None)
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    for name, table, _, _ in INDEXES:
+        # ix_card_review_user_next_review predates this revision (created at startup)
+        if name != 'ix_card_review_user_next_review' and name in _existing(inspector, table):
+            op.drop_index(name, table_name=table)
+
+    for name, table, _ in UNIQUE_CONSTRAINTS:
+        if name in _existing(inspector, table):
+            with op.batch_alter_table(table, schema=None) as batch_op:
+                batch_op.drop_constraint(name, type_='unique')
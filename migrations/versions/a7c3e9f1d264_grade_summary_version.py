@@ -0,0 +1,48 @@
+"""Grade summary version (stale summaries are not stored over an invalidation)
+
+Revision ID: a7c3e9f1d264
+Revises: f2b6c8d4a913
+Create Date: 2026-10-19 18:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e9f1d264'
+down_revision = 'f2b6c8d4a913'
+branch_labels = None
+depends_on = None
+
+
+def _create(data_nullable, with_version):
+    columns = [
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('data', sa.Text(), nullable=data_nullable),
+        sa.Column('computed_at', sa.DateTime(), nullable=True),
+    ]
+    if with_version:
+        columns.append(sa.Column('version', sa.Integer(), nullable=False, server_default='0'))
+    op.create_table('grade_summary', *columns,
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id')
+    )
+
+
+def upgrade():
+    # A cache (rebuilt on demand): recreated instead of altered, SQLite cannot drop NOT NULL in place
+    inspector = sa.inspect(op.get_bind())
+    if 'grade_summary' in inspector.get_table_names():
+        if 'version' in {c['name'] for c in inspector.get_columns('grade_summary')}:
+            return
+        op.drop_table('grade_summary')
+    _create(data_nullable=True, with_version=True)
+
+
+def downgrade():
+    if 'grade_summary' in sa.inspect(op.get_bind()).get_table_names():
+        op.drop_table('grade_summary')
+    _create(data_nullable=False, with_version=False)
@@ -0,0 +1,77 @@
+"""Columns previously added by create_app at every startup
+
+Revision ID: c41f6d2b8e05
+Revises: 7b3e91c4d2f0
+Create Date: 2026-10-19 14:02:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41f6d2b8e05'
+down_revision = '7b3e91c4d2f0'
+branch_labels = None
+depends_on = None
+
+
+# table -> [(column, DDL)]; databases that already went through the old startup code have them
+COLUMNS = {
+    'school_class': [
+        ('chat_enabled', 'BOOLEAN DEFAULT 0'),
+    ],
+    'user': [
+        ('role', "VARCHAR(20) DEFAULT 'student'"),
+        ('class_id', 'INTEGER REFERENCES school_class(id)'),
+        ('dark_mode', 'BOOLEAN DEFAULT 0'),
+        ('language', "VARCHAR(5) DEFAULT 'de'"),
+        ('needs_password_change', 'BOOLEAN DEFAULT 1'),
+        ('has_seen_tutorial', 'BOOLEAN DEFAULT 0'),
+        ('has_accepted_privacy', 'BOOLEAN DEFAULT 0'),
+        ('theme', "VARCHAR(32) DEFAULT 'standard'"),
+    ],
+    'task_message': [
+        ('parent_id', 'INTEGER REFERENCES task_message(id)'),
+    ],
+    'notification_setting': [
+        ('notify_chat_message', 'BOOLEAN DEFAULT 1'),
+    ],
+    'drive_folder': [
+        ('class_id', 'INTEGER REFERENCES school_class(id)'),
+        ('folder_id', 'VARCHAR(256)'),
+        ('file_count', 'INTEGER DEFAULT 0'),
+        ('is_active', 'BOOLEAN DEFAULT 1'),
+        ('include_subfolders', 'BOOLEAN DEFAULT 1'),
+        ('created_by_user_id', 'INTEGER REFERENCES user(id)'),
+    ],
+    # Image processing queue (image_queue)
+    'task_image': [('status', "VARCHAR(16) DEFAULT 'ready'")],
+    'meal_plan': [('status', "VARCHAR(16) DEFAULT 'ready'")],
+    'timetable_image': [('status', "VARCHAR(16) DEFAULT 'ready'")],
+}
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+    for table, columns in COLUMNS.items():
+        if table not in tables:
+            continue
+        existing = {c['name'] for c in inspector.get_columns(table)}
+        for column, ddl in columns:
+            if column in existing:
+                continue
+            op.execute(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}')
+            if (table, column) == ('user', 'role'):
+                # Roles replaced the is_super_admin / is_admin flags
+                if 'is_super_admin' in existing:
+                    op.execute("UPDATE user SET role='super_admin' WHERE is_super_admin=1")
+                if 'is_admin' in existing:
+                    not_super = " AND (is_super_admin=0 OR is_super_admin IS NULL)" if 'is_super_admin' in existing else ""
+                    op.execute(f"UPDATE user SET role='admin' WHERE is_admin=1{not_super}")
+
+
+def downgrade():
+    # The columns are part of the models since long before this revision
+    pass
@@ -0,0 +1,99 @@
+"""Backup journal, content-addressed uploads and chunked uploads
+
+Revision ID: d9a7b3e5c218
+Revises: c41f6d2b8e05
+Create Date: 2026-10-19 14:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9a7b3e5c218'
+down_revision = 'c41f6d2b8e05'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ('change_log', 'backup_record', 'upload_blob', 'chunked_upload', 'chunked_upload_part')
+
+
+def upgrade():
+    # Until this revision the tables were created by db.create_all() at startup
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'change_log' not in tables:
+        op.create_table('change_log',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('table_name', sa.String(length=64), nullable=False),
+            sa.Column('row_pk', sa.Integer(), nullable=True),
+            sa.Column('changed_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sqlite_autoincrement=True
+        )
+
+    if 'backup_record' not in tables:
+        op.create_table('backup_record',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('backup_id', sa.String(length=36), nullable=False),
+            sa.Column('kind', sa.String(length=16), nullable=False),
+            sa.Column('parent_id', sa.String(length=36), nullable=True),
+            sa.Column('revision', sa.Integer(), nullable=True),
+            sa.Column('manifest', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('backup_id')
+        )
+
+    if 'upload_blob' not in tables:
+        op.create_table('upload_blob',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('key', sa.String(length=128), nullable=False),
+            sa.Column('digest', sa.String(length=64), nullable=False),
+            sa.Column('size', sa.Integer(), nullable=True),
+            sa.Column('ref_count', sa.Integer(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('key')
+        )
+        op.create_index('ix_upload_blob_digest', 'upload_blob', ['digest'])
+
+    if 'chunked_upload' not in tables:
+        op.create_table('chunked_upload',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('upload_id', sa.String(length=32), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('purpose', sa.String(length=16), nullable=False),
+            sa.Column('target_id', sa.Integer(), nullable=True),
+            sa.Column('filename', sa.String(length=256), nullable=False),
+            sa.Column('total_size', sa.BigInteger(), nullable=False),
+            sa.Column('chunk_size', sa.Integer(), nullable=False),
+            sa.Column('sha256', sa.String(length=64), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('upload_id')
+        )
+        op.create_index('ix_chunked_upload_user_id', 'chunked_upload', ['user_id'])
+
+    if 'chunked_upload_part' not in tables:
+        op.create_table('chunked_upload_part',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('upload_id', sa.Integer(), nullable=False),
+            sa.Column('index', sa.Integer(), nullable=False),
+            sa.Column('size', sa.Integer(), nullable=False),
+            sa.Column('sha256', sa.String(length=64), nullable=False),
+            sa.ForeignKeyConstraint(['upload_id'], ['chunked_upload.id'], ),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('upload_id', 'index', name='_chunked_upload_part_uc')
+        )
+
+
+def downgrade():
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+    for table in reversed(TABLES):
+        if table in tables:
+            op.drop_table(table)
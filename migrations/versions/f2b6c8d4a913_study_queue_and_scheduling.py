@@ -0,0 +1,103 @@
+"""Study queue, review scheduling, deck card counts and grade summaries
+
+Revision ID: f2b6c8d4a913
+Revises: d9a7b3e5c218
+Create Date: 2026-10-19 14:08:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b6c8d4a913'
+down_revision = 'd9a7b3e5c218'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ('review_batch', 'review_log', 'scheduler_settings', 'grade_summary')
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+
+    if 'card_review' in tables:
+        cols = {c['name'] for c in inspector.get_columns('card_review')}
+        if 'created_at' not in cols:
+            # First review of the card (daily new-card limit)
+            op.execute("ALTER TABLE card_review ADD COLUMN created_at DATETIME")
+        for col in ('stability', 'difficulty'):  # FSRS memory state
+            if col not in cols:
+                op.execute(f"ALTER TABLE card_review ADD COLUMN {col} FLOAT")
+
+    if 'flashcard' in tables:
+        if 'ix_flashcard_deck_id' not in {i['name'] for i in inspector.get_indexes('flashcard')}:
+            op.create_index('ix_flashcard_deck_id', 'flashcard', ['deck_id'])
+
+    if 'deck' in tables and 'card_count' not in {c['name'] for c in inspector.get_columns('deck')}:
+        op.execute("ALTER TABLE deck ADD COLUMN card_count INTEGER NOT NULL DEFAULT 0")
+        op.execute("UPDATE deck SET card_count = (SELECT COUNT(*) FROM flashcard WHERE flashcard.deck_id = deck.id)")
+
+    if 'review_batch' not in tables:
+        op.create_table('review_batch',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('idempotency_key', sa.String(length=64), nullable=False),
+            sa.Column('response', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('user_id', 'idempotency_key', name='_user_review_batch_uc')
+        )
+
+    if 'review_log' not in tables:
+        op.create_table('review_log',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('card_id', sa.Integer(), nullable=False),
+            sa.Column('rating', sa.Integer(), nullable=False),
+            sa.Column('reviewed_at', sa.DateTime(), nullable=False),
+            sa.Column('elapsed_days', sa.Float(), nullable=True),
+            sa.Column('last_interval', sa.Float(), nullable=True),
+            sa.Column('scheduler', sa.String(length=8), nullable=True),
+            sa.ForeignKeyConstraint(['card_id'], ['flashcard.id'], ),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_review_log_user_card_time', 'review_log', ['user_id', 'card_id', 'reviewed_at'])
+
+    if 'scheduler_settings' not in tables:
+        op.create_table('scheduler_settings',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('scheduler', sa.String(length=8), nullable=True),
+            sa.Column('desired_retention', sa.Float(), nullable=True),
+            sa.Column('weights', sa.Text(), nullable=True),
+            sa.Column('optimized_at', sa.DateTime(), nullable=True),
+            sa.Column('optimized_reviews', sa.Integer(), nullable=True),
+            sa.Column('log_loss', sa.Float(), nullable=True),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('user_id')
+        )
+
+    if 'grade_summary' not in tables:
+        op.create_table('grade_summary',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('data', sa.Text(), nullable=False),
+            sa.Column('computed_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('user_id')
+        )
+
+
+def downgrade():
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+    for table in reversed(TABLES):
+        if table in tables:
+            op.drop_table(table)
+    # The added columns stay: SQLite can only drop them by rebuilding the tables
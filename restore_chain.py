@@ -0,0 +1,39 @@
+"""
+Restore a backup chain: a full backup followed by its incremental backups
+(oldest first) or by one differential backup.
+
+WARNING: replaces the whole database and the upload folder contents.
+Scheduled backups written with BACKUP_COMPRESSION=zstd (.zip.zst) are read as well.
+
+Usage:
+    python restore_chain.py <full.zip> [<incremental.zip> ...]
+    python restore_chain.py <full.zip> <differential.zip>
+"""
+import os
+import sys
+
+os.environ.setdefault('IMAGE_POOL_PREFORK', 'false')  # No image pool for a one-off script
+
+from app import create_app, db
+from app.backup import restore_chain
+
+
+def main(paths):
+    app = create_app()
+    with app.app_context():
+        try:
+            restore_chain(paths, app.config['UPLOAD_FOLDER'])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error: Restore failed: {e}")
+            return 1
+    print(f"Successfully restored {len(paths)} backup(s).")
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    sys.exit(main(sys.argv[1:]))
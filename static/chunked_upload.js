@@ -0,0 +1,84 @@
+// ============================================
+// CHUNKED UPLOADS - L8teStudy
+// Resumable uploads for large files (see app/chunked_upload.py)
+// ============================================
+
+const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024; // Smaller files use the normal form upload
+const CHUNK_RETRIES = 5;
+
+function chunkedUploadKey(file, purpose, extra) {
+    return `chunked_upload:${purpose}:${extra.task_id || ''}:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+async function sha256Hex(buffer) {
+    const hash = await crypto.subtle.digest('SHA-256', buffer);
+    return Array.from(new Uint8Array(hash)).map(b => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function startOrResumeUpload(file, purpose, extra) {
+    const key = chunkedUploadKey(file, purpose, extra);
+    const savedId = localStorage.getItem(key);
+    if (savedId) {
+        const res = await fetch(`/api/uploads/${savedId}`);
+        if (res.ok) return await res.json();
+        localStorage.removeItem(key);
+    }
+
+    const res = await fetch('/api/uploads', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ purpose, filename: file.name, size: file.size, ...extra })
+    });
+    const data = await res.json();
+    if (!res.ok || !data.success) throw new Error(data.message || data.error || 'Upload failed');
+    localStorage.setItem(key, data.upload_id);
+    return data;
+}
+
+async function putChunk(uploadId, index, blob) {
+    const buffer = await blob.arrayBuffer();
+    const checksum = await sha256Hex(buffer);
+    for (let attempt = 0; ; attempt++) {
+        try {
+            const res = await fetch(`/api/uploads/${uploadId}/chunks/${index}`, {
+                method: 'PUT',
+                headers: { 'Content-Type': 'application/octet-stream', 'X-Chunk-SHA256': checksum },
+                body: buffer
+            });
+            if (res.ok) return;
+            // Client errors (quota, size) will not get better by retrying
+            if (res.status < 500 && res.status !== 422) {
+                const data = await res.json().catch(() => ({}));
+                throw Object.assign(new Error(data.message || 'Upload failed'), { fatal: true });
+            }
+        } catch (e) {
+            if (e.fatal || attempt >= CHUNK_RETRIES) throw e;
+        }
+        await new Promise(r => setTimeout(r, Math.min(30000, 1000 * 2 ** attempt)));
+    }
+}
+
+/**
+ * Upload a file in chunks and hand it to the server-side handler.
+ * purpose: 'chat' (extra: { task_id }) or 'deck_import'.
+ * Resumes an interrupted upload of the same file. Resolves with the handler's JSON response.
+ */
+async function chunkedUpload(file, purpose, extra = {}, onProgress = null) {
+    const status = await startOrResumeUpload(file, purpose, extra);
+    const missing = status.missing;
+    const total = status.chunk_count;
+    let done = total - missing.length;
+
+    for (const index of missing) {
+        const start = index * status.chunk_size;
+        await putChunk(status.upload_id, index, file.slice(start, start + status.chunk_size));
+        done++;
+        if (onProgress) onProgress(done / total);
+    }
+
+    const res = await fetch(`/api/uploads/${status.upload_id}/complete`, { method: 'POST' });
+    const data = await res.json();
+    if (res.status !== 409) localStorage.removeItem(chunkedUploadKey(file, purpose, extra));
+    if (!res.ok) throw new Error(data.message || data.error || 'Upload failed');
+    return data;
+}
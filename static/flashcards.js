@@ -8,6 +8,14 @@ let currentCardIndex = 0;
 let isCardFlipped = false;
 let studyMode = 'spaced'; // 'spaced' or 'free'
 let dueCards = [];
+let studyAvailable = 0; // Due + new cards a study session serves today (server-side queue)
+let studyPosition = 0; // Cards rated in the current study session
+let studyTotal = 0;
+const STUDY_BATCH = 20;
+const PENDING_REVIEWS_KEY = 'flashcards_pending_reviews'; // Ratings not yet sent
+const REVIEW_BATCH_KEY = 'flashcards_review_batch'; // Batch being sent, kept with its idempotency key for retries
+const MAX_REVIEW_BATCH = 1000;
+let reviewFlush = null;
 
 // ============================================
 // DECK LIST VIEW
@@ -57,14 +65,21 @@ async function renderFlashcardsView() {
 
         const myDecks = data.my_decks || [];
         const publicDecks = data.public_decks || [];
+        publicDeckPage = 1;
+        publicDeckSearch = '';
 
         let html = `
             <div style="margin-bottom: 30px; animation: fadeIn 0.3s ease;">
                 <div style="display:flex; justify-content:space-between; align-items:center; margin-bottom:15px;">
                     <h2 style="margin:0; font-size:24px; font-weight:700;">${(typeof t === 'function' ? t('my_decks') : 'Meine Decks')}</h2>
-                    <button class="ios-btn btn-small btn-sec" onclick="openImportDeckSheet()" style="width:auto; padding: 6px 12px; height: 32px; display: inline-flex; align-items: center;">
-                        <i data-lucide="upload" style="width:16px; height:16px; margin-right:6px;"></i> Import
-                    </button>
+                    <div style="display:flex; gap:8px;">
+                        <button class="ios-btn btn-small btn-sec" onclick="openSchedulerSheet()" style="width:auto; padding: 6px 12px; height: 32px; display: inline-flex; align-items: center;">
+                            <i data-lucide="sliders-horizontal" style="width:16px; height:16px; margin-right:6px;"></i> Lernplan
+                        </button>
+                        <button class="ios-btn btn-small btn-sec" onclick="openImportDeckSheet()" style="width:auto; padding: 6px 12px; height: 32px; display: inline-flex; align-items: center;">
+                            <i data-lucide="upload" style="width:16px; height:16px; margin-right:6px;"></i> Import
+                        </button>
+                    </div>
                 </div>
                 
                 ${myDecks.length === 0 ? `
@@ -90,7 +105,7 @@ async function renderFlashcardsView() {
                                     </div>
                                     <div style="display:flex; gap:6px; align-items:center;">
                                         ${deck.is_public ? '<div class="deck-badge public">Öffentlich</div>' : ''}
-                                        ${deck.new_count > 0 ? `<div class="deck-badge">${deck.new_count}</div>` : ''}
+                                        ${deck.due_count > 0 ? `<div class="deck-badge">${deck.due_count}</div>` : ''}
                                     </div>
                                 </div>
                             </div>
@@ -103,26 +118,18 @@ async function renderFlashcardsView() {
                 `}
             </div>
 
-            ${publicDecks.length > 0 ? `
+            ${publicDecks.length > 0 || publicDeckSearch ? `
                 <div style="margin-bottom: 30px; animation: fadeIn 0.4s ease;">
-                    <h2 style="margin:0 0 15px 0; font-size:24px; font-weight:700;">${(typeof t === 'function' ? t('public_decks') : 'Öffentliche Decks')}</h2>
-                    <div class="deck-grid">
-                        ${publicDecks.map(deck => `
-                            <div class="deck-card" onclick="openDeck(${deck.id})">
-                                <div class="deck-top">
-                                    <div class="deck-title" title="${escapeHtml(deck.title)}">${escapeHtml(deck.title)}</div>
-                                    <div class="deck-author" style="font-size:12px; color:var(--text-sec); margin-top:-4px;">von ${escapeHtml(deck.author_name)}</div>
-                                </div>
-                                <div class="deck-stats">
-                                    <div class="deck-count">
-                                        <i data-lucide="layers" style="width:14px; height:14px;"></i>
-                                        ${deck.card_count} Karten
-                                    </div>
-                                    <div class="deck-badge public">Öffentlich</div>
-                                </div>
-                            </div>
-                        `).join('')}
+                    <div style="display:flex; justify-content:space-between; align-items:center; gap:12px; margin-bottom:15px;">
+                        <h2 style="margin:0; font-size:24px; font-weight:700;">${(typeof t === 'function' ? t('public_decks') : 'Öffentliche Decks')}</h2>
+                        <input type="search" class="ios-input" id="public-deck-search" placeholder="Suchen..." value="${escapeHtml(publicDeckSearch)}"
+                            oninput="searchPublicDecks(this.value)" style="max-width:220px; margin:0; height:36px;">
                     </div>
+                    <div class="deck-grid" id="public-deck-grid">
+                        ${publicDecks.map(renderPublicDeckCard).join('')}
+                    </div>
+                    <button class="ios-btn btn-sec btn-small" id="public-deck-more" onclick="loadPublicDecks(false)"
+                        style="margin-top:15px; ${data.has_more ? '' : 'display:none;'}">Mehr laden</button>
                 </div>
             ` : ''}
         `;
@@ -136,6 +143,66 @@ async function renderFlashcardsView() {
     }
 }
 
+// Public catalogue: paginated and searchable on the server
+let publicDeckPage = 1;
+let publicDeckSearch = '';
+let publicDeckSearchTimer = null;
+
+function renderPublicDeckCard(deck) {
+    return `
+        <div class="deck-card" onclick="openDeck(${deck.id})">
+            <div class="deck-top">
+                <div class="deck-title" title="${escapeHtml(deck.title)}">${escapeHtml(deck.title)}</div>
+                <div class="deck-author" style="font-size:12px; color:var(--text-sec); margin-top:-4px;">von ${escapeHtml(deck.author_name)}</div>
+            </div>
+            <div class="deck-stats">
+                <div class="deck-count">
+                    <i data-lucide="layers" style="width:14px; height:14px;"></i>
+                    ${deck.card_count} Karten
+                </div>
+                <div style="display:flex; gap:6px; align-items:center;">
+                    ${deck.due_count > 0 ? `<div class="deck-badge">${deck.due_count}</div>` : ''}
+                    <div class="deck-badge public">Öffentlich</div>
+                </div>
+            </div>
+        </div>
+    `;
+}
+
+async function loadPublicDecks(reset) {
+    const grid = document.getElementById('public-deck-grid');
+    const more = document.getElementById('public-deck-more');
+    if (!grid) return;
+    const page = reset ? 1 : publicDeckPage + 1;
+    const search = publicDeckSearch;
+
+    try {
+        const response = await fetch(`/api/decks?scope=public&page=${page}&q=${encodeURIComponent(search)}`);
+        const data = await response.json();
+        if (search !== publicDeckSearch) return; // A newer search is running
+
+        publicDeckPage = page;
+        const cards = data.public_decks.map(renderPublicDeckCard).join('');
+        if (reset) {
+            grid.innerHTML = cards || '<p style="color:var(--text-sec);">Keine Decks gefunden</p>';
+        } else {
+            grid.insertAdjacentHTML('beforeend', cards);
+        }
+        if (more) more.style.display = data.has_more ? '' : 'none';
+        lucide.createIcons();
+    } catch (error) {
+        console.error('Error loading public decks:', error);
+    }
+}
+
+function searchPublicDecks(value) {
+    clearTimeout(publicDeckSearchTimer);
+    publicDeckSearchTimer = setTimeout(() => {
+        publicDeckSearch = value.trim();
+        loadPublicDecks(true);
+    }, 300);
+}
+
 // ============================================
 // DECK DETAIL VIEW
 // ============================================
@@ -153,6 +220,7 @@ async function openDeck(deckId, pushState = true) {
         currentDeck = deck;
         currentCards = deck.cards || [];
         dueCards = currentCards.filter(c => c.is_due);
+        studyAvailable = deck.study ? deck.study.due + deck.study.new : dueCards.length;
 
         // Update view state
         if (typeof previousView !== 'undefined' && typeof currentView !== 'undefined') {
@@ -203,9 +271,9 @@ async function openDeck(deckId, pushState = true) {
         <div style="display:flex; gap:12px; margin-bottom:24px;">
             <button class="ios-btn" onclick="startStudyMode('spaced')"
                 style="flex:1; background:var(--accent); color:white; font-size:16px; padding:16px;"
-                ${dueCards.length === 0 ? 'disabled style="opacity:0.5; cursor:not-allowed;"' : ''}>
+                ${studyAvailable === 0 ? 'disabled style="opacity:0.5; cursor:not-allowed;"' : ''}>
                 <i data-lucide="brain" style="width:20px; height:20px; margin-right:8px;"></i>
-                Lernen (${dueCards.length})
+                Lernen (${studyAvailable})
             </button>
             <button class="ios-btn btn-sec" onclick="startStudyMode('free')"
                 style="flex:1; font-size:16px; padding:16px;"
@@ -265,11 +333,98 @@ let originalHeaderProfileOnClick = null;
 let originalSideAccountContent = '';
 let originalSideAccountOnClick = null;
 
-function startStudyMode(mode) {
+// ============================================
+// OFFLINE REVIEW QUEUE
+// Ratings are stored locally and sent in batches (POST /api/cards/reviews/batch),
+// so studying keeps working without a connection and costs one request per batch.
+// ============================================
+
+function readReviewStore(key, fallback) {
+    try {
+        return JSON.parse(localStorage.getItem(key)) || fallback;
+    } catch (e) {
+        return fallback;
+    }
+}
+
+function queueReview(cardId, quality) {
+    const pending = readReviewStore(PENDING_REVIEWS_KEY, []);
+    pending.push({ card_id: cardId, quality, reviewed_at: new Date().toISOString() });
+    localStorage.setItem(PENDING_REVIEWS_KEY, JSON.stringify(pending));
+}
+
+function pendingReviewCardIds() {
+    const batch = readReviewStore(REVIEW_BATCH_KEY, null);
+    const reviews = [...(batch ? batch.reviews : []), ...readReviewStore(PENDING_REVIEWS_KEY, [])];
+    return [...new Set(reviews.map(r => r.card_id))];
+}
+
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return `${Date.now().toString(16)}-${Math.random().toString(16).slice(2)}`;
+}
+
+async function sendReviewBatches() {
+    while (true) {
+        let batch = readReviewStore(REVIEW_BATCH_KEY, null);
+        if (!batch) {
+            const pending = readReviewStore(PENDING_REVIEWS_KEY, []);
+            if (pending.length === 0) return true;
+            batch = { key: newIdempotencyKey(), reviews: pending.slice(0, MAX_REVIEW_BATCH) };
+            localStorage.setItem(REVIEW_BATCH_KEY, JSON.stringify(batch));
+            localStorage.setItem(PENDING_REVIEWS_KEY, JSON.stringify(pending.slice(MAX_REVIEW_BATCH)));
+        }
+
+        let response;
+        try {
+            response = await fetch('/api/cards/reviews/batch', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ idempotency_key: batch.key, reviews: batch.reviews })
+            });
+        } catch (error) {
+            return false; // Offline: retried with the same key later
+        }
+        if (response.status >= 500 || response.status === 401 || response.status === 429) return false;
+        if (!response.ok) console.error('Review batch rejected:', response.status);
+        localStorage.removeItem(REVIEW_BATCH_KEY);
+    }
+}
+
+// Send queued ratings; resolves to false if some are still waiting for a connection
+function flushReviews() {
+    if (!reviewFlush) {
+        reviewFlush = sendReviewBatches().finally(() => { reviewFlush = null; });
+    }
+    return reviewFlush;
+}
+
+window.addEventListener('online', () => flushReviews());
+if (navigator.onLine) flushReviews();
+
+// Next batch of the server-side study queue (due cards first, new cards capped per day)
+async function fetchStudyCards() {
+    try {
+        // Cards rated but not yet synced would otherwise come back as due
+        const exclude = pendingReviewCardIds().slice(-100).join(',');
+        const response = await fetch(`/api/decks/${currentDeck.id}/study/next?limit=${STUDY_BATCH}&exclude=${exclude}`);
+        if (!response.ok) return null;
+        return await response.json();
+    } catch (error) {
+        console.error('Error loading study cards:', error);
+        return null;
+    }
+}
+
+async function startStudyMode(mode) {
     studyMode = mode;
 
     if (mode === 'spaced') {
-        currentCards = dueCards;
+        await flushReviews();
+        const batch = await fetchStudyCards();
+        currentCards = batch ? batch.cards : [];
+        studyPosition = 0;
+        studyTotal = batch ? batch.counts.due + batch.counts.new : 0;
     } else {
         // Shuffle for free practice
         currentCards = [...currentDeck.cards].sort(() => Math.random() - 0.5);
@@ -358,14 +513,17 @@ function renderStudyCard() {
         return;
     }
 
-    const progress = ((currentCardIndex + 1) / currentCards.length * 100).toFixed(0);
+    // Spaced mode counts over the whole session, the queue is loaded in batches
+    const position = studyMode === 'spaced' ? studyPosition + 1 : currentCardIndex + 1;
+    const total = studyMode === 'spaced' ? Math.max(studyTotal, position) : currentCards.length;
+    const progress = (position / total * 100).toFixed(0);
 
     let html = `
         <div class="study-mode-main" style="max-width: 800px; margin: 40px auto; padding: 0 20px;">
             <!-- Progress Header -->
             <div style="text-align: center; margin-bottom: 30px;">
                 <h2 style="margin: 0; font-size: 20px; font-weight: 700; color: var(--accent);">
-                    ${progress}% (${currentCardIndex + 1} / ${currentCards.length})
+                    ${progress}% (${position} / ${total})
                 </h2>
             </div>
             
@@ -377,6 +535,7 @@ function renderStudyCard() {
                             Frage
                         </div>
                         <div class="flashcard-content">
+                            ${card.image_url ? `<img src="${escapeHtml(card.image_url)}" alt="" loading="lazy" style="max-width:100%; max-height:160px; border-radius:12px; margin-bottom:12px; display:block; margin-left:auto; margin-right:auto;">` : ''}
                             ${escapeHtml(card.front)}
                         </div>
                         <div style="position:absolute; bottom:16px; right:16px; color:var(--text-sec); opacity:0.5;">
@@ -660,26 +819,30 @@ async function rateCard(quality) {
     const card = currentCards[currentCardIndex];
 
     if (studyMode === 'spaced') {
-        try {
-            // Map UI ratings to SM-2 quality (0-5)
-            // 1=Again -> 1, 2=Hard -> 2, 3=Good -> 4, 4=Easy -> 5
-            const qualityMap = { 1: 1, 2: 2, 3: 4, 4: 5 };
-            const sm2Quality = qualityMap[quality];
-
-            await fetch(`/api/cards/${card.id}/review`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ quality: sm2Quality })
-            });
-        } catch (error) {
-            console.error('Error rating card:', error);
-        }
+        // Map UI ratings to SM-2 quality (0-5)
+        // 1=Again -> 1, 2=Hard -> 2, 3=Good -> 4, 4=Easy -> 5
+        const qualityMap = { 1: 1, 2: 2, 3: 4, 4: 5 };
+        queueReview(card.id, qualityMap[quality]);
     }
 
     // Next card
     currentCardIndex++;
     isCardFlipped = false;
 
+    if (studyMode === 'spaced') {
+        studyPosition++;
+        if (currentCardIndex >= currentCards.length) {
+            // Batch done: sync the ratings, then ask the queue for more
+            await flushReviews();
+            const batch = await fetchStudyCards();
+            if (batch && batch.cards.length > 0) {
+                currentCards = batch.cards;
+                currentCardIndex = 0;
+                studyTotal = studyPosition + batch.counts.due + batch.counts.new;
+            }
+        }
+    }
+
     if (currentCardIndex >= currentCards.length) {
         endStudySession();
     } else {
@@ -704,6 +867,8 @@ function endStudySession() {
 }
 
 function quitStudySession() {
+    if (studyMode === 'spaced') flushReviews();
+
     // Restore header/sidebar
     const profileBtn = document.querySelector('.profile-btn');
     if (profileBtn && originalHeaderProfileContent) {
@@ -810,6 +975,84 @@ function previewCardById(cardId) {
 // CREATE/EDIT DECK
 // ============================================
 
+// ============================================
+// SCHEDULER SETTINGS (SM-2 / FSRS)
+// ============================================
+
+async function openSchedulerSheet() {
+    let settings;
+    try {
+        const response = await fetch('/api/flashcards/scheduler');
+        settings = await response.json();
+    } catch (error) {
+        showToast('Fehler beim Laden', 'error');
+        return;
+    }
+
+    const retention = Math.round(settings.desired_retention * 100);
+    const sheetContent = `
+        <div class="sheet-header">
+            <h3 style="margin:0; font-size:20px; font-weight:700;">Lernplan</h3>
+            <div class="sheet-close-btn" onclick="closeSheet()">
+                <i data-lucide="x" style="width:20px; height:20px;"></i>
+            </div>
+        </div>
+
+        <div style="margin-top: 20px;">
+            <select class="ios-input" id="scheduler-select">
+                <option value="sm2" ${settings.scheduler === 'sm2' ? 'selected' : ''}>SM-2 (klassisch)</option>
+                <option value="fsrs" ${settings.scheduler === 'fsrs' ? 'selected' : ''}>FSRS (weniger Wiederholungen)</option>
+            </select>
+            <label style="display:block; font-size:14px; color:var(--text-sec); margin:12px 0 6px;">
+                Ziel-Erinnerungsrate (FSRS): <span id="retention-value">${retention}</span>%
+            </label>
+            <input type="range" id="retention-input" min="70" max="97" value="${retention}" style="width:100%;"
+                oninput="document.getElementById('retention-value').textContent = this.value">
+            <p style="font-size:13px; color:var(--text-sec); line-height:1.4;">
+                ${settings.personalized ? 'Deine persönlichen Parameter sind aktiv.' : 'Standard-Parameter.'}
+                ${settings.review_count} Bewertungen gespeichert${settings.can_optimize ? '' : `, ab ${settings.min_reviews_to_optimize} kann FSRS auf dich angepasst werden`}.
+            </p>
+
+            <div class="button-group" style="margin-top: 20px;">
+                ${settings.can_optimize ? '<button class="ios-btn btn-sec btn-small" onclick="optimizeScheduler()">Anpassen</button>' : ''}
+                <button class="ios-btn btn-small" onclick="saveSchedulerSettings()">Speichern</button>
+            </div>
+        </div>
+    `;
+
+    openSheet(sheetContent);
+}
+
+async function saveSchedulerSettings() {
+    const response = await fetch('/api/flashcards/scheduler', {
+        method: 'PUT',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+            scheduler: document.getElementById('scheduler-select').value,
+            desired_retention: parseInt(document.getElementById('retention-input').value) / 100
+        })
+    });
+    const data = await response.json();
+    if (response.ok && data.success) {
+        closeSheet();
+        showToast(data.rescheduled ? `Gespeichert, ${data.rescheduled} Karten neu geplant` : 'Gespeichert', 'success');
+    } else {
+        showToast(data.message || 'Fehler beim Speichern', 'error');
+    }
+}
+
+async function optimizeScheduler() {
+    showToast('Passe Parameter an...', 'info');
+    const response = await fetch('/api/flashcards/scheduler/optimize', { method: 'POST' });
+    const data = await response.json().catch(() => ({}));
+    if (response.ok && data.success) {
+        closeSheet();
+        showToast('Parameter angepasst', 'success');
+    } else {
+        showToast(data.message || 'Anpassung fehlgeschlagen', 'error');
+    }
+}
+
 function openCreateDeckSheet() {
     const sheetContent = `
         <div class="sheet-header">
@@ -1280,12 +1523,24 @@ async function uploadDeckFile(file) {
     if (typeof showToast === 'function') showToast('Importiere Deck...', 'info');
 
     try {
-        const response = await fetch('/api/decks/import', {
-            method: 'POST',
-            body: formData
-        });
-
-        const data = await response.json();
+        let response, data;
+        if (file.size > 8 * 1024 * 1024 && typeof loadScript === 'function') {
+            // Large decks: resumable chunked upload
+            await loadScript('/static/chunked_upload.js');
+            try {
+                data = await chunkedUpload(file, 'deck_import');
+                response = { ok: true };
+            } catch (e) {
+                data = { error: e.message };
+                response = { ok: false };
+            }
+        } else {
+            response = await fetch('/api/decks/import', {
+                method: 'POST',
+                body: formData
+            });
+            data = await response.json();
+        }
 
         if (response.ok && data.success) {
             if (typeof showToast === 'function') {
@@ -105,6 +105,7 @@ const translations = {
         choose_subject: "Fach wählen...",
         title_placeholder: "Titel",
         existing_images: "Vorhandene Bilder - zum Löschen antippen",
+        image_processing: "Bild wird verarbeitet…",
         add_images: "Bilder hinzufügen",
         select_images: "Bilder auswählen...",
         desc_placeholder: "Beschreibung",
@@ -397,6 +398,7 @@ const translations = {
         choose_subject: "Select Subject...",
         title_placeholder: "Title",
         existing_images: "Existing Images - Tap to delete",
+        image_processing: "Processing image…",
         add_images: "Add Images",
         select_images: "Select Images...",
         desc_placeholder: "Description",
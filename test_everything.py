@@ -13,6 +13,7 @@ os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
 os.environ['FLASK_ENV'] = 'testing'
 os.environ['SECRET_KEY'] = 'test-secret'
 os.environ['WTF_CSRF_ENABLED'] = 'false'
+os.environ['IMAGE_POOL_PREFORK'] = 'false'
 
 # Ensure the app can be imported
 sys.path.append(os.getcwd())
@@ -219,6 +220,734 @@ class L8teStudyComprehensiveTest(unittest.TestCase):
         self.assertNotIn(b'CHANGED_IMPRINT', res.data)
         print(" -> Data Integrity Verification: OK")
 
+    def test_08_deck_details_query_count(self):
+        """Deck details must not issue one query per card."""
+        print("\n[STEP 8] Testing Deck Details Query Count...")
+        from sqlalchemy import event
+        from app.models import Deck, Flashcard, CardReview
+
+        with self.app.app_context():
+            deck_user = User(username="deckuser", role=UserRole.SUPER_ADMIN, has_accepted_privacy=True)
+            deck_user.set_password("pass")
+            db.session.add(deck_user)
+            db.session.flush()
+            deck_ids = []
+            for size in (5, 200):
+                deck = Deck(title=f"Deck {size}", user_id=deck_user.id)
+                db.session.add(deck)
+                db.session.flush()
+                cards = [Flashcard(deck_id=deck.id, front=f"Q{i}", back=f"A{i}") for i in range(size)]
+                db.session.add_all(cards)
+                db.session.flush()
+                # First card due, second reviewed for later, the rest new
+                db.session.add(CardReview(user_id=deck_user.id, card_id=cards[0].id,
+                                          next_review_at=datetime.utcnow() - timedelta(days=1)))
+                db.session.add(CardReview(user_id=deck_user.id, card_id=cards[1].id,
+                                          next_review_at=datetime.utcnow() + timedelta(days=3)))
+                deck_ids.append(deck.id)
+            db.session.commit()
+            deck_user_id = deck_user.id
+            engine = db.engine
+
+        # Log in through the session (the login route is rate limited)
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(deck_user_id)
+            sess['_fresh'] = True
+        counts = []
+        for deck_id in deck_ids:
+            statements = []
+            listener = lambda *args: statements.append(args[2])
+            event.listen(engine, 'before_cursor_execute', listener)
+            try:
+                res = self.client.get(f'/api/decks/{deck_id}')
+            finally:
+                event.remove(engine, 'before_cursor_execute', listener)
+            self.assertEqual(res.status_code, 200)
+            counts.append(len(statements))
+        data = json.loads(res.data)
+
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(data['stats'], {'new': 198, 'due': 1, 'total': 200})
+        self.assertEqual([c['is_due'] for c in data['cards'][:3]], [True, False, True])
+        print(f" -> Queries per request: {counts[1]} (5 and 200 cards)")
+    def test_09_backup_chain_restore(self):
+        """Full -> incremental -> restore round-trip, chain checks and journal cleanup."""
+        print("\n[STEP 9] Testing Incremental Backup Chain...")
+        import tempfile
+        from app.backup import write_backup, restore_chain
+        from app.models import ChangeLog, TaskImage, UploadBlob
+        from app.upload_store import blob_key
+
+        tmp = tempfile.mkdtemp()
+        uploads = os.path.join(tmp, 'uploads')
+        os.makedirs(uploads)
+        path = lambda name: os.path.join(tmp, name)
+
+        def add_upload(name, content):
+            with open(os.path.join(uploads, name), 'w') as f:
+                f.write(content)
+
+        with self.app.app_context():
+            student = User.query.filter_by(username="student").first()
+            kept, removed = (Task(user_id=student.id, class_id=self.test_class_id, title=title)
+                             for title in ('Chain kept', 'Chain removed'))
+            key = blob_key('ab' * 32, '.jpg')
+            db.session.add_all([kept, removed, UploadBlob(key=key, digest='ab' * 32, ref_count=0)])
+            db.session.commit()
+            kept_id, removed_id = kept.id, removed.id
+            add_upload('old.txt', 'old')
+
+            write_backup(path('full.zip'), upload_folder=uploads, mode='full')
+            self.assertEqual(ChangeLog.query.count(), 0)
+            print(" -> Journal pruned by full backup: OK")
+
+            # Changes for the first incremental: update, delete, insert, new upload
+            kept.title = 'Chain kept (edited)'
+            db.session.delete(removed)
+            added = Task(user_id=student.id, class_id=self.test_class_id, title='Chain added')
+            db.session.add(added)
+            db.session.commit()
+            added_id = added.id
+            os.remove(os.path.join(uploads, 'old.txt'))
+            add_upload('new.txt', 'new')
+            write_backup(path('inc1.zip'), upload_folder=uploads, mode='incremental')
+
+            # Second incremental: the added task is gone again, an image references the blob
+            db.session.delete(db.session.get(Task, added_id))
+            db.session.add(TaskImage(task_id=kept_id, filename=key))
+            db.session.commit()
+            self.assertEqual(UploadBlob.query.filter_by(key=key).one().ref_count, 1)
+            write_backup(path('inc2.zip'), upload_folder=uploads, mode='incremental')
+            write_backup(path('diff.zip'), upload_folder=uploads, mode='differential')
+            write_backup(path('full2.zip'), upload_folder=uploads, mode='full')
+
+            # Not in any backup
+            db.session.add(Task(user_id=student.id, class_id=self.test_class_id, title='Chain too late'))
+            db.session.commit()
+
+            for chain in (['inc1.zip'], ['full.zip', 'inc2.zip'], ['full2.zip', 'diff.zip']):
+                with self.assertRaises(ValueError):
+                    restore_chain([path(name) for name in chain], uploads)
+                db.session.rollback()
+            print(" -> Broken chains rejected: OK")
+
+            for chain in (['full.zip', 'inc1.zip', 'inc2.zip'], ['full.zip', 'diff.zip']):
+                restore_folder = tempfile.mkdtemp()
+                restore_chain([path(name) for name in chain], restore_folder)
+                db.session.commit()
+                titles = {t.title for t in Task.query.filter(Task.title.like('Chain%'))}
+                self.assertEqual(titles, {'Chain kept (edited)'})
+                self.assertIsNone(db.session.get(Task, removed_id))
+                self.assertEqual(sorted(os.listdir(restore_folder)), ['new.txt'])
+                # The blob row of the full backup still had ref_count 0
+                self.assertEqual(UploadBlob.query.filter_by(key=key).one().ref_count, 1)
+            print(" -> Incremental and differential restore: OK")
+
+    def test_10_review_batch_idempotency(self):
+        """A review batch sent twice (one after the other or at once) is applied once."""
+        print("\n[STEP 10] Testing Review Batch Idempotency...")
+        from unittest import mock
+        from app import spaced_repetition
+        from app.models import Deck, Flashcard, CardReview, ReviewBatch
+
+        with self.app.app_context():
+            user = User(username="batchuser", role=UserRole.STUDENT, has_accepted_privacy=True,
+                        needs_password_change=False)
+            user.set_password("pass")
+            db.session.add(user)
+            db.session.flush()
+            deck = Deck(title="Batch Deck", user_id=user.id)
+            db.session.add(deck)
+            db.session.flush()
+            card = Flashcard(deck_id=deck.id, front="Q", back="A")
+            db.session.add(card)
+            db.session.commit()
+            user_id, card_id = user.id, card.id
+
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(user_id)
+            sess['_fresh'] = True
+        post = lambda key: self.client.post('/api/cards/reviews/batch', data=json.dumps({
+            'idempotency_key': key,
+            'reviews': [{'card_id': card_id, 'quality': 4}]
+        }), content_type='application/json')
+
+        first, second = post('batch-1'), post('batch-1')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(json.loads(first.data)['applied'], 1)
+        self.assertEqual(second.data, first.data)
+        with self.app.app_context():
+            self.assertEqual(CardReview.query.filter_by(user_id=user_id, card_id=card_id).one().review_count, 1)
+        print(" -> Retry returns the stored response: OK")
+
+        # Concurrent duplicate: the other request commits the key while this one applies the reviews
+        apply = spaced_repetition.apply_review_batch
+
+        def apply_while_other_request_commits(*args, **kwargs):
+            result = apply(*args, **kwargs)
+            db.session.add(ReviewBatch(user_id=user_id, idempotency_key='batch-2', response='{"success": true, "applied": 1}'))
+            db.session.commit()
+            return result
+
+        with mock.patch.object(spaced_repetition, 'apply_review_batch', apply_while_other_request_commits):
+            res = post('batch-2')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data), {'success': True, 'applied': 1})
+        print(" -> Concurrent duplicate returns the stored response: OK")
+
+
+    def test_11_fsrs_replay_matches_single_reviews(self):
+        """The vectorized FSRS replay ends in the state the single-review path computed."""
+        print("\n[STEP 11] Testing FSRS Replay...")
+        from app import fsrs, spaced_repetition
+        from app.models import Deck, Flashcard, CardReview, ReviewLog, SchedulerSettings
+
+        start = datetime(2026, 1, 5, 8, 0)
+        histories = [  # (days after start, quality) per card
+            [(0, 4), (3, 4), (13, 1), (13.01, 4), (15, 5)],
+            [(0, 2), (1, 3), (5, 0), (7, 2)],
+            [(2, 5), (20, 4)],
+        ]
+        with self.app.app_context():
+            users = {}
+            for name, role in (('fsrsuser', UserRole.STUDENT), ('fsrsreviewer', UserRole.STUDENT),
+                               ('fsrsadmin', UserRole.SUPER_ADMIN)):
+                users[name] = User(username=name, role=role, has_accepted_privacy=True, needs_password_change=False)
+                users[name].set_password("pass")
+                db.session.add(users[name])
+            db.session.flush()
+            user = users['fsrsuser']
+            settings = SchedulerSettings(user_id=user.id, scheduler='fsrs', desired_retention=0.9)
+            deck = Deck(title="FSRS Deck", user_id=user.id, is_public=True)
+            db.session.add_all([settings, deck])
+            db.session.flush()
+            cards = [Flashcard(deck_id=deck.id, front=f"Q{i}", back="A") for i in range(len(histories) + 1)]
+            db.session.add_all(cards)
+            db.session.flush()
+
+            for card, history in zip(cards, histories):
+                review = spaced_repetition.new_review(user.id, card.id)
+                db.session.add(review)
+                for days, quality in history:
+                    spaced_repetition.record_review(review, quality, start + timedelta(days=days), settings=settings)
+            # Reviewed with SM-2 before the log existed: the replay starts from the logged interval
+            seeded = CardReview(user_id=user.id, card_id=cards[-1].id, interval=6, ease_factor=2.5,
+                                review_count=2, last_review_at=start)
+            db.session.add(seeded)
+            spaced_repetition.record_review(seeded, 4, start + timedelta(days=8), settings=settings)
+            other = spaced_repetition.new_review(users['fsrsreviewer'].id, cards[1].id)
+            db.session.add(other)
+            spaced_repetition.record_review(other, 4, start)
+            db.session.commit()
+            ids = {name: u.id for name, u in users.items()}
+            user_id, deck_id, card_ids = user.id, deck.id, [c.id for c in cards]
+
+            expected = {r.card_id: (r.stability, r.difficulty, r.interval, r.next_review_at)
+                        for r in CardReview.query.filter_by(user_id=user_id)}
+            history = fsrs.load_history(user_id)
+            stability, difficulty, loss, count = fsrs.replay(history, fsrs.DEFAULT_WEIGHTS)
+            self.assertEqual(history.card_ids, card_ids)
+            self.assertEqual(count, 8)  # Reviews at least a day after the card's previous one
+            for i, card_id in enumerate(history.card_ids):
+                self.assertAlmostEqual(stability[0, i], expected[card_id][0], places=9)
+                self.assertAlmostEqual(difficulty[0, i], expected[card_id][1], places=9)
+            print(" -> Replay matches apply_fsrs: OK")
+
+            # Weight vectors replayed side by side do not affect each other
+            perturbed = list(fsrs.DEFAULT_WEIGHTS)
+            perturbed[8] += 0.5
+            both, _, _, _ = fsrs.replay(history, [fsrs.DEFAULT_WEIGHTS, perturbed])
+            alone, _, _, _ = fsrs.replay(history, perturbed)
+            self.assertTrue((both[0] == stability[0]).all())
+            self.assertTrue((both[1] == alone[0]).all())
+
+            self.assertEqual(fsrs.reschedule_user(user_id), len(card_ids))
+            db.session.expire_all()
+            for review in CardReview.query.filter_by(user_id=user_id):
+                s, d, interval, next_review_at = expected[review.card_id]
+                self.assertAlmostEqual(review.stability, s, places=9)
+                self.assertAlmostEqual(review.difficulty, d, places=9)
+                self.assertEqual((review.interval, review.next_review_at), (interval, next_review_at))
+            print(" -> reschedule_user keeps the replayed state: OK")
+
+            trainable = history.trainable()  # Without the seeded card
+            _, _, loss, _ = fsrs.replay(trainable, fsrs.DEFAULT_WEIGHTS)
+            weights, loss_before, loss_after, used = fsrs.fit_weights(trainable, iterations=10)
+            self.assertEqual(len(weights), len(fsrs.DEFAULT_WEIGHTS))
+            self.assertEqual(used, 7)
+            self.assertAlmostEqual(loss_before, loss[0], places=9)
+            self.assertLessEqual(loss_after, loss_before)
+            print(" -> fit_weights does not increase the loss: OK")
+
+        # Deleting a card, a user or a deck removes the review log with it
+        def counts(**filters):
+            with self.app.app_context():
+                return ReviewLog.query.filter_by(**filters).count(), CardReview.query.filter_by(**filters).count()
+
+        def login(name):
+            with self.client.session_transaction() as sess:
+                sess['_user_id'] = str(ids[name])
+                sess['_fresh'] = True
+
+        login('fsrsuser')
+        self.assertEqual(self.client.delete(f'/api/cards/{card_ids[0]}').status_code, 200)
+        self.assertEqual(counts(card_id=card_ids[0]), (0, 0))
+        self.assertEqual(counts(user_id=user_id), (7, 3))
+        login('fsrsadmin')
+        self.assertEqual(self.client.delete(f"/api/admin/users/{ids['fsrsreviewer']}").status_code, 200)
+        self.assertEqual(counts(user_id=ids['fsrsreviewer']), (0, 0))
+        login('fsrsuser')
+        self.assertEqual(self.client.delete(f'/api/decks/{deck_id}/delete').status_code, 200)
+        self.assertEqual(counts(user_id=user_id), (0, 0))
+        print(" -> Card, user and deck deletion remove the review log: OK")
+
+    def test_12_grade_summary_stale_write(self):
+        """A summary computed from grades that change meanwhile is not cached."""
+        print("\n[STEP 12] Testing Grade Summary Invalidation...")
+        from unittest import mock
+        from app import grade_analytics
+        from app.models import GradeSummary
+
+        with self.app.app_context():
+            user = User(username="gradeuser", role=UserRole.STUDENT, has_accepted_privacy=True,
+                        needs_password_change=False)
+            user.set_password("pass")
+            db.session.add(user)
+            db.session.flush()
+            grade = Grade(user_id=user.id, subject="Mathe", value=2.0, weight=1.0, title="KA",
+                          date=datetime(2026, 9, 1))
+            db.session.add(grade)
+            db.session.commit()
+            user_id, grade_id = user.id, grade.id
+
+            compute = grade_analytics.compute_summary
+
+            def compute_while_grade_changes(value):
+                def wrapper(uid):
+                    summary = compute(uid)
+                    # Another request changes the grade after this one read the grades
+                    Grade.query.get(grade_id).value = value
+                    grade_analytics.invalidate(uid)
+                    db.session.commit()
+                    return summary
+                return wrapper
+
+            def average():
+                return grade_analytics.get_summary(user_id)['overall_average']
+
+            def cached():
+                return GradeSummary.query.filter_by(user_id=user_id).one()
+
+            # No cached row yet
+            with mock.patch.object(grade_analytics, 'compute_summary', compute_while_grade_changes(4.0)):
+                self.assertEqual(average(), 2.0)
+            self.assertIsNone(cached().data)
+            self.assertEqual(average(), 4.0)
+            with mock.patch.object(grade_analytics, 'compute_summary', side_effect=AssertionError):
+                self.assertEqual(average(), 4.0)
+            print(" -> Stale first summary not stored: OK")
+
+            # Cached row invalidated by an earlier change
+            grade_analytics.invalidate(user_id)
+            db.session.commit()
+            with mock.patch.object(grade_analytics, 'compute_summary', compute_while_grade_changes(5.0)):
+                self.assertEqual(average(), 4.0)
+            self.assertIsNone(cached().data)
+            self.assertEqual(cached().version, 3)
+            self.assertEqual(average(), 5.0)
+            self.assertIsNotNone(cached().data)
+            print(" -> Stale summary not stored over an invalidation: OK")
+
+    def test_13_task_completion_and_read_rows(self):
+        """Per-user task rows are created once, also when two requests create them at once."""
+        print("\n[STEP 13] Testing Task Completion and Chat Read Rows...")
+        from flask_login import login_user
+        from app import routes
+        from app.models import TaskCompletion, TaskChatRead
+
+        with self.app.app_context():
+            user = User(username="taskrowuser", role=UserRole.STUDENT, class_id=self.test_class_id,
+                        has_accepted_privacy=True, needs_password_change=False)
+            user.set_password("pass")
+            db.session.add(user)
+            db.session.flush()
+            task = Task(user_id=user.id, class_id=self.test_class_id, title="Rows")
+            db.session.add(task)
+            db.session.commit()
+            user_id, task_id = user.id, task.id
+
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(user_id)
+            sess['_fresh'] = True
+        toggle = lambda: json.loads(self.client.post(f'/api/tasks/{task_id}/toggle').data)['is_done']
+        self.assertEqual((toggle(), toggle()), (True, False))
+        res = self.client.put(f'/api/tasks/{task_id}', data=json.dumps({'is_done': True}),
+                              content_type='application/json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.client.post(f'/api/tasks/{task_id}/read').status_code, 200)
+        self.assertEqual(self.client.post(f'/api/tasks/{task_id}/read').status_code, 200)
+        with self.app.app_context():
+            self.assertTrue(TaskCompletion.query.filter_by(user_id=user_id, task_id=task_id).one().is_done)
+            self.assertEqual(TaskChatRead.query.filter_by(user_id=user_id, task_id=task_id).count(), 1)
+        print(" -> Toggle, update and read mark: OK")
+
+        # Another request creates the row between this one's read and its commit
+        with self.app.test_request_context():
+            login_user(db.session.get(User, user_id))
+            TaskChatRead.query.filter_by(user_id=user_id, task_id=task_id).delete()
+            db.session.commit()
+            read_at = datetime(2026, 10, 1, 12, 0)
+            rows = []
+
+            def mark_read(row):
+                if not rows:
+                    db.session.expunge(row)
+                    db.session.add(TaskChatRead(user_id=user_id, task_id=task_id, last_read_at=read_at))
+                    db.session.commit()
+                    db.session.add(row)
+                rows.append(row)
+                row.last_read_at = read_at + timedelta(hours=1)
+
+            saved = routes.save_user_task_row(TaskChatRead, task_id, mark_read)
+            self.assertEqual(len(rows), 2)
+            self.assertIsNot(rows[0], rows[1])
+            stored = TaskChatRead.query.filter_by(user_id=user_id, task_id=task_id).one()
+            self.assertEqual((stored.id, stored.last_read_at), (saved.id, read_at + timedelta(hours=1)))
+        print(" -> Concurrently created row is updated: OK")
+
+    def test_14_missing_optional_integrations(self):
+        """Without pywebpush nothing counts as sent; without webuntis the import answers 501."""
+        print("\n[STEP 14] Testing Missing Optional Integrations...")
+        from unittest import mock
+        from app import integrations, notifications
+        from app.models import PushSubscription
+
+        def unavailable(name):
+            raise integrations.IntegrationUnavailable(f"{name} missing")
+
+        with self.app.app_context():
+            user = User(username="pushuser", role=UserRole.SUPER_ADMIN, has_accepted_privacy=True,
+                        needs_password_change=False)
+            user.set_password("pass")
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(PushSubscription(user_id=user.id, endpoint="https://push.example/1",
+                                            auth_key="a", p256dh_key="p"))
+            db.session.commit()
+            user_id = user.id
+
+            with mock.patch.object(integrations, 'load', side_effect=unavailable):
+                self.assertIsNone(notifications.send_web_push({'endpoint': 'https://push.example/1'}, {}))
+                self.assertFalse(notifications.notify_user(user, "Titel", "Text"))
+            self.assertEqual(PushSubscription.query.filter_by(user_id=user_id).count(), 1)
+            print(" -> Push without pywebpush not counted as sent: OK")
+
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(user_id)
+            sess['_fresh'] = True
+        with mock.patch.object(integrations, 'load', side_effect=unavailable):
+            res = self.client.post('/api/untis/import-subjects', data=json.dumps({'class_id': self.test_class_id}),
+                                   content_type='application/json')
+        self.assertEqual(res.status_code, 501)
+        self.assertFalse(json.loads(res.data)['success'])
+        print(" -> Untis import without webuntis returns 501: OK")
+
+        from app.drive_oauth_client import DriveOAuthClient
+        request = mock.Mock()
+        request.execute.side_effect = ValueError("original error")
+        with self.app.app_context(), \
+                mock.patch.object(integrations, 'load', side_effect=unavailable), \
+                mock.patch.object(integrations, 'is_loaded', return_value=False):
+            with self.assertRaises(ValueError):
+                DriveOAuthClient()._execute_with_retry(request)
+        print(" -> Drive errors without the google libraries keep the original exception: OK")
+
+    def test_15_gc_after_restore(self):
+        """Files of rows outside the backup survive a restore and the next garbage collection."""
+        print("\n[STEP 15] Testing Upload GC After Restore...")
+        import time
+        import tempfile
+        from unittest import mock
+        from app import upload_store
+        from app.backup import write_backup, restore_chain
+        from app.models import Deck, Flashcard, TimetableImage, UploadBlob
+
+        tmp = tempfile.mkdtemp()
+        uploads = os.path.join(tmp, 'uploads')
+        os.makedirs(uploads)
+        with self.app.app_context(), mock.patch.dict(self.app.config, {'UPLOAD_FOLDER': uploads}):
+            write_backup(os.path.join(tmp, 'old.zip'), upload_folder=uploads, mode='full')
+
+            keys = []
+            for content in (b'timetable', b'anki card'):
+                source = os.path.join(tmp, 'source.png')
+                with open(source, 'wb') as f:
+                    f.write(content)
+                keys.append(upload_store.store_file(source, '.png')[0])
+            student = User.query.filter_by(username="student").first()
+            deck = Deck(title="GC Deck", user_id=student.id)
+            db.session.add_all([deck, TimetableImage(class_id=self.test_class_id, image_path=keys[0])])
+            db.session.flush()
+            db.session.add(Flashcard(deck_id=deck.id, front="Q", back="A", image_url=upload_store.URL_PREFIX + keys[1]))
+            db.session.commit()
+            old = time.time() - 2 * upload_store.GC_GRACE.total_seconds()
+            for key in keys:
+                os.utime(os.path.join(uploads, key), (old, old))
+
+            # timetable_image and flashcard are not in the backup: their rows stay, the blob rows go
+            restore_chain([os.path.join(tmp, 'old.zip')], uploads)
+            db.session.commit()
+            blobs = {b.key: b.ref_count for b in UploadBlob.query.filter(UploadBlob.key.in_(keys))}
+            self.assertEqual(blobs, {key: 1 for key in keys})
+            for key in keys:
+                self.assertTrue(os.path.exists(os.path.join(uploads, key)))
+            print(" -> Restore keeps referenced files and recreates their blob rows: OK")
+
+            UploadBlob.query.filter(UploadBlob.key.in_(keys)).delete(synchronize_session=False)
+            db.session.commit()
+            upload_store.collect_garbage()
+            for key in keys:
+                self.assertTrue(os.path.exists(os.path.join(uploads, key)))
+            self.assertEqual(UploadBlob.query.filter(UploadBlob.key.in_(keys)).count(), 2)
+            print(" -> Referenced files kept by the garbage collection: OK")
+
+    def test_16_scheduled_backup_outside_chain(self):
+        """A scheduled server-side backup is no base for downloaded incremental backups."""
+        print("\n[STEP 16] Testing Scheduled Backup and Download Chain...")
+        import tempfile
+        from app.backup import write_backup, find_backup_base
+        from app.backup_job import write_archive
+        from app.models import BackupRecord, ChangeLog
+
+        tmp = tempfile.mkdtemp()
+        with self.app.app_context():
+            write_backup(os.path.join(tmp, 'download.zip'), mode='full')
+            base = find_backup_base('incremental').backup_id
+            student = User.query.filter_by(username="student").first()
+            db.session.add(Task(user_id=student.id, class_id=self.test_class_id, title='After download'))
+            db.session.commit()
+            journal = ChangeLog.query.count()
+            self.assertGreater(journal, 0)
+            records = BackupRecord.query.count()
+
+            write_archive(os.path.join(tmp, 'scheduled.zip'))
+            self.assertEqual(BackupRecord.query.count(), records)
+            self.assertEqual(find_backup_base('incremental').backup_id, base)
+            self.assertEqual(find_backup_base('differential').backup_id, base)
+            self.assertEqual(ChangeLog.query.count(), journal)
+            print(" -> Downloaded chain unaffected: OK")
+
+    def test_17_zstd_backup_restore(self):
+        """Scheduled zstd archives (.zip.zst) restore through the upload and the chain path."""
+        print("\n[STEP 17] Testing zstd Backup Restore...")
+        import tempfile
+        from werkzeug.datastructures import FileStorage
+        from app import routes
+        from app.backup import restore_chain
+        from app.backup_job import write_archive, verify_archive
+
+        tmp = tempfile.mkdtemp()
+        path = os.path.join(tmp, 'scheduled.zip.zst')
+        with self.app.app_context():
+            student = User.query.filter_by(username="student").first()
+            task = Task(user_id=student.id, class_id=self.test_class_id, title='zstd kept')
+            db.session.add(task)
+            db.session.commit()
+            task_id = task.id
+            write_archive(path, 'zstd')
+            verify_archive(path)
+
+            for restore in (
+                lambda: restore_chain([path], tempfile.mkdtemp()),
+                lambda: routes.perform_restore(FileStorage(open(path, 'rb'), filename='scheduled.zip.zst'),
+                                               {'UPLOAD_FOLDER': tempfile.mkdtemp()}),
+            ):
+                db.session.get(Task, task_id).title = 'zstd changed'
+                db.session.commit()
+                result = restore()
+                if result is not None:
+                    self.assertEqual(result, (True, "Restore successful"))
+                db.session.commit()
+                db.session.expire_all()
+                self.assertEqual(db.session.get(Task, task_id).title, 'zstd kept')
+            print(" -> .zip.zst restored by restore_chain and the upload: OK")
+
+    def test_18_shared_incoming_file_race(self):
+        """Two jobs for one incoming file: the one that finds it gone still succeeds."""
+        print("\n[STEP 18] Testing Concurrent Image Jobs...")
+        import tempfile
+        from unittest import mock
+        from PIL import Image
+        from app import image_queue
+
+        tmp = tempfile.mkdtemp()
+        src = os.path.join(tmp, 'incoming.png')
+        dest = os.path.join(tmp, 'image.png')
+        Image.new('RGB', (8, 8), 'red').save(src)
+        self.assertTrue(image_queue.process_image_file(src, dest))
+
+        # The other job removes the shared file right after this one replaced dest
+        real_replace = os.replace
+        def replace_then_lose_src(a, b):
+            real_replace(a, b)
+            os.remove(src)
+        Image.new('RGB', (8, 8), 'red').save(src)
+        with mock.patch.object(image_queue.os, 'replace', side_effect=replace_then_lose_src):
+            self.assertTrue(image_queue.process_image_file(src, dest))
+        print(" -> incoming file removed by the other job after replace: OK")
+
+        # The other job finished between the existence check and opening the file
+        def lose_src(path):
+            os.remove(path)
+            raise FileNotFoundError(path)
+        Image.new('RGB', (8, 8), 'red').save(src)
+        with mock.patch('PIL.Image.open', side_effect=lose_src):
+            self.assertTrue(image_queue.process_image_file(src, dest))
+        self.assertTrue(os.path.exists(dest))
+        print(" -> incoming file gone before processing: OK")
+
+    def test_19_legacy_upload_sources_skip_listing(self):
+        """srcset lookup for legacy flat uploads does not list the upload folder."""
+        print("\n[STEP 19] Testing Legacy Upload Sources...")
+        from unittest import mock
+        from app import routes, image_queue, image_variants
+
+        with self.app.test_request_context(), \
+                mock.patch.object(image_queue, 'variant_formats', return_value=('webp',)), \
+                mock.patch.object(image_variants.os, 'listdir', return_value=[]) as listdir:
+            self.assertEqual(routes.image_sources('1700000000_photo.jpg'), {})
+            listdir.assert_not_called()
+            routes.image_sources('ab/cd/' + 'ab' * 32 + '.jpg')
+            self.assertEqual(listdir.call_count, 1)
+        print(" -> legacy name answered without os.listdir: OK")
+
+    def test_20_drive_thumbnail_failures_cached(self):
+        """Undecodable image types get no thumbnail; failed renders are not downloaded again."""
+        print("\n[STEP 20] Testing Drive Thumbnail Failures...")
+        import tempfile
+        from unittest import mock
+        from app import drive_thumbnails
+
+        self.assertFalse(drive_thumbnails.is_thumbnailable({'mimeType': 'image/svg+xml'}))
+        self.assertFalse(drive_thumbnails.is_thumbnailable({'mimeType': 'image/heic'}))
+        self.assertTrue(drive_thumbnails.is_thumbnailable({'mimeType': 'image/png'}))
+        print(" -> only Pillow-decodable image types: OK")
+
+        client = mock.Mock()
+        client.download_file.return_value = b'not a png'
+        meta = {'id': 'broken', 'mimeType': 'image/png', 'md5Checksum': 'ab' * 16}
+        with self.app.app_context(), \
+                mock.patch.dict(self.app.config, {'DRIVE_THUMBNAIL_FOLDER': tempfile.mkdtemp()}):
+            self.assertIsNone(drive_thumbnails.get_or_create_thumbnail(client, meta))
+            self.assertIsNone(drive_thumbnails.get_or_create_thumbnail(client, meta))
+        self.assertEqual(client.download_file.call_count, 1)
+        print(" -> failed render remembered: OK")
+
+    def test_21_anki_import(self):
+        """Legacy and anki21b packages import cards, media and scheduling; oversized ones are rejected."""
+        print("\n[STEP 21] Testing Anki Import...")
+        import io
+        import sqlite3
+        import zipfile
+        import tempfile
+        import zstandard
+        from unittest import mock
+        from PIL import Image
+        from app import anki_import, upload_store
+        from app.models import Flashcard, CardReview, ReviewLog, UploadBlob
+
+        crt = 1_600_000_000
+        tmp = tempfile.mkdtemp()
+        collection_path = os.path.join(tmp, 'collection.db')
+        conn = sqlite3.connect(collection_path)
+        conn.executescript("""
+            CREATE TABLE col (id INTEGER PRIMARY KEY, crt INTEGER);
+            CREATE TABLE notes (id INTEGER PRIMARY KEY, flds TEXT);
+            CREATE TABLE cards (id INTEGER PRIMARY KEY, nid INTEGER, ord INTEGER, type INTEGER, queue INTEGER,
+                                due INTEGER, ivl INTEGER, factor INTEGER, reps INTEGER, data TEXT);
+            CREATE TABLE revlog (id INTEGER PRIMARY KEY, cid INTEGER, ease INTEGER, lastIvl INTEGER, type INTEGER);
+        """)
+        conn.execute("INSERT INTO col VALUES (1, ?)", (crt,))
+        conn.executemany("INSERT INTO notes VALUES (?, ?)", [
+            (1, 'Hund<img src="pic.png">\x1fdog'),
+            (2, '{{c1::Berlin}} ist die Hauptstadt<img src="pic.png">\x1f'),
+        ])
+        conn.executemany("INSERT INTO cards VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", [
+            (11, 1, 0, 2, 2, 100, 10, 2500, 3, '{"s": 12.5, "d": 4.2}'),
+            (12, 2, 0, 0, 0, 1, 0, 0, 0, ''),
+        ])
+        conn.executemany("INSERT INTO revlog VALUES (?, ?, ?, ?, ?)", [
+            ((crt + 86400) * 1000, 11, 3, 0, 0),
+            ((crt + 5 * 86400) * 1000, 11, 3, 4, 1),
+            ((crt + 9 * 86400) * 1000, 11, 0, 10, 4),  # Manual reschedule, not a review
+        ])
+        conn.commit()
+        conn.close()
+        with open(collection_path, 'rb') as f:
+            collection = f.read()
+        picture = io.BytesIO()
+        Image.new('RGB', (4, 4), 'blue').save(picture, 'PNG')
+        picture = picture.getvalue()
+
+        def varint(value):
+            out = bytearray()
+            while True:
+                byte, value = value & 0x7f, value >> 7
+                out.append(byte | (0x80 if value else 0))
+                if not value:
+                    return bytes(out)
+
+        def apkg(modern):
+            buf = io.BytesIO()
+            with zipfile.ZipFile(buf, 'w') as z:
+                if modern:
+                    zstd = zstandard.ZstdCompressor()
+                    name = b'pic.png'
+                    # MediaEntry: name (1), size (2), legacy zip member (255)
+                    entry = b'\x0a' + varint(len(name)) + name + b'\x10' + varint(len(picture)) + varint(255 << 3) + varint(0)
+                    z.writestr('collection.anki21b', zstd.compress(collection))
+                    z.writestr('collection.anki2', b'dummy collection of new exports')
+                    z.writestr('media', zstd.compress(b'\x0a' + varint(len(entry)) + entry))
+                    z.writestr('0', zstd.compress(picture))
+                else:
+                    z.writestr('collection.anki2', collection)
+                    z.writestr('media', json.dumps({'0': 'pic.png'}))
+                    z.writestr('0', picture)
+            buf.seek(0)
+            return buf
+
+        with self.app.app_context():
+            student = User.query.filter_by(username="student").first()
+            for modern in (False, True):
+                with mock.patch.dict(self.app.config, {'UPLOAD_FOLDER': tempfile.mkdtemp()}):
+                    result = anki_import.import_apkg(apkg(modern), student.id, 'Anki')
+                    self.assertEqual((result.cards, result.reviews, result.media), (2, 1, 1))
+
+                    cards = Flashcard.query.filter_by(deck_id=result.deck_id).order_by(Flashcard.id).all()
+                    self.assertEqual([c.front for c in cards], ['Hund', '[...] ist die Hauptstadt'])
+                    self.assertEqual(cards[1].back, 'Berlin ist die Hauptstadt')
+                    key = upload_store.upload_name(cards[0].image_url)
+                    self.assertTrue(upload_store.is_blob_key(key))
+                    self.assertEqual(cards[1].image_url, cards[0].image_url)
+                    self.assertEqual(UploadBlob.query.filter_by(key=key).one().ref_count, 2)
+                    self.assertTrue(os.path.exists(os.path.join(self.app.config['UPLOAD_FOLDER'], key)))
+
+                    review = CardReview.query.filter_by(card_id=cards[0].id).one()
+                    self.assertEqual(review.next_review_at, datetime.utcfromtimestamp(crt) + timedelta(days=100))
+                    self.assertEqual((review.interval, review.ease_factor, review.review_count), (10.0, 2.5, 3))
+                    self.assertEqual((review.stability, review.difficulty), (12.5, 4.2))
+                    self.assertIsNone(CardReview.query.filter_by(card_id=cards[1].id).first())
+                    logs = ReviewLog.query.filter_by(card_id=cards[0].id).order_by(ReviewLog.reviewed_at).all()
+                    self.assertEqual([(l.rating, l.elapsed_days) for l in logs], [(4, None), (4, 4.0)])
+                    db.session.rollback()
+                print(f" -> {'anki21b (zstd, protobuf media)' if modern else 'anki2 (JSON media)'} imported: OK")
+
+            with mock.patch.dict(self.app.config, {'UPLOAD_FOLDER': tempfile.mkdtemp()}):
+                with self.assertRaises(anki_import.AnkiImportError):
+                    anki_import.import_apkg(apkg(True), student.id, 'Anki', max_size=len(collection) - 1)
+                db.session.rollback()
+            print(" -> oversized collection rejected: OK")
+
 if __name__ == '__main__':
     print("="*60)
     print(" L8TESTUDY - FULL SYSTEM AUDIT TOOL ")
@@ -0,0 +1,156 @@
+import sys
+import os
+import unittest
+import logging
+from datetime import datetime
+
+logging.basicConfig(level=logging.ERROR)
+
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['FLASK_ENV'] = 'testing'
+os.environ['SECRET_KEY'] = 'test-secret'
+os.environ['SCHEDULER_ENABLED'] = 'false'
+os.environ['IMAGE_POOL_PREFORK'] = 'false'
+
+sys.path.append(os.getcwd())
+from sqlalchemy import event
+from app import create_app, db
+from app.models import (Task, TaskCompletion, TaskMessage, TaskChatRead, Event, AuditLog,
+                        PushSubscription, CardReview, DriveFolder, Subject, SchoolClass)
+
+
+class QueryPlanTest(unittest.TestCase):
+    """The hot queries must keep using their indexes (EXPLAIN QUERY PLAN on SQLite)"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = create_app()
+        cls.app.config['TESTING'] = True
+        cls.ctx = cls.app.app_context()
+        cls.ctx.push()
+        db.create_all()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.ctx.pop()
+
+    def plan(self, run):
+        """Run the query and return the plan of the last statement it executed"""
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            run()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+        statement, parameters = statements[-1]
+        rows = db.session.connection().exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)
+        return '\n'.join(row[-1] for row in rows)
+
+    def assertUsesIndex(self, plan, index):
+        self.assertIn(index, plan, plan)
+
+    def assertNoScan(self, plan, table):
+        for line in plan.splitlines():
+            self.assertFalse(line.startswith(f'SCAN {table}') and 'INDEX' not in line, plan)
+
+    def test_task_listing(self):
+        plan = self.plan(lambda: Task.query.filter(
+            Task.deleted_at.is_(None),
+            db.or_(
+                Task.class_id == 1,
+                db.and_(
+                    Task.is_shared == True,
+                    Task.subject_id.in_(
+                        db.session.query(Subject.id).join(Subject.classes).filter(SchoolClass.id == 1)
+                    )
+                )
+            )
+        ).order_by(Task.due_date).all())
+        self.assertIn('MULTI-INDEX OR', plan)
+        self.assertUsesIndex(plan, 'ix_task_class_live_due')
+        self.assertUsesIndex(plan, 'ix_task_subject_live')
+        self.assertNoScan(plan, 'task')
+
+    def test_all_tasks(self):
+        plan = self.plan(lambda: Task.query.filter(Task.deleted_at.is_(None)).order_by(Task.due_date).all())
+        self.assertUsesIndex(plan, 'ix_task_live_due')
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_task_reminder(self):
+        plan = self.plan(lambda: Task.query.filter(Task.class_id == 1, Task.deleted_at.is_(None)).all())
+        self.assertUsesIndex(plan, 'ix_task_class_live_due')
+
+    def test_task_completion(self):
+        plan = self.plan(lambda: TaskCompletion.query.filter_by(user_id=1, task_id=1).first())
+        self.assertUsesIndex(plan, 'sqlite_autoindex_task_completion')
+
+    def test_task_chat_read(self):
+        plan = self.plan(lambda: TaskChatRead.query.filter_by(user_id=1, task_id=1).first())
+        self.assertUsesIndex(plan, 'sqlite_autoindex_task_chat_read')
+
+    def test_unread_chat_count(self):
+        plan = self.plan(lambda: TaskMessage.query.filter(
+            TaskMessage.task_id == 1, TaskMessage.created_at > datetime(1970, 1, 1)
+        ).count())
+        self.assertUsesIndex(plan, 'ix_task_message_task_created')
+
+    def test_task_chat(self):
+        plan = self.plan(lambda: TaskMessage.query.filter_by(task_id=1).order_by(TaskMessage.created_at).all())
+        self.assertUsesIndex(plan, 'ix_task_message_task_created')
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_event_listing(self):
+        plan = self.plan(lambda: Event.query.filter(
+            Event.deleted_at.is_(None),
+            db.or_(
+                Event.class_id == 1,
+                db.and_(
+                    Event.is_shared == True,
+                    Event.subject_id.in_(
+                        db.session.query(Subject.id).join(Subject.classes).filter(SchoolClass.id == 1)
+                    )
+                )
+            )
+        ).order_by(Event.date).all())
+        self.assertIn('MULTI-INDEX OR', plan)
+        self.assertUsesIndex(plan, 'ix_event_class_live_date')
+        self.assertUsesIndex(plan, 'ix_event_subject_live')
+        self.assertNoScan(plan, 'event')
+
+    def test_event_reminder(self):
+        plan = self.plan(lambda: Event.query.filter(
+            db.func.date(Event.date) == datetime.utcnow().date(), Event.class_id == 1, Event.deleted_at.is_(None)
+        ).all())
+        self.assertUsesIndex(plan, 'ix_event_class_live_date')
+
+    def test_all_events(self):
+        plan = self.plan(lambda: Event.query.filter(Event.deleted_at.is_(None)).order_by(Event.date).all())
+        self.assertUsesIndex(plan, 'ix_event_live_date')
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_audit_log(self):
+        plan = self.plan(lambda: AuditLog.query.filter_by(class_id=1).order_by(AuditLog.timestamp.desc()).limit(100).all())
+        self.assertUsesIndex(plan, 'ix_audit_log_class_timestamp')
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_push_subscriptions(self):
+        plan = self.plan(lambda: PushSubscription.query.filter_by(user_id=1).all())
+        self.assertUsesIndex(plan, 'ix_push_subscription_user_id')
+
+    def test_due_cards(self):
+        plan = self.plan(lambda: CardReview.query.filter(
+            CardReview.user_id == 1, CardReview.next_review_at <= datetime.utcnow()
+        ).order_by(CardReview.next_review_at).all())
+        self.assertUsesIndex(plan, 'ix_card_review_user_next_review')
+
+    def test_drive_folder(self):
+        plan = self.plan(lambda: DriveFolder.query.filter_by(folder_id='abc').all())
+        self.assertUsesIndex(plan, 'ix_drive_folder_folder_id')
+
+
+if __name__ == '__main__':
+    unittest.main()